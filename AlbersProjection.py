@@ -0,0 +1,141 @@
+# Albers Projection
+# Projects longitude/latitude columns to Albers Equal Area Conic coordinates and back, on the ellipsoid, with plain array math.
+# The formulas are Snyder's (Map Projections - A Working Manual, USGS Professional Paper 1395, pp. 101-102). The inverse finds the latitude by Newton iteration.
+# Large columns are split into blocks which are projected on several threads at once. NumPy releases the GIL inside its array operations, so the threads run in parallel.
+# The parameters are read from an ESRI WKT string, such as the Alaska Albers definition the DataProcessor projects to.
+import re
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BLOCK_SIZE = 262144 # Points projected at once by one thread
+MAX_ITERATIONS = 15 # Newton iterations allowed for the inverse latitude
+CONVERGENCE = 1e-12 # Radians. The inverse stops iterating once every latitude moves less than this
+TOLERANCE = 0.0005 # Metres. The largest error validate() accepts
+
+# Points with known Alaska Albers (NAD83, EPSG:3338) coordinates, as ( longitude, latitude, x, y ). Computed with PROJ 9
+ALASKA_ALBERS_REFERENCE = ( ( -154.0, 50.0, 0.00000, 0.00000 ),
+							( -154.0, 65.0, 0.00000, 1671054.57844 ),
+							( -130.0, 54.5, 1522319.18280, 776578.59397 ),
+							( -141.0, 60.0, 718053.78324, 1182796.22978 ),
+							( -165.5, 62.0, -597545.70895, 1387840.25287 ),
+							( -179.9, 51.5, -1763439.46286, 513940.40323 ),
+							( 172.5, 52.9, -2166832.19526, 879136.43196 ),
+							( -150.0, 70.5, 151956.76360, 2284180.68640 ),
+							( -147.7, 64.8, 298872.77436, 1662939.15738 ),
+							( -160.0, 58.0, -353252.92793, 904692.27184 ) )
+
+class ProjectionAccuracyException( Exception ):
+	def __init__( self, error, tolerance ):
+		self.error = error
+		self.tolerance = tolerance
+
+	def __str__( self ):
+		return "Projection is off by %g m at a reference point, more than the %g m allowed" % ( self.error, self.tolerance )
+
+class AlbersEqualArea( object ):
+	# @param a = The semi-major axis of the ellipsoid, in metres
+	# @param inverse_flattening = The inverse flattening of the ellipsoid
+	# @param central_meridian, standard_parallel_1, standard_parallel_2, latitude_of_origin = In degrees
+	def __init__( self, a, inverse_flattening, central_meridian, standard_parallel_1, standard_parallel_2, latitude_of_origin, false_easting=0.0, false_northing=0.0 ):
+		self.a = a
+		f = 1.0 / inverse_flattening
+		self.e2 = 2.0 * f - f * f
+		self.e = math.sqrt( self.e2 )
+		self.lon0 = math.radians( central_meridian )
+		self.false_easting = false_easting
+		self.false_northing = false_northing
+		( phi1, phi2, phi0 ) = ( math.radians( standard_parallel_1 ), math.radians( standard_parallel_2 ), math.radians( latitude_of_origin ) )
+		( m1, m2 ) = ( self.m( phi1 ), self.m( phi2 ) )
+		( q1, q2 ) = ( self.q( phi1 ), self.q( phi2 ) )
+		if phi1 == phi2:
+			self.n = math.sin( phi1 )
+		else:
+			self.n = ( m1 * m1 - m2 * m2 ) / ( q2 - q1 )
+		self.C = m1 * m1 + self.n * q1
+		self.rho0 = self.a * math.sqrt( self.C - self.n * self.q( phi0 ) ) / self.n
+
+	# Builds the projection from an ESRI WKT string with PROJECTION['Albers']
+	@classmethod
+	def fromWKT( cls, wkt ):
+		if not re.search( r"PROJECTION\[['\"]Albers", wkt ):
+			raise ValueError( "Not an Albers projection: %s" % wkt )
+		spheroid = re.search( r"SPHEROID\[['\"][^'\"]*['\"],([-0-9.eE+]+),([-0-9.eE+]+)", wkt )
+		parameters = dict( ( name.lower(), float( value ) ) for ( name, value ) in re.findall( r"PARAMETER\[['\"]([^'\"]+)['\"],([-0-9.eE+]+)\]", wkt ) )
+		return cls( float( spheroid.group( 1 ) ), float( spheroid.group( 2 ) ), parameters['central_meridian'], parameters['standard_parallel_1'],
+					parameters['standard_parallel_2'], parameters['latitude_of_origin'], parameters.get( 'false_easting', 0.0 ), parameters.get( 'false_northing', 0.0 ) )
+
+	# Snyder's m (eq. 14-15). Works on floats and arrays alike
+	def m( self, phi ):
+		sin_phi = np.sin( phi )
+		return np.cos( phi ) / np.sqrt( 1.0 - self.e2 * sin_phi * sin_phi )
+
+	# Snyder's q (eq. 3-12)
+	def q( self, phi ):
+		e_sin = self.e * np.sin( phi )
+		return ( 1.0 - self.e2 ) * ( np.sin( phi ) / ( 1.0 - e_sin * e_sin ) - np.log( ( 1.0 - e_sin ) / ( 1.0 + e_sin ) ) / ( 2.0 * self.e ) )
+
+	# Projects longitudes and latitudes (degrees) to x and y (metres)
+	def forwardBlock( self, lon, lat ):
+		phi = np.radians( np.asarray( lat, dtype=np.float64 ) )
+		# Longitudes are measured from the central meridian, wrapped into -180..180 so that points across the antimeridian stay together
+		dlon = np.remainder( np.radians( np.asarray( lon, dtype=np.float64 ) ) - self.lon0 + math.pi, 2.0 * math.pi ) - math.pi
+		rho = self.a * np.sqrt( self.C - self.n * self.q( phi ) ) / self.n
+		theta = self.n * dlon
+		return ( rho * np.sin( theta ) + self.false_easting, self.rho0 - rho * np.cos( theta ) + self.false_northing )
+
+	# Converts x and y (metres) back to longitudes and latitudes (degrees)
+	def inverseBlock( self, x, y ):
+		x = np.asarray( x, dtype=np.float64 ) - self.false_easting
+		y = self.rho0 - ( np.asarray( y, dtype=np.float64 ) - self.false_northing )
+		if self.n < 0:
+			( x, y ) = ( -x, -y )
+		rho = np.hypot( x, y )
+		theta = np.arctan2( x, y )
+		q = ( self.C - rho * rho * self.n * self.n / ( self.a * self.a ) ) / self.n
+		phi = np.arcsin( np.clip( q / 2.0, -1.0, 1.0 ) )
+		for iteration in range( 0, MAX_ITERATIONS ):
+			sin_phi = np.sin( phi )
+			e_sin = self.e * sin_phi
+			one_less = 1.0 - e_sin * e_sin
+			step = one_less * one_less / ( 2.0 * np.cos( phi ) ) * ( q / ( 1.0 - self.e2 ) - sin_phi / one_less + np.log( ( 1.0 - e_sin ) / ( 1.0 + e_sin ) ) / ( 2.0 * self.e ) )
+			phi = phi + step
+			if np.all( np.abs( step ) < CONVERGENCE ):
+				break
+		lon = np.degrees( self.lon0 + theta / self.n )
+		# Back into -180..180
+		lon = np.remainder( lon + 180.0, 360.0 ) - 180.0
+		return ( lon, np.degrees( phi ) )
+
+	def forward( self, lon, lat, workers=1 ):
+		return self.inParallel( self.forwardBlock, lon, lat, workers )
+
+	def inverse( self, x, y, workers=1 ):
+		return self.inParallel( self.inverseBlock, x, y, workers )
+
+	# Applies function to a pair of columns in blocks of BLOCK_SIZE, on up to workers threads at once
+	def inParallel( self, function, A, B, workers ):
+		A = np.asarray( A, dtype=np.float64 )
+		B = np.asarray( B, dtype=np.float64 )
+		if workers <= 1 or len( A ) <= BLOCK_SIZE:
+			return function( A, B )
+		starts = range( 0, len( A ), BLOCK_SIZE )
+		with ThreadPoolExecutor( workers ) as pool:
+			blocks = list( pool.map( lambda start: function( A[start:start + BLOCK_SIZE], B[start:start + BLOCK_SIZE] ), starts ) )
+		return ( np.concatenate( [block[0] for block in blocks] ), np.concatenate( [block[1] for block in blocks] ) )
+
+	# Checks the projection against points with known coordinates, both ways. The inverse error is measured on the ground, in metres
+	# @param reference = ( longitude, latitude, x, y ) tuples
+	# @return = The largest error found, in metres
+	def validate( self, reference=ALASKA_ALBERS_REFERENCE, tolerance=TOLERANCE ):
+		points = np.array( reference, dtype=np.float64 )
+		( x, y ) = self.forward( points[:, 0], points[:, 1] )
+		error = np.hypot( x - points[:, 2], y - points[:, 3] ).max()
+		( lon, lat ) = self.inverse( points[:, 2], points[:, 3] )
+		dlon = np.remainder( lon - points[:, 0] + 180.0, 360.0 ) - 180.0
+		metres_per_degree = math.pi * self.a / 180.0
+		ground = np.hypot( ( lat - points[:, 1] ) * metres_per_degree, dlon * metres_per_degree * np.cos( np.radians( points[:, 1] ) ) ).max()
+		error = max( error, ground )
+		if error > tolerance:
+			raise ProjectionAccuracyException( error, tolerance )
+		return error
@@ -0,0 +1,240 @@
+# Benchmarks
+# Measures the throughput of every pipeline stage on deterministic synthetic data, so that performance regressions are caught before they reach a nightly run.
+# Everything runs offline, against a GeoPackage (the SQLiteBackend) in a temporary directory. Each stage reports rows per second and its peak resident memory,
+# and the runner compares the results to a stored baseline, flagging any stage which has slowed down or grown.
+# Run from the command line: python Benchmarks.py --help
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from KNearestNeighborModel import KNNModel
+from Instrumentation import resetPeakRSS, readPeakRSS
+from M77TReader import readM77tChunks
+
+TOLERANCE = 0.2 # A stage is flagged when it is this fraction slower, or larger, than its baseline
+
+# Generates a synthetic bathymetric point cloud: a smooth sloping seafloor with some noise on top
+# @param num_points = The number of points to generate
+# @param seed = The random seed. The same seed always produces the same points
+# @param density = Points per square kilometre. If None, the points cover a 10 km square whatever their number
+# @param nan_rate = The fraction of points whose depth is missing (NaN)
+# @return = An nx3 array of xyz coordinates
+def syntheticXYZ( num_points, seed=0, density=None, nan_rate=0.0 ):
+	rng = np.random.default_rng( seed )
+	extent = 10000.0
+	if density != None:
+		extent = 1000.0 * np.sqrt( num_points / float( density ) )
+	x = rng.uniform( 0.0, extent, num_points )
+	y = rng.uniform( 0.0, extent, num_points )
+	z = -200.0 - 0.05 * x + 30.0 * np.sin( y / 500.0 ) + rng.normal( 0.0, 2.0, num_points )
+	if nan_rate > 0:
+		z[rng.random( num_points ) < nan_rate] = np.nan
+	return np.column_stack( ( x, y, z ) )
+
+# Converts synthetic metres to longitudes and latitudes around the centre of the Alaska Albers projection
+def toLonLat( XYZ ):
+	return ( -154.0 + XYZ[:, 0] / 60000.0, 58.0 + XYZ[:, 1] / 111000.0 )
+
+# Writes a synthetic M77T file. Missing depths are left blank, the way NCEI leaves them
+# @return = The number of data rows written
+def writeSyntheticM77t( fp, num_points, seed=0, density=None, nan_rate=0.0 ):
+	XYZ = syntheticXYZ( num_points, seed, density, nan_rate )
+	( lon, lat ) = toLonLat( XYZ )
+	with open( fp, 'w' ) as writer:
+		writer.write( "SURVEY_ID\tTIMEZONE\tDATE\tTIME\tLAT\tLON\tPOS_TYPE\tNAV_QUALCO\tBAT_TTIME\tCORR_DEPTH\n" )
+		for ( x, y, z ) in zip( lon.tolist(), lat.tolist(), XYZ[:, 2].tolist() ):
+			depth = "" if z != z else "%.2f" % -z
+			writer.write( "SYNTH\t0\t20000101\t0000.00\t%.6f\t%.6f\t1\t\t\t%s\n" % ( y, x, depth ) )
+	return num_points
+
+# Writes a synthetic tab separated XYZ file. Missing depths are written as NaN, and every thousandth row is left blank
+# @return = The number of data rows written
+def writeSyntheticXYZFile( fp, num_points, seed=0, density=None, nan_rate=0.0 ):
+	XYZ = syntheticXYZ( num_points, seed, density, nan_rate )
+	with open( fp, 'w' ) as writer:
+		for ( index, ( x, y, z ) ) in enumerate( XYZ.tolist() ):
+			writer.write( "%.3f\t%.3f\t%.3f\n" % ( x, y, z ) )
+			if index % 1000 == 999:
+				writer.write( "\n" )
+	return num_points
+
+# Times a single call of function
+# @param rows = The number of rows the call processes
+# @return = A dictionary with the rows, seconds, rows per second and peak memory in MB
+def measure( function, rows ):
+	resetPeakRSS()
+	start = time.perf_counter()
+	function()
+	seconds = time.perf_counter() - start
+	return { 'rows':rows, 'seconds':seconds, 'rows_per_sec':rows / seconds if seconds > 0 else float( 'inf' ), 'peak_rss_mb':readPeakRSS() }
+
+# Compares the per point residual path with the batch residual engine
+# The per point path is only timed on a sample, since it is far too slow to run on the whole set
+# @param num_points = The size of the synthetic point set
+# @param num_nn = The number of nearest neighbors to use
+# @param sample_size = The number of points timed through the per point path
+# @param workers = The number of worker threads used by the batch engine
+# @return = A dictionary of points per second for each path
+def benchmarkResiduals( num_points=1000000, num_nn=150, sample_size=2000, workers=-1 ):
+	XYZ = syntheticXYZ( num_points )
+	KNNM = KNNModel( XYZ, 0, 1, 2, NUM_NN=num_nn )
+
+	start = time.perf_counter()
+	BATCH = KNNM.CalculateAllResidualsBatch( workers=workers )
+	batch_rate = num_points / ( time.perf_counter() - start )
+
+	SAMPLE = KNNM.data[:sample_size]
+	start = time.perf_counter()
+	PER_POINT = [KNNM.CalculateResidual( INDEX, KNNM.data ) for INDEX in range( len( SAMPLE ) )]
+	per_point_rate = len( SAMPLE ) / ( time.perf_counter() - start )
+
+	if not np.allclose( BATCH[:len( SAMPLE ), 3], PER_POINT ):
+		raise AssertionError( "Batch residuals do not match per point residuals" )
+	return { 'per_point':per_point_rate, 'batch':batch_rate }
+
+# Reads the LON/LAT/CORR_DEPTH columns of an M77T file the way the importer did before M77TReader: one line at a time, splitting every line in Python
+# @return = An nx3 array of the rows with all three fields present, as strings converted to floats
+def readM77tBaseline( fp ):
+	reader = open( fp, 'r' )
+	fields = [field.strip() for field in reader.readline().split( '\t' )]
+	indices = [fields.index( field ) for field in ( 'LON', 'LAT', 'CORR_DEPTH' )]
+	data = list()
+	for line in reader:
+		row = line.split( '\t' )
+		try:
+			add_row = [row[index].rstrip() for index in indices]
+		except:
+			continue
+		if add_row[0] == "" or add_row[1] == "" or add_row[2] == "":
+			continue
+		data.append( add_row )
+	reader.close()
+	return np.array( data, dtype=np.float64 ).reshape( -1, 3 )
+
+# Compares the line by line M77T reader the importer used to have with the chunked native parse of M77TReader, on a synthetic file
+# @param num_points = The number of rows in the file
+# @return = A dictionary of rows per second for each reader
+def benchmarkM77tReader( num_points=1000000, seed=0, nan_rate=0.01, work_dir=None ):
+	directory = tempfile.mkdtemp( prefix='benchmarks_', dir=work_dir )
+	try:
+		m77t = os.path.join( directory, 'bench.m77t' )
+		writeSyntheticM77t( m77t, num_points, seed, nan_rate=nan_rate )
+
+		start = time.perf_counter()
+		BASELINE = readM77tBaseline( m77t )
+		baseline_rate = num_points / ( time.perf_counter() - start )
+
+		start = time.perf_counter()
+		CHUNKED = np.concatenate( [np.column_stack( chunk ) for chunk in readM77tChunks( m77t )] )
+		chunked_rate = num_points / ( time.perf_counter() - start )
+	finally:
+		shutil.rmtree( directory, ignore_errors=True )
+	if not np.array_equal( BASELINE, CHUNKED ):
+		raise AssertionError( "The chunked M77T reader does not match the baseline reader" )
+	return { 'baseline':baseline_rate, 'chunked':chunked_rate }
+
+# Runs every stage benchmark on freshly generated data in a temporary directory
+# @param num_points = The number of points in each synthetic file and table
+# @param num_nn = The number of nearest neighbors used by the residual benchmark
+# @return = A dictionary of stage name to the result of measure()
+def runSuite( num_points=200000, seed=0, density=None, nan_rate=0.01, num_nn=150, work_dir=None ):
+	from DataImporter import SQLiteDataImporter
+	from DataProcessor import SQLiteDataProcessor
+	directory = tempfile.mkdtemp( prefix='benchmarks_', dir=work_dir )
+	results = dict()
+	try:
+		gpkg = os.path.join( directory, 'bench.gpkg' )
+		m77t = os.path.join( directory, 'bench.m77t' )
+		xyz = os.path.join( directory, 'bench.xyz' )
+		writeSyntheticM77t( m77t, num_points, seed, density, nan_rate )
+		writeSyntheticXYZFile( xyz, num_points, seed, density, nan_rate )
+
+		importer = SQLiteDataImporter( gpkg )
+		results['import_m77t'] = measure( lambda: importer.importM77tFile( m77t ), num_points )
+		results['delete_empty_points'] = measure( lambda: importer.deleteEmptyPoints( xyz ), num_points )
+		importer.tpr.flush()
+
+		processor = SQLiteDataProcessor( gpkg, err_log_fp=os.path.join( directory, 'errors.txt' ) )
+		table = 'bench'
+		size = processor.storage.getCount( table )
+		results['table_statistics'] = measure( lambda: processor.calculateTableStatistics( table ), size )
+		results['percentiles'] = measure( lambda: processor.addPercentiles( table ), size )
+		results['percentiles_external'] = measure( lambda: processor.addPercentiles( table, external=True ), size )
+
+		XYZ = syntheticXYZ( num_points, seed, density )
+		KNNM = KNNModel( XYZ, 0, 1, 2, NUM_NN=num_nn )
+		results['knn_residuals'] = measure( lambda: KNNM.CalculateAllResidualsBatch(), num_points )
+	finally:
+		shutil.rmtree( directory, ignore_errors=True )
+	return results
+
+# Compares results to a baseline produced by an earlier runSuite
+# @param tolerance = The fraction by which a stage may be slower, or use more memory, before it is flagged
+# @return = A list of messages, one per regression. Empty if there are none
+def compareToBaseline( results, baseline, tolerance=TOLERANCE ):
+	regressions = list()
+	for stage in results:
+		if stage not in baseline:
+			continue
+		( now, then ) = ( results[stage], baseline[stage] )
+		if now['rows_per_sec'] < then['rows_per_sec'] * ( 1.0 - tolerance ):
+			regressions.append( "%s is %.0f%% slower (%.0f rows/sec, baseline %.0f)" % ( stage, 100.0 * ( 1.0 - now['rows_per_sec'] / then['rows_per_sec'] ), now['rows_per_sec'], then['rows_per_sec'] ) )
+		if now['peak_rss_mb'] > then['peak_rss_mb'] * ( 1.0 + tolerance ):
+			regressions.append( "%s peaked at %.0f MB (baseline %.0f MB)" % ( stage, now['peak_rss_mb'], then['peak_rss_mb'] ) )
+	return regressions
+
+def printResults( results ):
+	print( "%-22s %12s %10s %14s %10s" % ( 'stage', 'rows', 'seconds', 'rows/sec', 'peak MB' ) )
+	for stage in results:
+		result = results[stage]
+		print( "%-22s %12d %10.2f %14.0f %10.0f" % ( stage, result['rows'], result['seconds'], result['rows_per_sec'], result['peak_rss_mb'] ) )
+
+def main( argv=None ):
+	parser = argparse.ArgumentParser( description="Benchmarks every pipeline stage on synthetic bathymetry" )
+	parser.add_argument( '--points', type=int, default=200000, help="Points per synthetic file and table" )
+	parser.add_argument( '--seed', type=int, default=0 )
+	parser.add_argument( '--density', type=float, default=None, help="Points per square kilometre" )
+	parser.add_argument( '--nan-rate', type=float, default=0.01, help="Fraction of points with a missing depth" )
+	parser.add_argument( '--num-nn', type=int, default=150 )
+	parser.add_argument( '--baseline', default=None, help="JSON file of baseline results to compare against" )
+	parser.add_argument( '--save-baseline', action='store_true', help="Write the results to --baseline instead of comparing against it" )
+	parser.add_argument( '--tolerance', type=float, default=TOLERANCE )
+	parser.add_argument( '--residual-speedup', action='store_true', help="Only compare the per point and batch residual paths" )
+	parser.add_argument( '--m77t-speedup', action='store_true', help="Only compare the baseline and chunked M77T readers" )
+	args = parser.parse_args( argv )
+
+	if args.residual_speedup:
+		rates = benchmarkResiduals( args.points, args.num_nn )
+		for path in rates:
+			print( "%-10s %12.0f points/sec" % ( path, rates[path] ) )
+		print( "Speedup: %.1fx" % ( rates['batch'] / rates['per_point'] ) )
+		return 0
+
+	if args.m77t_speedup:
+		rates = benchmarkM77tReader( args.points, args.seed, args.nan_rate )
+		for reader in rates:
+			print( "%-10s %12.0f rows/sec" % ( reader, rates[reader] ) )
+		print( "Speedup: %.1fx" % ( rates['chunked'] / rates['baseline'] ) )
+		return 0
+
+	results = runSuite( args.points, args.seed, args.density, args.nan_rate, args.num_nn )
+	printResults( results )
+	if args.baseline == None:
+		return 0
+	if args.save_baseline:
+		with open( args.baseline, 'w' ) as f:
+			json.dump( results, f, indent=1 )
+		print( "Baseline written to %s." % args.baseline )
+		return 0
+	with open( args.baseline ) as f:
+		regressions = compareToBaseline( results, json.load( f ), args.tolerance )
+	for regression in regressions:
+		print( "REGRESSION: %s" % regression )
+	return 1 if len( regressions ) else 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
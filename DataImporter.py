@@ -1,208 +1,345 @@
 import os
 import os.path
-import arcpy
 import time
-import pathos.multiprocessing as mp
+import math
+import tempfile
+import shutil
+import multiprocessing
+try:
+	import arcpy
+except ImportError:
+	arcpy = None # Only the ArcGDBDataImporter needs arcpy
+from M77TReader import readM77tChunks
+from XYZReader import readXYZChunks
+from TableProcessingRecord import TableProcessingRecord
+from PointCache import PointCacheWriter, writePointCache, cachePath, defaultCacheDir
+from StorageBackend import SpatialReference, ArcGDBBackend, SQLiteBackend
+from ImportScheduler import ImportScheduler, ImportTask
+from FileCrawler import crawlFiles, FileRecord
+from ImportPipeline import ImportPipeline
+from Instrumentation import MetricsLog
+from SpatialTileIndex import SpatialTileIndex, tileIndexDir
+from GridThinning import thinnedTableName
+from ImportManifest import ImportManifest, defaultManifestPath, NEW, UNCHANGED, TOUCHED, CHANGED
 
+GCS_NAD_1983_2011 = "GEOGCS['GCS_NAD_1983_2011',DATUM['D_NAD_1983_2011',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]]"
+NAD_1983_2011 = SpatialReference( 6318, 'GCS_NAD_1983_2011', GCS_NAD_1983_2011 )
+
+# Imports files into a database through a StorageBackend, recording every imported table in the Table Processing Record
+# Subclasses choose the backend, and may replace any of the import functions with ones specific to their database
 class DataImporter( object ):
-	def __init__( self, verbose ):
+	# @param storage - The StorageBackend to import files into
+	# @param tpr - The TableProcessingRecord recording the imported tables
+	# @param verbose - If set to true, this DataImporter reports what it is doing
+	# @param cache_dir - The directory point caches are written to
+	# @param manifest - The ImportManifest recording the imported source files. If None, files are skipped only when their table is already in the TPR
+	# @param metrics_fp - The JSON-lines file every import is measured into (see Instrumentation). If None, nothing is measured
+	# @param pipeline_on - If True, text point files are imported through an ImportPipeline, which overlaps reading, parsing and writing
+	def __init__( self, storage, tpr, verbose=False, multiprocessing_on=False, free_cores=6, cache_dir=None, manifest=None, metrics_fp=None, pipeline_on=False ):
+		self.storage = storage
+		self.pipeline_on = pipeline_on
+		self.metrics = MetricsLog( metrics_fp )
+		self.tpr = tpr
 		self.verbose = verbose
-		self.procFuncDict = self.defImportFunctionDictionary()
+		self.cache_dir = cache_dir
+		self.manifest = manifest
+		self.multiprocessing_on = multiprocessing_on
+		self.max_num_cpu = multiprocessing.cpu_count() - free_cores # Given the load imposed by this kind of data processing, it is usually easier to specify how many cores to keep free (free_cores), and then to use all other available cores.
+		self.import_dict = self.defImportFunctionDictionary()
 		
 	def __str__( self ):
 		print( self )
+
+	# Returns the ( class, keyword arguments ) from which a worker process builds its own copy of this importer
+	# Subclasses set self.worker_kwargs to the arguments they were constructed with
+	def getWorkerConfig( self ):
+		if not hasattr( self, 'worker_kwargs' ):
+			raise NotImplementedError( "%s cannot be rebuilt in a worker process" % self.__class__.__name__ )
+		kwargs = dict( self.worker_kwargs )
+		kwargs['multiprocessing_on'] = True
+		return ( self.__class__, kwargs )
 	
 	def printIfVerbose( self, message ):
 		if self.verbose:
 			print( message )
 			
-	def importFilesFromDir( self, DIR ):
-		self.printIfVerbose( "Import files from directory not implemented" )
-	
 	def importFilesFromList( self, FILES ):
 		self.printIfVerbose( "Import files from list not implemented" )
 		
 	def importShapefile( self, shapefile ):
 		self.printIfVerbose( "Import files from shapefile not implemented" )
 		
-	def importXYZFile( self, xyzfile ):
-		self.printIfVerbose( "Import files from xyz file not implemented" )
-		
-	def importM77tFile( self, m77tfile ):
-		self.printIfVerbose( "Import files from m77t file not implemented" )
-	
 	# Here we define the import function dictionary. Each entry key is a file type, and each entry value is the function with which to import that file type
 	# To add import functionality for a new file type (ft), write the import function (func), then add a new dictionary entry { 'ft':func }
 	def defImportFunctionDictionary( self ):
-		return { '.shp':ArcGDBDataImporter.importShapefile, '.xyz':self.importXYZFile, '.m77t':self.importM77tFile }
+		return { '.shp':self.importShapefile, '.xyz':self.importXYZFile, '.m77t':self.importM77tFile }
 		
-	
-class ArcGDBDataImporter( DataImporter ):
-	# @param GDB_fp - The file path to the GDB which this DataImporter will import files into
-	# @param verbose - If set to true, this DataImporter
-	def __init__( self, GDB_fp, tpr="Table_Processing_Record", dataset=None, verbose=False, multiprocessing_on=False, free_cores=6 ):
-		self.GDB = GDB_fp
-		self.TPR = os.path.join( self.GDB, tpr )
-		self.verbose = verbose
-		self.dataset = dataset
-		self.multiprocessing_on = multiprocessing_on
-		self.max_num_cpu = mp.cpu_count() - free_cores # Given the load imposed by this kind of data processing, it is usually easier to specify how many cores to keep free (free_cores), and then to use all other available cores.
-		self.import_dict = self.defImportFunctionDictionary()
-		self.WRKSPC = self.GDB
-		if dataset != None:
-			self.WRKSPC = os.path.join( self.GDB, dataset )
-		arcpy.env.workspace = self.WRKSPC
-	
 	# Method that walks through a file tree recursively, looking for files with the specified extension.
 	# It then returns a list containing all files which mached the specified extension
 	# @param ROOT = The root of the file tree to search through
 	# @param EXTENSION = The extension to look for
 	def findFilesByExtension( self, ROOT, EXTENSION ):
-		AllFiles = os.walk( ROOT, True, None, False )
-		ReturnFiles = list()
-
-		for entry in AllFiles:
-			# entry is a tuple containing (path, directories, files)
-			for file in entry[2]:
-				( filename, extension ) = os.path.splitext( file )
-				if extension == EXTENSION:
-					ReturnFiles.append( os.path.join( entry[0], file ) )
-
-		return ReturnFiles
-	
-	def getTableFields( self, table ):
-		fields = [f.name for f in arcpy.ListFields( table )]
-		return fields
+		return [record.path for record in crawlFiles( ROOT, ( EXTENSION, ) )]
 	
 	def tablePresentInTPR( self, table ):
-		sCur = arcpy.da.SearchCursor( self.TPR, 'tbl_name' )
-		for row in sCur:
-			if row[0] == table:
-				return True
-		return False
-
-	# TODO: This function in general needs help << --------------------------------------------------------------------------####
-	# @param table - The filename to the new table as inserted into the GDB
+		return table in self.tpr
+
+	# @param table - The filename to the new table as inserted into the database
 	def addTableToTableRecord( self, table ):
-		self.printIfVerbose( "Adding %s to table record." % table )
-		cursor = arcpy.InsertCursor( self.TPR )
-		row = cursor.newRow()
-		row.setValue( 'tbl_name', table )
-		row.setValue( 'date_added', time.strftime("%Y/%m/%d") )
-		cursor.insertRow( row )
-		del cursor
-		del row
+		self.tpr.addTable( table )
 
 	# Deletes an entry in the TPR based on the table name. Returns true if successful, false if not.
 	def removeTableFromTableRecord( self, table ):
-		self.printIfVerbose( "Removing %s from table record." % table )
-		cursor = arcpy.UpdateCursor( self.TPR )
-		for row in cursor:
-			if row.getValue( 'tbl_name' ) == table:
-				cursor.deleteRow( row )
-				del cursor
-				del row
-				return True
-		del cursor
-		del row
-		return False
+		return self.tpr.removeTable( table )
 		
-	# Method that updates the table processing record. There are two copies of this function right now. If they get out of sync, there could be problems
-	# TODO: Kind of a big one. Implement a TPR class which accepts as a parameter the name of the TPR, and provides a bunch of common functions for interacting with the TPR
+	# Buffers an update to the table processing record. The TableProcessingRecord writes buffered updates back in batches
 	def updateTableProcessingRecord( self, table, update_fields, update_values ):
-		where_clause = "tbl_name = '%s'" % table
-		uCur = arcpy.UpdateCursor( self.TPR, where_clause )
-		row = uCur.next()
-		for index in range( 0, len( update_fields ) ):
-			self.printIfVerbose( "Updating %s to %s for %s." % ( update_fields[index], update_values[index], table ) )
-			row.setValue( update_fields[index], update_values[index] )
-		uCur.updateRow( row )
-		del uCur
-		del row
+		self.tpr.update( table, update_fields, update_values )
 	
 		
 	# Crawls a directory looking for files and categorizing them by their extension
 	# Returns a dictionary with a key for every file type present in the directory, and a list containing all files of that type in the directory as the value for that key
 	def categorizeFilesInDir( self, DIR ):
-		all_dirs = os.walk( DIR, True, None, False )
 		files = {}
-		for dir in all_dirs:
-			for file in dir[2]:
-				( fname, ext ) = os.path.splitext( file )
-				if ext in files:
-					files[ext] = files[ext] + ( os.path.join( dir[0], file ), )
-				else:
-					files[ext] = ( os.path.join( dir[0], file ), )
+		for record in crawlFiles( DIR ):
+			files.setdefault( record.ext, list() ).append( record.path )
 		return files
 	
+	# Classifies a single line of an xyz file. Returns None if the line holds a usable point, otherwise the reason it should be dropped
+	def classifyXYZLine( self, line ):
+		point = line.split( '\t' )
+		if line.strip() == "":
+			return 'blank'
+		if len( point ) < 3:
+			return 'malformed'
+		try:
+			values = [float( value ) for value in point[:3]]
+		except ValueError:
+			return 'malformed'
+		if any( math.isnan( value ) for value in values ):
+			return 'nan'
+		return None
+
+	# Removes blank, malformed and NaN rows from an xyz file in a single streaming pass
+	# The kept rows are written to a temporary file beside the original, which then atomically replaces it. If the process dies part way through, the original is untouched
+	# @return - A dictionary with the number of rows dropped for each reason
 	def deleteEmptyPoints( self, fp ):
-		file = open( fp, 'r' )
-		xyz = [line.split('\t') for line in file]
-		ret = list()
-		for point in xyz:
-			if point[2] == 'NaN\n':
-				pass
+		dropped = { 'blank':0, 'malformed':0, 'nan':0 }
+		( handle, temp_fp ) = tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( fp ) ), suffix='.xyz' )
+		try:
+			with open( fp, 'r' ) as reader, os.fdopen( handle, 'w' ) as writer:
+				for line in reader:
+					reason = self.classifyXYZLine( line )
+					if reason == None:
+						writer.write( line )
+					else:
+						dropped[reason] += 1
+			if sum( dropped.values() ) == 0:
+				# Culling removed no points, leave the original alone
+				os.remove( temp_fp )
 			else:
-				ret.append( point )
-		if len( xyz ) == len( ret ):
-			# Culling removed no points, skip the rest
-			return
-		file.close()
-		file = open( fp, 'w' )
-		for point in ret:
-			file.write( '\t'.join( point ) )
+				shutil.copymode( fp, temp_fp )
+				os.replace( temp_fp, fp )
+		except:
+			os.remove( temp_fp )
+			raise
+		self.printIfVerbose( "Dropped %d blank, %d malformed and %d NaN rows from %s." % ( dropped['blank'], dropped['malformed'], dropped['nan'], fp ) )
+		return dropped
 	
 	# Imports files of all viable types from the given directory
-	# @param skip If True the script will print all errors to the command line, but will then continue. If False will raise error.
+	# Files are checked and imported as the crawl finds them, so importing starts long before a large tree has been crawled. In pipeline mode, text point files
+	# go through an ImportPipeline, whose parse processes take the place of the worker pool. Otherwise, in multiprocessing mode every file, of whatever type,
+	# goes through one ImportScheduler, which keeps a single pool of workers for the whole run
+	# @return - In multiprocessing mode, the scheduler's report of the run: every file's result, the wall clock time, and each worker's utilization. Otherwise None
 	def importFilesFromDir( self, dir ):
 		self.printIfVerbose( "Importing files from %s." % dir )
-		files = self.categorizeFilesInDir( dir )
-		for file_type in files:
-			if file_type in self.import_dict:
-				# If execution reaches this section, then file_type is a file type we can import, and files[file_type] is a list of files of that file type
-				if self.multiprocessing_on:
-					# Creates a worker pool which will allow us to execute many processes in parallel, while keeping a cap on how many processes we spawn
-					p = mp.ProcessPool( nodes=self.max_num_cpu )
-					# A little confusing. self.import_dict[file_type] is the import function to be used to import a file of type file_type. files[file_type] is a list of files of type file_type
-					# pool.map spawns worker processes executing the specified import function on each member of files[file_type]
-					p.map( self.import_dict[file_type], files[file_type] )
-				else:
-					# Exactly the same as above, just one at a time. Linear, not parallel.
-					for file in files[file_type]:
-						self.import_dict[file_type](file)
+		report = None
+		# Tables dropped for re-import must be out of the TPR before any worker starts
+		self.tpr.flush()
+		selected = self.iterFilesToImport( crawlFiles( dir, self.import_dict.keys() ) )
+		if self.pipeline_on:
+			pipeline = ImportPipeline( self, NAD_1983_2011, self.max_num_cpu, verbose=self.verbose )
+			pipeline.run( record for ( record, changed ) in selected )
+		elif self.multiprocessing_on:
+			scheduler = ImportScheduler( self, self.max_num_cpu, self.verbose )
+			try:
+				report = scheduler.runStream( ImportTask( record.path, record.size, changed ) for ( record, changed ) in selected )
+			finally:
+				scheduler.close()
+			utilization = report['utilization']
+			if len( utilization ):
+				self.printIfVerbose( "Imported %d files in %.1f seconds, workers busy %.0f%% of the time on average." % ( len( report['results'] ), report['wall_seconds'], 100.0 * sum( utilization.values() ) / len( utilization ) ) )
+			# The workers wrote their own TPR rows, so our index is out of date
+			self.tpr.load()
+		else:
+			for ( record, changed ) in selected:
+				self.importFile( record.path )
+		self.tpr.flush()
+		return report
+
+	# Checks every file against the manifest, and returns those which need importing: new files, and files whose contents have changed.
+	# The table of a changed file is dropped, so that it is imported afresh and every processing stage runs on it again
+	# Without a manifest, every file is returned, and the import functions skip those whose table is already in the TPR
+	# @param files = A list of file paths or FileRecords (see FileCrawler)
+	def selectFilesToImport( self, files ):
+		return [record.path for ( record, changed ) in self.iterFilesToImport( files )]
+
+	# Generator form of selectFilesToImport, which checks each file as it arrives, reusing the size and modification time a crawl found it with
+	# A changed file's old table is dropped from the TPR before the file is yielded, so it can be handed straight to a worker
+	# @param files = An iterable of file paths or FileRecords
+	# @return = A generator of ( FileRecord, changed ) tuples. changed is True for a file whose old table was dropped
+	def iterFilesToImport( self, files ):
+		if self.manifest != None:
+			self.manifest.load()
+		( found, selected ) = ( 0, 0 )
+		for record in files:
+			if not isinstance( record, FileRecord ):
+				stat = os.stat( record )
+				record = FileRecord( os.path.splitext( record )[1], record, stat.st_size, stat.st_mtime_ns )
+			found += 1
+			( state, digest ) = ( NEW, None )
+			table = self.getTableName( record.path )
+			if self.manifest != None:
+				( state, digest ) = self.manifest.classify( record.path, record.size, record.mtime_ns )
+			if state == UNCHANGED:
+				continue
+			if state == TOUCHED:
+				# Only the modification time moved. Remember the new one, so the file is not hashed again next time
+				self.manifest.record( record.path, table, digest, record.size, record.mtime_ns )
+				continue
+			if state == NEW and self.manifest != None and self.tablePresentInTPR( table ):
+				# Imported before there was a manifest. Adopt it as it is
+				self.manifest.record( record.path, table, digest, record.size, record.mtime_ns )
+				continue
+			if state == CHANGED:
+				self.printIfVerbose( "%s has changed since it was imported. Importing it again." % record.path )
+				self.invalidateTable( table )
+				# A worker rereads the table's row before importing it (see ImportTask), so the drop must be committed first. Imported in this process,
+				# the file sees the drop in our own index
+				if self.multiprocessing_on and not self.pipeline_on:
+					self.tpr.flush()
+			selected += 1
+			yield ( record, state == CHANGED )
+		self.printIfVerbose( "%d of %d files are new or changed." % ( selected, found ) )
+
+	# Drops a table, its point cache, its points in the spatial index and its TPR row, so that it can be imported again from scratch
+	# The table's thinned copy (see GridThinning) is dropped with it, since it was made from the old points
+	def invalidateTable( self, table ):
+		for name in ( table, thinnedTableName( table ) ):
+			if self.storage.tableExists( name ):
+				self.storage.deleteTable( name )
+			if self.cache_dir != None and os.path.exists( cachePath( self.cache_dir, name ) ):
+				os.remove( cachePath( self.cache_dir, name ) )
+			if self.cache_dir != None and os.path.isdir( tileIndexDir( self.cache_dir ) ):
+				SpatialTileIndex( tileIndexDir( self.cache_dir ) ).removeTable( name )
+			if self.tablePresentInTPR( name ):
+				self.removeTableFromTableRecord( name )
 
+	# Returns the name of the table a file is imported as
+	def getTableName( self, file ):
+		return os.path.splitext( os.path.basename( file ) )[0]
+
+	# Imports a single file with the import function for its file type, then records it in the manifest
+	# The TPR is not flushed here: a worker flushes once per batch of files (see ImportScheduler.runBatch), and every other caller once at the end of its run
+	def importFile( self, file ):
+		( fname, ext ) = os.path.splitext( file )
+		table = self.getTableName( file )
+		with self.metrics.measure( 'import', self.import_dict[ext].__name__, table ) as measurement:
+			self.import_dict[ext]( file )
+			if measurement.enabled and self.storage.tableExists( table ):
+				measurement.setRows( self.storage.getCount( table ) )
+		if self.manifest != None and self.tablePresentInTPR( self.getTableName( file ) ):
+			# The file is hashed after the import, since importing may have cleaned it in place
+			self.manifest.record( file, self.getTableName( file ) )
+
+	# Streams the LON/LAT/CORR_DEPTH columns of an m77t file straight into a new point table, one chunk at a time
 	def importM77tFile( self, file ):
-		( dir, basename ) = os.path.split( file )
-		( fname, ext ) = os.path.splitext( basename )
+		( fname, ext ) = os.path.splitext( os.path.basename( file ) )
 		if self.tablePresentInTPR( fname ):
 			self.printIfVerbose( "%s already present in TPR. Cancelling import." % fname )
 			return
 		self.printIfVerbose( "Importing %s as m77tFile..." % file )
-		reader = open( file, 'r' )
-		firstline = reader.readline()
-		fields = firstline.split( '\t' )
-		desired_fields = ( 'LAT', 'LON', 'CORR_DEPTH' )
-		desired_field_indices = [fields.index( desired_field ) for desired_field in desired_fields]
-		data = list()
-		for line in reader:
-			row = line.split( '\t' )
-			try:
-				add_row = [row[index].rstrip() for index in desired_field_indices]
-			except:
-				continue
-			if str( add_row[0] ) == "" or str( add_row[1] ) == "" or str( add_row[2] ) == "" or str( add_row ) == '()':
-				continue
-			else:
-				data.append( add_row )
-		reader.close()
-		# Data now consists of tuples, each corresponding to a different feature in the m77t file and made up of those fields specified by desired_fields (x,y,z)
-		# Now we write these tuples to file as an xyz file, and import the new file
-		new_xyz_file_name = os.path.join( dir, fname + '.xyz' )
-		new_xyz_file = open( new_xyz_file_name, 'w' )
-		for entry in data:
-			new_xyz_file.write( '\t'.join( entry ) + '\n' )
-		new_xyz_file.close()
-		self.importXYZFile( new_xyz_file_name )
+		count = self.importPointChunks( fname, readM77tChunks( file ) )
+		self.addTableToTableRecord( fname )
+		self.printIfVerbose( "Done importing %s (%d points)." % ( file, count ) )
+
+	# Writes chunks of points into a new point table and its point cache together. If reading or writing fails, the spooled cache is discarded and the
+	# half written table dropped before the error is raised again, so that neither is left behind for the next import to trip over
+	# @return - The number of points written
+	def importPointChunks( self, fname, chunks ):
+		writer = PointCacheWriter( cachePath( self.cache_dir, fname ) )
+		try:
+			count = self.writePointChunks( fname, self.cacheChunks( chunks, writer ) )
+			writer.close()
+		except:
+			writer.abort()
+			if self.storage.tableExists( fname ):
+				self.storage.deleteTable( fname )
+			raise
+		return count
+
+	# Creates a new point table and writes points into it
+	# @param fname - The name of the new table
+	# @param chunks - An iterable of ( X, Y, Z ) array tuples, as produced by readM77tChunks
+	# @return - The number of points written
+	def writePointChunks( self, fname, chunks ):
+		self.storage.createPointTable( fname, NAD_1983_2011 )
+		count = 0
+		for ( X, Y, Z ) in chunks:
+			count += self.storage.appendPoints( fname, X, Y, Z )
+		return count
+
+	# Generator which passes ( X, Y, Z ) chunks through unchanged, appending each one to a point cache on the way
+	def cacheChunks( self, chunks, writer ):
+		for ( X, Y, Z ) in chunks:
+			writer.append( X, Y, Z )
+			yield ( X, Y, Z )
+
+	# Streams the points of an xyz file into a new point table, skipping any blank, malformed or NaN rows
+	def importXYZFile( self, file ):
+		( fname, ext ) = os.path.splitext( os.path.basename( file ) )
+		if self.tablePresentInTPR( fname ):
+			self.printIfVerbose( "%s already present in TPR. Cancelling import." % fname )
+			return
+		self.printIfVerbose( "Importing %s as XYZ file..." % file )
+		count = self.importPointChunks( fname, readXYZChunks( file ) )
+		self.addTableToTableRecord( fname )
+		self.printIfVerbose( "Done importing %s (%d points)." % ( file, count ) )
+
+class ArcGDBDataImporter( DataImporter ):
+	# @param GDB_fp - The file path to the GDB which this DataImporter will import files into
+	# @param verbose - If set to true, this DataImporter
+	# @param cache_dir - The directory point caches are written to. Defaults to a directory beside the GDB
+	# @param manifest_fp - The import manifest. Defaults to a file beside the GDB
+	# @param metrics_fp - The JSON-lines metrics log. If None, nothing is measured
+	# @param pipeline_on - If True, text point files are imported through an ImportPipeline
+	def __init__( self, GDB_fp, tpr="Table_Processing_Record", dataset=None, verbose=False, multiprocessing_on=False, free_cores=6, cache_dir=None, manifest_fp=None, metrics_fp=None, pipeline_on=False ):
+		self.GDB = GDB_fp
+		self.worker_kwargs = { 'GDB_fp':GDB_fp, 'tpr':tpr, 'dataset':dataset, 'verbose':verbose, 'free_cores':free_cores, 'cache_dir':cache_dir, 'manifest_fp':manifest_fp, 'metrics_fp':metrics_fp, 'pipeline_on':pipeline_on }
+		if cache_dir == None:
+			cache_dir = defaultCacheDir( self.GDB )
+		if manifest_fp == None:
+			manifest_fp = defaultManifestPath( self.GDB )
+		self.TPR = os.path.join( self.GDB, tpr )
+		self.dataset = dataset
+		self.WRKSPC = self.GDB
+		if dataset != None:
+			self.WRKSPC = os.path.join( self.GDB, dataset )
+		# The TPR is a plain table, and so always lives in the root of the GDB rather than in the dataset
+		DataImporter.__init__( self, ArcGDBBackend( self.GDB, dataset ), TableProcessingRecord( ArcGDBBackend( self.GDB ), tpr, verbose ), verbose, multiprocessing_on, free_cores, cache_dir, ImportManifest( manifest_fp ), metrics_fp, pipeline_on )
+		arcpy.env.workspace = self.WRKSPC
+	
+	def getTableFields( self, table ):
+		fields = [f.name for f in arcpy.ListFields( table )]
+		return fields
+	
+	# Writes the point cache for a feature class already in the workspace, reading its points back in one bulk array. Feature classes without Z values are not cached
+	def cacheFeatureClass( self, fname ):
+		out_fc = os.path.join( self.WRKSPC, fname )
+		if not arcpy.Describe( out_fc ).hasZ:
+			return
+		points = arcpy.da.FeatureClassToNumPyArray( out_fc, ( 'OID@', 'SHAPE@X', 'SHAPE@Y', 'SHAPE@Z' ) )
+		writePointCache( cachePath( self.cache_dir, fname ), points['SHAPE@X'], points['SHAPE@Y'], points['SHAPE@Z'], points['OID@'] )
 	
 	# Accepts a file path to the shapefile to be imported, and imports it into the GDB
 	def importShapefile( self, file ):
@@ -213,6 +350,7 @@ class ArcGDBDataImporter( DataImporter ):
 			return	
 		self.printIfVerbose( "Importing %s as shapefile..." % file )
 		arcpy.FeatureClassToGeodatabase_conversion( file, self.WRKSPC ) # Import the fc into the GDB
+		self.cacheFeatureClass( fname )
 		self.addTableToTableRecord( fname )
 		if self.verbose:
 			print( "Done importing %s." % file )
@@ -231,8 +369,27 @@ class ArcGDBDataImporter( DataImporter ):
 		
 		out_fc = os.path.join( self.WRKSPC, fname )
 		arcpy.CheckOutExtension("3D")
-		arcpy.ddd.ASCII3DToFeatureClass( file, "XYZ", out_fc, "POINT", "1", "GEOGCS['GCS_NAD_1983_2011',DATUM['D_NAD_1983_2011',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]]", "", "", "DECIMAL_POINT")
+		arcpy.ddd.ASCII3DToFeatureClass( file, "XYZ", out_fc, "POINT", "1", GCS_NAD_1983_2011, "", "", "DECIMAL_POINT")
 		arcpy.CheckInExtension("3D")
+		self.cacheFeatureClass( fname )
 		self.addTableToTableRecord( fname )
 		if self.verbose:
-			print( "Done importing %s." % file )			
\ No newline at end of file
+			print( "Done importing %s." % file )			
+
+
+# Imports files into a GeoPackage. Needs neither arcpy nor ArcGIS, so it runs on any machine
+class SQLiteDataImporter( DataImporter ):
+	# @param GPKG_fp - The file path to the GeoPackage which this DataImporter will import files into. It is created if it does not exist
+	# @param cache_dir - The directory point caches are written to. Defaults to a directory beside the GeoPackage
+	# @param manifest_fp - The import manifest. Defaults to a file beside the GeoPackage
+	# @param metrics_fp - The JSON-lines metrics log. If None, nothing is measured
+	# @param pipeline_on - If True, text point files are imported through an ImportPipeline
+	def __init__( self, GPKG_fp, tpr="Table_Processing_Record", verbose=False, multiprocessing_on=False, free_cores=6, cache_dir=None, manifest_fp=None, metrics_fp=None, pipeline_on=False ):
+		self.GPKG = GPKG_fp
+		self.worker_kwargs = { 'GPKG_fp':GPKG_fp, 'tpr':tpr, 'verbose':verbose, 'free_cores':free_cores, 'cache_dir':cache_dir, 'manifest_fp':manifest_fp, 'metrics_fp':metrics_fp, 'pipeline_on':pipeline_on }
+		if cache_dir == None:
+			cache_dir = defaultCacheDir( self.GPKG )
+		if manifest_fp == None:
+			manifest_fp = defaultManifestPath( self.GPKG )
+		storage = SQLiteBackend( self.GPKG )
+		DataImporter.__init__( self, storage, TableProcessingRecord( storage, tpr, verbose ), verbose, multiprocessing_on, free_cores, cache_dir, ImportManifest( manifest_fp ), metrics_fp, pipeline_on )
@@ -5,33 +5,40 @@ import os.path
 import time
 import math
 from collections import Counter
-import arcpy
+try:
+	import arcpy
+except ImportError:
+	arcpy = None # Only the ArcGDBDataProcessor needs arcpy
 import multiprocessing as mp
 import datetime
+import functools
+import numpy as np
+from PointCache import openPointCache, defaultCacheDir, cachePath, writePointCache, PointCacheWriter
+from TableProcessingRecord import TableProcessingRecord
+from StorageBackend import OID_FIELD, CHUNK_SIZE, SpatialReference, ArcGDBBackend, SQLiteBackend
+from StreamingStatistics import StreamingStatistics
+from PercentileRanking import rankDescending, ranksToPercentiles, ExternalRanker
+from ProcessingPlan import ProcessingStage, planStages, fusedReads
+from AlbersProjection import AlbersEqualArea
+from Instrumentation import MetricsLog
+from SpatialTileIndex import SpatialTileIndex, tileIndexDir
+from GridThinning import GridThinner, thinnedTableName, THIN_CELL_SIZE, THIN_METHOD
+from SurfaceGrid import SurfaceGrid, SURFACE_CELL_SIZE, SURFACE_BANDS
 
 # import statistics as stats
 from collections import Counter
 # from KNearestNeighborModel import KNNModel
 
 NAD1983_TO_AkAlb_Transformation = "PROJCS['NAD_1983_Alaska_Albers',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Albers'],PARAMETER['False_Easting',0.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-154.0],PARAMETER['Standard_Parallel_1',55.0],PARAMETER['Standard_Parallel_2',65.0],PARAMETER['Latitude_Of_Origin',50.0],UNIT['Meter',1.0]]"
-
-class DataProcessor( object ):
-
-	def __init__( self, verbose ):
-		self.verbose = verbose
-
-	def printIfVerbose( self, message ):
-		if self.verbose == True:
-			print( message )
-
-	def addPercentiles( self ):
-		self.printIfVerbose( "addPercentiles not implemented." )
-		
-	def addResiduals( self ):
-		self.printIfVerbose( "addResiduals not implemented." )
-
-	def addXYZData( self ):
-		self.printIfVerbose( "addXYData not implemented.")
+ALASKA_ALBERS = SpatialReference( 3338, 'NAD_1983_Alaska_Albers', NAD1983_TO_AkAlb_Transformation )
+KDTREE_DISK_BUDGET = 10 * 1024 ** 3 # Bytes of KD trees kept beside the point caches for reuse by addResiduals
+BUILD_SPATIAL_INDEX = True # buildGeometry also builds each table's spatial index
+EXTERNAL_SORT_ROWS = 100000000 # Tables with more rows than this are ranked with an external sort by addPercentiles
+FUSED_MAX_ROWS = EXTERNAL_SORT_ROWS # Tables with more rows than this run every stage on its own, streaming, instead of loading the table's columns once for all of them
+PERCENTILE_FIELD = 'percentile'
+CALIBRATION_ROWS = 1000000 # The most points of a table in the spatial index its neighbor count is calibrated on (see calibrateNeighbors)
+RESIDUAL_ESTIMATORS = ( 'residual', ) # The estimators addResiduals writes by default. Each one is a DOUBLE column of every row, so the rest (see ALL_ESTIMATORS) are asked for by name
+CACHED_FIELDS = { OID_FIELD:'oid', 'x':'x', 'y':'y', 'z':'z' } # Fields which can be read from a table's point cache, and the cache column holding each
 
 class FieldNotPresentException( Exception ):
 	def __init__( self, table, field ):
@@ -41,49 +48,94 @@ class FieldNotPresentException( Exception ):
 	def __str__ ( self ):
 		str = "Field referenced ('%s') which does not exist in table %s" % ( self.field, self.table )
 		return str
-		
+
 """
-Class which wraps a single File Geodatabase (and dataset within, if specified) and provides functions that process the Feature Classes inside. All processing is based on a Table Processing Record, a table provided within the FGDB. If none exists, one is created, and the processor assumes no processing has occured for any of the classes within.
+Class which wraps a single database and provides functions that process the point tables inside. All processing is based on a Table Processing Record, a table provided within the database. If none exists, one is created, and the processor assumes no processing has occured for any of the classes within.
+All data access goes through a StorageBackend, in bulk. Subclasses choose the backend, and provide the processes which depend on a particular database.
 """
-# TODO: Current implementation assumes the existance of a TPR. Create protocol for no existance
-class ArcGDBDataProcessor( DataProcessor ):
-	def __init__( self, FGDB, TPR='Table_Processing_Record', dataset=None, verbose=False, multiprocessing_on=False, free_cores=4 ):
+class DataProcessor( object ):
+	# @param storage = The StorageBackend holding the tables
+	# @param tpr = The TableProcessingRecord of the database
+	# @param cache_dir = The directory holding the point caches written at import time
+	# @param err_log_fp = The file errors raised while processing are logged to. If None, errors are not logged
+	# @param metrics_fp = The JSON-lines file every stage is measured into (see Instrumentation). If None, nothing is measured
+	# @param thin_cell_size = The grid cell size tables are thinned onto by thinTable
+	# @param thin_method = How thinTable picks the point kept for each cell (see GridThinning)
+	# @param thin_on = Whether tables are thinned (the is_thin stage) at all. Off by default, since every thinned copy is itself a table to store and process
+	# @param exact_mode = Whether the table statistics record the exact mode of z (see StreamingStatistics) rather than the centre of its most populated bin
+	def __init__( self, storage, tpr, verbose=False, multiprocessing_on=False, free_cores=4, cache_dir=None, err_log_fp=None, metrics_fp=None, thin_cell_size=THIN_CELL_SIZE, thin_method=THIN_METHOD, thin_on=False, exact_mode=False ):
+		self.storage = storage
+		self.metrics = MetricsLog( metrics_fp )
+		self.tpr = tpr
 		self.verbose = verbose
-		self.GDB = FGDB
-		self.dataset = dataset
-		self.TPR = os.path.join( self.GDB, TPR )
-		self.err_log_fp = r"N:\Python Scripts\BathymetryProcessor\2.0\ErrorLogs\proc_err_log.txt"# TODO: Make the location of this log dyanmically defined to an intelligent location
+		self.cache_dir = cache_dir
+		self.err_log_fp = err_log_fp
 		self.initializeErrorLogHeader()
 		self.multiprocessing_on = multiprocessing_on
 		self.max_num_cpu = mp.cpu_count() - free_cores
-		# Define workspace
-		self.WRKSPC = self.GDB
+		self.projection = None
+		self.thin_cell_size = thin_cell_size
+		self.thin_method = thin_method
+		self.thin_on = thin_on
+		self.exact_mode = exact_mode
 		self.proc_dict = self.defineProcessingDictionary()
-		if self.dataset != None:
-			self.WRKSPC = os.path.join( self.GDB, self.dataset )
-		arcpy.env.workspace = self.WRKSPC
-	
+		self.plan = planStages( self.proc_dict )
+
+	def printIfVerbose( self, message ):
+		if self.verbose == True:
+			print( message )
+
+	def logError( self, table, field, error ):
+		if self.err_log_fp == None:
+			return
+		log = open( self.err_log_fp, 'a' )
+		log.write( "\nError while processing %s.\nProccessing field: %s\n%s\n" % ( table, field, str( error ) ) )
+		log.close()
+
 	def initializeErrorLogHeader( self ):
+		if self.err_log_fp == None:
+			return
 		dt = datetime.datetime.now().strftime("%I:%M%p on %B %d, %Y")
 		log = open( self.err_log_fp, 'a' )
 		log.write( "\n\n----------------------------------------------------------------------------------\nError Log for bathymetry data processing begun at %s.\n----------------------------------------------------------------------------------\n" % dt )
 		log.close()
 	
 	def getTableFields( self, table ):
-		fields = [f.name for f in arcpy.ListFields( table )]
-		return fields
+		return self.storage.getFields( table )
 	
+	# Opens the memory-mapped point cache for a table. Returns None if the table was imported without one
+	def openPointCache( self, table ):
+		if self.cache_dir == None:
+			return None
+		return openPointCache( self.cache_dir, table )
+
+	# Reads whole columns of a table, from its memory-mapped point cache if it has one and every field is in it, otherwise from storage
+	# @return = A dictionary of field name to NumPy array
+	def readColumns( self, table, fields ):
+		cache = self.openPointCache( table )
+		if cache != None and all( field in CACHED_FIELDS for field in fields ):
+			return dict( ( field, getattr( cache, CACHED_FIELDS[field] ) ) for field in fields )
+		return self.storage.readColumns( table, fields )
+
+	# Generator which reads columns of a table in chunks, from its point cache if it has one and every field is in it, otherwise from storage
+	def iterColumns( self, table, fields, chunk_size=CHUNK_SIZE ):
+		cache = self.openPointCache( table )
+		if cache != None and all( field in CACHED_FIELDS for field in fields ):
+			for start in range( 0, len( cache ), chunk_size ):
+				yield dict( ( field, getattr( cache, CACHED_FIELDS[field] )[start:start + chunk_size] ) for field in fields )
+			return
+		for columns in self.storage.iterColumns( table, fields, chunk_size ):
+			yield columns
+
 	def getTablesInTPR( self ):
-		sCur = arcpy.SearchCursor( self.TPR )
-		names = [row.getValue( 'tbl_name' ) for row in sCur]
-		return names
+		return self.tpr.getTables()
 	
 	def updateTPRWithExistingFCs( self ):
 		fcs_in_tpr = self.getTablesInTPR()
-		fcs_in_gdb = arcpy.ListFeatureClasses()
+		fcs_in_gdb = self.storage.listTables()
 		fcs_not_in_tpr = list()
 		for fc in fcs_in_gdb:
-			if fc not in fcs_in_tpr:
+			if fc not in fcs_in_tpr and fc != self.tpr.name:
 				fcs_not_in_tpr.append( fc )
 		# fcs_not_in_tpr now has the names of all of the fcs in the gdb not present in the tpr.'
 		
@@ -94,138 +146,489 @@ class ArcGDBDataProcessor( DataProcessor ):
 	# A method which accepts a processing field from the table processing record as a parameter, and then returns a list of all tables in the tpr which have not undergone that process
 	def selectTablesByProcessingRecord( self, process ):
 		self.printIfVerbose( "Selecting tables by '%s' field" % process )
-		fields = self.getTableFields( self.TPR )
-		if process not in fields:
-			raise FieldNotPresentException( self.TPR, process )
-		
-		where_clause = "%s = 0" % process
-		spatial_reference = ""
-		fields = ""
-		sort_fields = ""
-		sCur = arcpy.SearchCursor( self.TPR, where_clause, spatial_reference, fields, sort_fields  )
-		names = [row.getValue( 'tbl_name' ) for row in sCur]
-		del sCur
-		return names
+		if process not in self.tpr.getFields():
+			raise FieldNotPresentException( self.tpr.name, process )
+		return self.tpr.selectTables( process, 0 )
 	
-	# Method that updates the table processing record. There are two copies of this function right now. If they get out of sync, there could be problems
-	# TODO: Kind of a big one. Implement a TPR class which accepts as a parameter the name of the TPR, and provides a bunch of common functions for interacting with the TPR
+	# Buffers an update to the table processing record. The TableProcessingRecord writes buffered updates back in batches
 	def updateTableProcessingRecord( self, table, update_fields, update_values ):
-		where_clause = "tbl_name = '%s'" % table
-		uCur = arcpy.UpdateCursor( self.TPR, where_clause )
-		row = uCur.next()
-		for index in range( 0, len( update_fields ) ):
-			self.printIfVerbose( "Updating %s to %s for %s." % ( update_fields[index], update_values[index], table ) )
-			row.setValue( update_fields[index], update_values[index] )
-		uCur.updateRow( row )
-		del uCur
-		del row
+		self.tpr.update( table, update_fields, update_values )
 	
 	def calculateTableSize( self, table ):
-		result = arcpy.GetCount_management( table )
-		size = int( result.getOutput( 0 ) )
+		size = self.storage.getCount( table )
 		self.updateTableProcessingRecord( table, ['tbl_size',], [size,] )
+
+	# The fused form of calculateTableSize. The OID column is always loaded, so counting it is free
+	def computeTableSize( self, table, columns ):
+		return ( {}, { 'tbl_size':len( columns[OID_FIELD] ) } )
 			
-	def calculateTableStatistics( self, table ):
-		# First we need to figure out which column index to look in for the z data
-		fields = [f.name for f in arcpy.ListFields( table )]
-		search_field = 'z'
-		field_index = fields.index( search_field )
-		sCur = arcpy.da.SearchCursor( table, search_field )
-		z_data = [float( row[0] ) for row in sCur]
-		# Calculate the classic aggregate stats
-		mean = sum( z_data ) / len( z_data )
-		median = sorted( z_data )[len( z_data ) / 2]
-		count_data = Counter( z_data )
-		mode = count_data.most_common(1)[0][0]  # Returns the highest occurring item
-		var = sum([ ( mean - z )**2.0 for z in z_data])/len( z_data )
-		std_dev = math.sqrt( var )
-		del sCur
-		del row
-		update_fields = [ 'tbl_std_dev', 'tbl_mean', 'tbl_med', 'tbl_mode' ]
-		update_values = [ std_dev, mean, median, mode ]
-		self.updateTableProcessingRecord( table, update_fields, update_values )
-		
-	# TODO: arcpy.da.UpdateCursor is supposed to be faster. Try and work that into the code
-	def addPercentiles( self, table ):
-		self.printIfVerbose( "Adding percentiles to %s." % table )
-		# Determine table size
-		result = arcpy.GetCount_management( table )
-		size = int( result.getOutput( 0 ) )
+	# Calculates the classic aggregate stats of the z values in one streaming pass, in constant memory (see StreamingStatistics)
+	# @param exact_mode = If True, the mode is the most common value rather than the centre of the most populated histogram bin. Costs memory per distinct value.
+	# If None, the processor's exact_mode is used
+	def calculateTableStatistics( self, table, exact_mode=None ):
+		if exact_mode == None:
+			exact_mode = self.exact_mode
+		stats = StreamingStatistics( exact_mode=exact_mode )
+		for columns in self.iterColumns( table, ['z'] ):
+			stats.update( columns['z'] )
+		updates = self.statisticsToRecord( stats )
+		self.updateTableProcessingRecord( table, list( updates.keys() ), list( updates.values() ) )
+
+	# The fused form of calculateTableStatistics, for a z column already in memory
+	def computeTableStatistics( self, table, columns ):
+		stats = StreamingStatistics( exact_mode=self.exact_mode )
+		stats.update( columns['z'] )
+		return ( {}, self.statisticsToRecord( stats ) )
+
+	# Returns the TPR fields and values recording a table's statistics
+	def statisticsToRecord( self, stats ):
+		return { 'tbl_std_dev':stats.getStdDev(), 'tbl_mean':stats.getMean(), 'tbl_med':stats.getMedian(), 'tbl_mode':stats.getMode() }
 
+	# Ranks the points by depth in memory instead of with a database sort, then writes the percentiles back by OID in bulk. Only the OID and z columns are read
+	# Tied depths get the same percentile (see PercentileRanking)
+	# @param external = If True, ranks with an external sort so that the z column never has to fit in memory. If None, tables larger than EXTERNAL_SORT_ROWS are ranked externally
+	def addPercentiles( self, table, external=None ):
+		self.printIfVerbose( "Adding percentiles to %s." % table )
 		# Add the percentile field to the table
-		new_field = 'percentile'
-		new_field_type = 'LONG'
-		arcpy.AddField_management( table, new_field, new_field_type, "", "", "", "", "", "", "" )
-		fields = [f.name for f in arcpy.ListFields( table )]
-		# Sort entries by depth (z)
-		sort_field = 'z'
-		prefix = ""
-		postfix = "ORDER BY %s DESC" % sort_field
-		sort_clauses = ( prefix, postfix )
-		uCur = arcpy.da.UpdateCursor( table, "*", "", "", "", sort_clauses )
-		index = 0
-		for row in uCur:
-			perc = int( ( float( index ) / float( size ) ) * 100.0 )
-			row[fields.index( new_field )] = perc
-			uCur.updateRow( row )
-			index += 1
-		del uCur
-		del row
+		self.storage.addField( table, PERCENTILE_FIELD, 'LONG' )
+		if external == None:
+			external = self.storage.getCount( table ) > EXTERNAL_SORT_ROWS
+		if external:
+			self.addPercentilesExternally( table, PERCENTILE_FIELD )
+		else:
+			columns = self.readColumns( table, [OID_FIELD, 'z'] )
+			( new_columns, updates ) = self.computePercentiles( table, columns )
+			self.storage.writeColumns( table, columns[OID_FIELD], new_columns )
 		self.updateTableProcessingRecord( table, ['has_perc',], [1,] )
 
+	# The fused form of addPercentiles, for a z column already in memory
+	def computePercentiles( self, table, columns ):
+		percs = ranksToPercentiles( rankDescending( columns['z'] ), len( columns['z'] ) )
+		return ( { PERCENTILE_FIELD:percs }, { 'has_perc':1 } )
+
+	# Ranks a table larger than memory in two passes over its chunks: the first writes each chunk to disk as a sorted run, the second ranks each chunk against the runs and writes its percentiles back
+	def addPercentilesExternally( self, table, new_field ):
+		# The runs go beside the point caches if there are any, since that disk is already sized for whole tables
+		temp_dir = None
+		if self.cache_dir != None and os.path.isdir( self.cache_dir ):
+			temp_dir = self.cache_dir
+		ranker = ExternalRanker( temp_dir )
+		try:
+			for columns in self.iterColumns( table, ['z'] ):
+				ranker.addRun( columns['z'] )
+			for columns in self.iterColumns( table, [OID_FIELD, 'z'] ):
+				percs = ranksToPercentiles( ranker.rank( columns['z'] ), ranker.size )
+				self.storage.writeColumns( table, columns[OID_FIELD], { new_field:percs } )
+		finally:
+			ranker.close()
+
+	# Returns the cache of KD trees kept beside the point caches, or None if there is no cache directory
+	def getTreeCache( self ):
+		from KDTreeCache import KDTreeCache
+		if self.cache_dir == None:
+			return None
+		return KDTreeCache( os.path.join( self.cache_dir, 'kdtrees' ), KDTREE_DISK_BUDGET )
+
+	# Returns the spatial index shared by every table, kept beside the point caches, or None if there is no cache directory
+	def getTileIndex( self ):
+		if self.cache_dir == None:
+			return None
+		return SpatialTileIndex( tileIndexDir( self.cache_dir ) )
+
+	# Adds a table's (projected) points to the shared spatial index, replacing any it had there, so that residuals of overlapping tables see each other's points
+	def indexTable( self, table ):
+		index = self.getTileIndex()
+		if index == None:
+			self.printIfVerbose( "No cache directory, so %s cannot be added to the spatial index." % table )
+			return
+		self.printIfVerbose( "Adding %s to the spatial index." % table )
+		columns = self.readColumns( table, [OID_FIELD, 'x', 'y', 'z'] )
+		index.addTable( table, columns['x'], columns['y'], columns['z'], columns[OID_FIELD] )
+		self.updateTableProcessingRecord( table, ['in_idx',], [1,] )
+
+	# Thins a table's (projected) points onto a grid in one streaming pass, keeping one point per occupied cell (see GridThinning), into a new table named
+	# after it (see thinnedTableName). Each thinned point records the number of points in its cell, and the OID of the point it came from.
+	# The thinned table is registered in the TPR beside the original, already projected, so later runs put it through the other stages and stages can
+	# opt into it in place of the original. It is neither thinned again, nor added to the spatial index, where its points would count twice
+	# A table with no two points in the same cell would be copied whole, so no thinned table is made for it
+	def thinTable( self, table ):
+		thin = thinnedTableName( table )
+		self.printIfVerbose( "Thinning %s into %s on a %g grid." % ( table, thin, self.thin_cell_size ) )
+		thinner = GridThinner( self.thin_cell_size, self.thin_method )
+		for columns in self.iterColumns( table, [OID_FIELD, 'x', 'y', 'z'] ):
+			thinner.add( columns['x'], columns['y'], columns['z'], columns[OID_FIELD] )
+		points = thinner.finish()
+		self.removeThinnedTable( thin )
+		if len( points['x'] ) == thinner.size:
+			self.printIfVerbose( "Thinning removes none of the %d points of %s, so it is left as it is." % ( thinner.size, table ) )
+			self.updateTableProcessingRecord( table, ['is_thin',], [1,] )
+			return
+		self.storage.createPointTable( thin, ALASKA_ALBERS )
+		self.storage.appendPoints( thin, points['x'], points['y'], points['z'] )
+		self.storage.addField( thin, 'cell_count', 'LONG' )
+		self.storage.addField( thin, 'src_oid', 'LONG' )
+		# Rows come back in the order they were appended
+		oids = self.storage.readColumns( thin, [OID_FIELD] )[OID_FIELD]
+		self.storage.writeColumns( thin, oids, { 'cell_count':points['count'], 'src_oid':points['oid'] } )
+		if self.cache_dir != None and os.path.isdir( self.cache_dir ):
+			writePointCache( cachePath( self.cache_dir, thin ), points['x'], points['y'], points['z'], oids )
+		self.printIfVerbose( "Kept %d of %d points of %s." % ( len( oids ), thinner.size, table ) )
+		self.tpr.addTable( thin )
+		self.updateTableProcessingRecord( thin, ['is_proj', 'is_thin', 'in_idx'], [1, 1, 1] )
+		self.updateTableProcessingRecord( table, ['is_thin',], [1,] )
+
+	# Drops a thinned table made by an earlier run, with its point cache and TPR row
+	def removeThinnedTable( self, thin ):
+		if self.storage.tableExists( thin ):
+			self.storage.deleteTable( thin )
+		if self.cache_dir != None and os.path.exists( cachePath( self.cache_dir, thin ) ):
+			os.remove( cachePath( self.cache_dir, thin ) )
+		self.tpr.removeTable( thin )
+
+	# Returns the tables a surface is built from by default: every projected table, except the thinned copies of tables which are in the TPR themselves,
+	# whose points would otherwise be counted twice
+	def selectSurfaceTables( self ):
+		tables = self.getTablesInTPR()
+		thinned = set( thinnedTableName( table ) for table in tables )
+		return [table for table in tables if table not in thinned and self.tpr.getValue( table, 'is_proj' ) == 1]
+
+	# Returns the ( xmin, ymin, xmax, ymax ) bounds of the points of some tables, from one streaming pass over their x and y columns. None if they have no points
+	def getTablesExtent( self, tables ):
+		( xmin, ymin, xmax, ymax ) = ( np.inf, np.inf, -np.inf, -np.inf )
+		for table in tables:
+			for columns in self.iterColumns( table, ['x', 'y'] ):
+				( X, Y ) = ( np.asarray( columns['x'], dtype=np.float64 ), np.asarray( columns['y'], dtype=np.float64 ) )
+				if len( X ) == 0 or np.isnan( X ).all():
+					continue
+				( xmin, xmax ) = ( min( xmin, np.nanmin( X ) ), max( xmax, np.nanmax( X ) ) )
+				( ymin, ymax ) = ( min( ymin, np.nanmin( Y ) ), max( ymax, np.nanmax( Y ) ) )
+		if not np.isfinite( [xmin, ymin, xmax, ymax] ).all():
+			return None
+		return ( float( xmin ), float( ymin ), float( xmax ), float( ymax ) )
+
+	# Streams the points of some tables into an empty grid with the passed geometry (see SurfaceGrid.getGeometry). Runs in a worker process when multiprocessing
+	def gridTables( self, geometry, tables ):
+		grid = SurfaceGrid( *geometry )
+		for table in tables:
+			for columns in self.iterColumns( table, ['x', 'y', 'z'] ):
+				grid.add( columns['x'], columns['y'], columns['z'] )
+		return grid
+
+	# Builds a gridded surface from the (projected) points of some tables, and writes it as a tiled, compressed GeoTIFF with overviews (see SurfaceGrid)
+	# Every table is streamed through one chunk at a time, so memory is proportional to the number of cells in the grid, not the number of points.
+	# When multiprocessing, the tables are shared between the workers, each worker fills a grid of its own, and the grids are merged, so memory is that many grids
+	# @param tables = The tables to grid. Defaults to every projected table (see selectSurfaceTables)
+	# @param extent = The ( xmin, ymin, xmax, ymax ) bounds of the surface. Defaults to the bounds of the tables' points, which costs a pass over their x and y columns
+	# @param bands = The statistics written, one band each (see SurfaceGrid.getBand)
+	# @return = The SurfaceGrid, or None if the tables have no points
+	def buildSurface( self, fp, cell_size=SURFACE_CELL_SIZE, tables=None, extent=None, bands=SURFACE_BANDS ):
+		if tables == None:
+			tables = self.selectSurfaceTables()
+		if extent == None:
+			extent = self.getTablesExtent( tables )
+		if extent == None:
+			self.printIfVerbose( "No points to build a surface from." )
+			return None
+		grid = SurfaceGrid.fromExtent( extent, cell_size )
+		self.printIfVerbose( "Building a %d x %d surface of %g cells from %d tables." % ( grid.ncols, grid.nrows, cell_size, len( tables ) ) )
+		with self.metrics.measure( 'stage', 'surface', os.path.basename( fp ) ) as measurement:
+			workers = min( max( 1, self.max_num_cpu ), len( tables ) )
+			if self.multiprocessing_on and workers > 1:
+				# Dealing the tables out largest first keeps the workers' shares of points even
+				tables = sorted( tables, key=lambda table: self.tpr.getValue( table, 'tbl_size' ) or 0, reverse=True )
+				p = mp.Pool( workers )
+				for partial in p.imap_unordered( functools.partial( self.gridTables, grid.getGeometry() ), [tables[start::workers] for start in range( 0, workers )] ):
+					grid.merge( partial )
+				p.close()
+			else:
+				grid = self.gridTables( grid.getGeometry(), tables )
+			grid.writeRaster( fp, ALASKA_ALBERS, bands )
+			measurement.setRows( int( grid.count.sum() ) )
+		self.printIfVerbose( "Wrote %s: %d of %d cells filled, %d points outside the surface." % ( fp, grid.getFilledCells(), grid.ncols * grid.nrows, grid.dropped ) )
+		return grid
+
 	# Calculates residual of each feature based on KNN model. Assumes table containes X, Y, and Z data.
-	# Not working because of python environment issues. <<-------------------------------------------------------------------------### TODO
-	def addResiduals( self, table ):
-		# First we get the OIDs, and the XYZ Data
-		fields = ( 'OBJECTID', 'x', 'y', 'z' )
-		sCur = arcpy.da.SearchCursor( table, fields, "", "", "", ( "", "" ) )
-		feats = list()
-		for row in sCur:
-			feats.append( ( row[fields.index( 'OBJECTID' )], row[fields.index( 'x' )], row[fields.index( 'y' )], row[fields.index( 'z' )] ) )
-		# feats now contains all of the features from the shapefile
-		# Now we simply calculate the residual for each feature
-		KNNM = KNNModel( feats, fields.index( 'x' ), fields.index( 'y' ), fields.index( 'z' )  )
-
-	# Projects the passed dataset to the Alaska Albers coordinate system. 
-	# Newly projected shapefile replaces the old one.
-	# @param table = filepath to the feature class to be projected
-	# @param dataset = The dataset the projected data will be copied into.
-	# This method is a mess. So much hacking away to try and deal with dataset and workspaces. GAH
-	def projectToAA( self, table, dataset=None, transformation=NAD1983_TO_AkAlb_Transformation ):
-		if dataset == None:
-			dataset = self.WRKSPC
-		print( dataset )
+	# Every estimator in estimators (see NeighborScores) is calculated from the same neighbor query, and written to its own column, named after it.
+	# Defaults to RESIDUAL_ESTIMATORS
+	# A table in the spatial index is scored against the points of every table overlapping it, reading only the tiles it touches. Any other table is scored on its own
+	# With a target_rate (points per second) or a time_budget (seconds for the whole table), the number of neighbors is calibrated to meet it (see
+	# KNNModel.CalibrateNumberOfNeighbors), otherwise NUM_NN neighbors are used. Either way the number used is recorded in the table's num_nn TPR field
+	# KNNModel is imported here rather than at the top of the module, so the rest of the processor still loads in environments without scipy
+	def addResiduals( self, table, estimators=None, target_rate=None, time_budget=None ):
+		from KNearestNeighborModel import KNNModel, NUM_NN
+		if estimators == None:
+			estimators = RESIDUAL_ESTIMATORS
+		calibrate = target_rate != None or time_budget != None
+		for field in estimators:
+			self.storage.addField( table, field, 'DOUBLE' )
+		index = self.getTileIndex()
+		if index != None and index.hasTable( table ):
+			num_nn = self.calibrateNeighbors( table, estimators, target_rate, time_budget ) if calibrate else NUM_NN
+			# Each tile's scores are written as soon as they are calculated, so only one tile's results are ever held
+			with self.storage.transaction():
+				for results in index.calculateResiduals( table, NUM_NN=num_nn, NAMES=estimators ):
+					self.writeScores( table, results[:, 3].astype( np.int64 ), results[:, 4:], estimators )
+		else:
+			# First we get the OIDs, and the XYZ Data. From the point cache, if there is one, so there is no cursor to walk
+			columns = self.readColumns( table, [OID_FIELD, 'x', 'y', 'z'] )
+			# Now we simply calculate the residual for each feature. The model holds views of the columns rather than a copy of them, and the KD tree comes
+			# from the tree cache if this table has been scored before
+			KNNM = KNNModel.FromColumns( columns['x'], columns['y'], columns['z'], TREE_CACHE=self.getTreeCache() )
+			if calibrate:
+				KNNM.CalibrateNumberOfNeighbors( target_rate, time_budget, NAMES=estimators )
+			num_nn = KNNM.GetNumberOfNearestNeighbors()
+			self.writeScores( table, columns[OID_FIELD], KNNM.CalculateScoresBatch( estimators ), estimators )
+		self.updateTableProcessingRecord( table, ['num_nn',], [num_nn,] )
+
+	# Picks the number of neighbors a table in the spatial index is scored with, to meet a target rate or time budget (see addResiduals)
+	# The model is timed on at most max_rows of the table's points, sampled at random, so that calibrating never builds a KD tree over more than that.
+	# A time budget is turned into a rate over every row of the table, not just the sample
+	def calibrateNeighbors( self, table, estimators, target_rate=None, time_budget=None, max_rows=CALIBRATION_ROWS ):
+		from KNearestNeighborModel import KNNModel
+		columns = self.readColumns( table, ['x', 'y', 'z'] )
+		size = len( columns['z'] )
+		rows = np.arange( size )
+		if size > max_rows:
+			rows = np.sort( np.random.default_rng( 0 ).choice( size, max_rows, replace=False ) )
+		if target_rate == None and time_budget != None:
+			( target_rate, time_budget ) = ( size / float( time_budget ), None )
+		KNNM = KNNModel.FromColumns( columns['x'][rows], columns['y'][rows], columns['z'][rows] )
+		return KNNM.CalibrateNumberOfNeighbors( target_rate, time_budget, NAMES=estimators )
+
+	# Writes one column per estimator, from a n x len( estimators ) array of scores
+	def writeScores( self, table, oids, scores, estimators ):
+		self.storage.writeColumns( table, oids, dict( ( field, scores[:, column] ) for ( column, field ) in enumerate( estimators ) ) )
+
+	# Returns the Albers projection tables are projected to, checked against reference points the first time it is asked for
+	def getProjection( self ):
+		if self.projection == None:
+			projection = AlbersEqualArea.fromWKT( NAD1983_TO_AkAlb_Transformation )
+			error = projection.validate()
+			self.printIfVerbose( "Albers projection agrees with the reference points to %.2g m." % error )
+			self.projection = projection
+		return self.projection
+
+	# Projects the x and y columns of a table from NAD83 longitude/latitude to Alaska Albers, in place, one chunk at a time.
+	# The whole table is rewritten in one transaction, and the point cache is rewritten to match before the table is recorded as projected
+	def projectToAA( self, table ):
 		self.printIfVerbose( "Projecting %s to AA." % table )
-		# The data needs to be projected into a new dataset, one which is defined as having the AA projection
-		# Using the dataset parameter, we can control where the projected data lands.
-		( dir, basename ) = os.path.split( table )
-		dir = os.path.join( self.GDB, dataset ) 
-		out_fc = os.path.join( dir, basename )
-		print( out_fc )
-		data_type = 'Shapefile'
-		# This is code exported by ArcGIS. The long string parameters in it are correct.
-		print( "arcpy.Project_management( \"%s\", \"%s\", \"%s\", \"\", \"\", \"NO_PRESERVE_SHAPE\", "", \"NO_VERTICAL\")" % ( table, dataset, "TRAN_STR" ) )
-		arcpy.Project_management( table, dataset, transformation, "", "", "NO_PRESERVE_SHAPE", "", "NO_VERTICAL")
-		self.updateTableProcessingRecord( table, ['is_proj',], [1,] )
-	
-	# Builds point geometry for each feature of the passed dataset. Assumes that X and Y fields are already present in the feature class
-	def buildGeometry( self, table ):
-		# First, we add the shape field
-		arcpy.AddField_management( table, 'Shape', 'Geometry' )
-		update_fields = ( 'x', 'y', 'Shape' )
-		x_index = update_fields.index( 'x' )
-		y_index = update_fields.index( 'y' )
-		shape_index = update_fields.index( 'Shape' )
-		# Then we build the geometry values into the new field
-		uCur = arcpy.da.UpdateCursor( table, update_fields )
-		for row in uCur:
-			point = arcpy.Point( row[x_index], row[y_index] )
-			pt_geom = arcpy.PointGeometry( point )
-			row[shape_index] = pt_geom
-			uCur.updateRow( row )
-		del uCur
-		del row
+		projection = self.getProjection()
+		writer = None
+		fields = [OID_FIELD, 'x', 'y']
+		if self.openPointCache( table ) != None:
+			writer = PointCacheWriter( cachePath( self.cache_dir, table ) )
+			fields.append( 'z' )
+		# The coordinates are rewritten in place, so is_proj is committed with them: were it lost, the next run would project metres as if they were degrees.
+		# The new cache replaces the old one before the commit, so a failed replace rolls the coordinates back too
+		try:
+			with self.storage.transaction():
+				for columns in self.iterColumns( table, fields ):
+					( X, Y ) = projection.forward( columns['x'], columns['y'], self.max_num_cpu )
+					self.storage.writeColumns( table, columns[OID_FIELD], { 'x':X, 'y':Y } )
+					if writer != None:
+						writer.append( X, Y, columns['z'], columns[OID_FIELD] )
+				# The last chunk is a view of the old cache, which must be unmapped before it can be replaced
+				columns = None
+				if writer != None:
+					writer.close()
+				self.tpr.updateNow( table, ['is_proj',], [1,] )
+		except:
+			if writer != None:
+				writer.abort()
+			raise
+
+	# The fused form of projectToAA, for x and y columns already in memory
+	def computeProjection( self, table, columns ):
+		( X, Y ) = self.getProjection().forward( columns['x'], columns['y'], self.max_num_cpu )
+		return ( { 'x':X, 'y':Y }, { 'is_proj':1 } )
+
+	# Rewrites a table's point cache with new x, y or z values, so that it keeps matching storage. The new cache replaces the old one atomically
+	# @param oids = The object IDs the values belong to
+	# @param columns = A dictionary of cached field name to array
+	# The new cache is written a chunk at a time, and the old one is unmapped before it is replaced, which Windows requires
+	def updatePointCache( self, table, oids, columns ):
+		cache = self.openPointCache( table )
+		if cache == None or not any( field in ( 'x', 'y', 'z' ) for field in columns ):
+			return
+		oids = np.asarray( oids )
+		sorter = np.argsort( oids, kind='stable' )
+		writer = PointCacheWriter( cachePath( self.cache_dir, table ) )
+		try:
+			for start in range( 0, len( cache ), CHUNK_SIZE ):
+				OID = np.array( cache.oid[start:start + CHUNK_SIZE] )
+				positions = sorter[np.searchsorted( oids[sorter], OID )]
+				( X, Y, Z ) = [np.asarray( columns[field] )[positions] if field in columns else np.array( getattr( cache, field )[start:start + CHUNK_SIZE] ) for field in ( 'x', 'y', 'z' )]
+				writer.append( X, Y, Z, OID )
+			cache.close()
+			writer.close()
+		except:
+			writer.abort()
+			raise
+
+	# Builds point geometry for every row of a table from its (projected) x and y columns, with its spatial index, in one bulk write
+	def buildGeometry( self, table, spatial_index=BUILD_SPATIAL_INDEX ):
+		self.printIfVerbose( "Building geometry for %s." % table )
+		columns = self.readColumns( table, [OID_FIELD, 'x', 'y'] )
+		self.storage.writeGeometry( table, columns[OID_FIELD], columns['x'], columns['y'], ALASKA_ALBERS, spatial_index )
+		self.updateTableProcessingRecord( table, ['has_shp',], [1,] )
+
+	def addXYZData( self, table ):
+		self.printIfVerbose( "addXYData not implemented.")
 	
+	# This function will return an instance of the processing dictionary, which will dictate which processes are applied to which datasets.
+	# Each key in the dictionary is a field in the Table Processing Record, and each value is the ProcessingStage which sets it (see ProcessingPlan).
+	# A stage is applied to every table which has a 0 in its field (denoting processing not yet done), after every stage it depends on.
+	# Stages which declare the columns they read and write, and provide a compute function, share one read and one write of each table.
+	# To add a new layer of processing, write the processing function (func) which sets a TPR field (f), and add a new entry ( f:ProcessingStage( f, func, depends=... ) )
+	def defineProcessingDictionary( self ):
+		proc_dict = {
+		'tbl_size'       :ProcessingStage( 'tbl_size', self.calculateTableSize, self.computeTableSize ),
+		'has_xyz'        :ProcessingStage( 'has_xyz', self.addXYZData ),
+		'has_perc'       :ProcessingStage( 'has_perc', self.addPercentiles, self.computePercentiles, depends=( 'has_xyz', ), reads=( 'z', ), writes=( ( PERCENTILE_FIELD, 'LONG' ), ) ),
+		'tbl_std_dev'    :ProcessingStage( 'tbl_std_dev', self.calculateTableStatistics, self.computeTableStatistics, depends=( 'has_xyz', ), reads=( 'z', ) ),
+		'is_proj'        :ProcessingStage( 'is_proj', self.projectToAA, self.computeProjection, depends=( 'has_xyz', ), reads=( 'x', 'y' ), writes=( ( 'x', 'DOUBLE' ), ( 'y', 'DOUBLE' ) ) ),
+		'has_shp'        :ProcessingStage( 'has_shp', self.buildGeometry, depends=( 'has_xyz', 'is_proj' ) ),
+		'in_idx'         :ProcessingStage( 'in_idx', self.indexTable, depends=( 'has_xyz', 'is_proj' ) )
+		}
+		if self.thin_on:
+			proc_dict['is_thin'] = ProcessingStage( 'is_thin', self.thinTable, depends=( 'has_xyz', 'is_proj' ) )
+		return proc_dict
+
+	# Returns the stages of the plan which table has not undergone, in plan order
+	def selectPendingStages( self, table ):
+		return [stage for stage in self.plan if self.tpr.getValue( table, stage.flag ) == 0]
+
+	# The main processing method. Selects every table from the tpr with a 0 in any stage's field, then runs all of its pending stages in one go.
+	# Supports multiprocssing
+	def processTables( self ):
+		tables = [table for table in self.getTablesInTPR() if len( self.selectPendingStages( table ) )]
+		self.printIfVerbose( "Processing %d tables." % len( tables ) )
+		if self.multiprocessing_on:
+			# If execution reaches this line, multiprocessing has been turned on
+			# We define a work pool, which will map our inputs the the process we speciy, while keeping the number of spawned processes below a set maximum (self.max_num_cpu)
+			p = mp.Pool( self.max_num_cpu )
+			p.map( self.processTable, tables )
+			p.close()
+			# Each worker flushed its own TPR updates (see processTable), so our index is out of date
+			self.tpr.load()
+		else:
+			for table in tables:
+				self.processTable( table )
+		self.tpr.flush()
+
+	# Runs every pending stage of a single table in plan order, logging any error. A stage whose dependencies failed, or did not record
+	# themselves as done, is skipped. Fusable stages are gathered and run together, just before the first stage which depends on one of them
+	# A worker process has its own copy of the TPR, which disappears with the worker, so in multiprocessing mode the record is flushed after every table
+	def processTable( self, table ):
+		pending = self.selectPendingStages( table )
+		fuse = any( stage.isFusable() for stage in pending ) and self.storage.getCount( table ) <= FUSED_MAX_ROWS
+		unfinished = set( stage.flag for stage in pending )
+		batch = list()
+		for stage in pending:
+			batched = set( member.flag for member in batch )
+			if any( dependency in unfinished and dependency not in batched for dependency in stage.depends ):
+				self.printIfVerbose( "Skipping '%s' for %s, a stage it depends on did not finish." % ( stage.flag, table ) )
+				continue
+			if fuse and stage.isFusable():
+				batch.append( stage )
+				continue
+			if len( batched.intersection( stage.depends ) ):
+				unfinished -= self.runFusedStages( table, batch )
+				batch = list()
+				if len( unfinished.intersection( stage.depends ) ):
+					self.printIfVerbose( "Skipping '%s' for %s, a stage it depends on did not finish." % ( stage.flag, table ) )
+					continue
+			try:
+				with self.metrics.measure( 'stage', stage.flag, table ) as measurement:
+					stage.apply( table )
+					measurement.setRows( self.tpr.getValue( table, 'tbl_size' ) or None )
+				if self.tpr.getValue( table, stage.flag ) != 0:
+					unfinished.discard( stage.flag )
+			except Exception as e:
+				self.logError( table, stage.flag, e )
+		if len( batch ):
+			self.runFusedStages( table, batch )
+		if self.multiprocessing_on:
+			self.tpr.flush()
+
+	# Runs a group of fusable stages on a table with one read of its columns, one write of the columns they produce, and one TPR update
+	# Each stage sees the columns written by the stages before it
+	# @return = The flags of the stages which finished
+	def runFusedStages( self, table, stages ):
+		self.printIfVerbose( "Running %s on %s." % ( ", ".join( "'%s'" % stage.flag for stage in stages ), table ) )
+		try:
+			with self.metrics.measure( 'stage', 'load', table ) as measurement:
+				columns = dict( self.readColumns( table, [OID_FIELD] + fusedReads( stages ) ) )
+				measurement.setRows( len( columns[OID_FIELD] ) )
+		except Exception as e:
+			for stage in stages:
+				self.logError( table, stage.flag, e )
+			return set()
+		new_columns = dict()
+		updates = dict()
+		done = list()
+		fused = set( stage.flag for stage in stages )
+		for stage in stages:
+			if any( dependency in fused and dependency not in [member.flag for member in done] for dependency in stage.depends ):
+				continue
+			try:
+				with self.metrics.measure( 'stage', stage.flag, table ) as measurement:
+					( stage_columns, stage_updates ) = stage.compute( table, columns )
+					measurement.setRows( len( columns[OID_FIELD] ) )
+			except Exception as e:
+				self.logError( table, stage.flag, e )
+				continue
+			columns.update( stage_columns )
+			new_columns.update( stage_columns )
+			updates.update( stage_updates )
+			done.append( stage )
+		try:
+			if len( new_columns ):
+				with self.metrics.measure( 'stage', 'store', table ) as measurement:
+					for stage in done:
+						for ( field, field_type ) in stage.writes:
+							self.storage.addField( table, field, field_type )
+					# Columns read from the point cache are views of it, which must be let go before updatePointCache replaces it
+					oids = np.array( columns[OID_FIELD] )
+					columns = None
+					# The columns, the cache and the stages' TPR fields are committed together, as in projectToAA
+					with self.storage.transaction():
+						self.storage.writeColumns( table, oids, new_columns )
+						self.updatePointCache( table, oids, new_columns )
+						if len( updates ):
+							self.tpr.updateNow( table, list( updates.keys() ), list( updates.values() ) )
+					measurement.setRows( len( oids ) )
+			elif len( updates ):
+				self.updateTableProcessingRecord( table, list( updates.keys() ), list( updates.values() ) )
+		except Exception as e:
+			for stage in done:
+				self.logError( table, stage.flag, e )
+			return set()
+		return set( stage.flag for stage in done if self.tpr.getValue( table, stage.flag ) != 0 )
+
+"""
+Class which wraps a single File Geodatabase (and dataset within, if specified) and provides the processes which need arcpy.
+"""
+class ArcGDBDataProcessor( DataProcessor ):
+	# @param cache_dir = The directory holding the point caches written at import time. Defaults to a directory beside the GDB
+	# @param err_log_fp = The error log. Defaults to a file beside the GDB
+	# @param metrics_fp = The JSON-lines metrics log. If None, nothing is measured
+	def __init__( self, FGDB, TPR='Table_Processing_Record', dataset=None, verbose=False, multiprocessing_on=False, free_cores=4, cache_dir=None, err_log_fp=None, metrics_fp=None, thin_cell_size=THIN_CELL_SIZE, thin_method=THIN_METHOD, thin_on=False, exact_mode=False ):
+		self.GDB = FGDB
+		if cache_dir == None:
+			cache_dir = defaultCacheDir( self.GDB )
+		if err_log_fp == None:
+			err_log_fp = os.path.splitext( os.path.normpath( self.GDB ) )[0] + '_proc_err_log.txt'
+		self.dataset = dataset
+		self.TPR = os.path.join( self.GDB, TPR )
+		# Define workspace
+		self.WRKSPC = self.GDB
+		if self.dataset != None:
+			self.WRKSPC = os.path.join( self.GDB, self.dataset )
+		# The TPR is a plain table, and so always lives in the root of the GDB rather than in the dataset
+		DataProcessor.__init__( self, ArcGDBBackend( self.GDB, dataset ), TableProcessingRecord( ArcGDBBackend( self.GDB ), TPR, verbose ), verbose, multiprocessing_on, free_cores, cache_dir, err_log_fp, metrics_fp, thin_cell_size, thin_method, thin_on, exact_mode )
+		arcpy.env.workspace = self.WRKSPC
+
 	def standardizeFieldNames( self, table ):
 		# For the sake of consistancy, we need to rename the fields to standard names
 		# Due to the large number of different sources of the material, we encounter tables with a wide variety of field names. We want them to all condense into the three we like: x, y, and z
@@ -256,43 +659,27 @@ class ArcGDBDataProcessor( DataProcessor ):
 		update_values = [1,]
 		self.updateTableProcessingRecord( table, update_fields, update_values )
 	
-	# This function will return an instance of the processing dictionary, which will dictate which processes are applied to which datasets.
-	# Each key in the dictionary will refer to a field in the Table Processing Record, and each value will consist of one or more functions.
-	# For each dictionary entry, the value functions will be applied to all tables which do not have a 1 in the key field (denoting completed processing)
-	# This method streamlines adding processing functionality. In order to add a new layer of processing to the control flow, simply write the processing function (func) which refers to a TPR field (f), and create a new entry in the processing dictionary ( f:func )
-	def defineProcessingDictionary( self ):
-		proc_dict = {
-		'tbl_size'		 :self.calculateTableSize,
-		'has_x'          :self.addXYZData,
-		'perc'			 :self.addPercentiles,
-		'is_proj'        :self.projectToAA,
-		'tbl_std_dev'    :self.calculateTableStatistics,
-		'has_shp'		 :self.buildGeometry
-		}
-		return proc_dict
-		
-	# The main processing method. Cycles through every key in the proc_dict, selects all tables from the tpr with 0's in the key field, then applies the value process to each table.
-	# Supports multiprocssing
-	def processTables( self ):
-		# An inelegant way of ordering the processes. Totally breaks the intended functionality. Needs to be fixed
-		# This could be substitued by a single int/char preceding each function. The int/char would indicate the order of the list, and would simply be removed fromt the field_name prior to use. Not as pretty, but better than this list.
-		processes = ( 'has_x', 'perc', 'tbl_std_dev', 'has_shp', 'is_proj' )
-		for field in processes:
-			tables = self.selectTablesByProcessingRecord( field )
-			if self.multiprocessing_on:
-				# If execution reaches this line, multiprocessing has been turned on
-				# We define a work pool, which will map our inputs the the process we speciy, while keeping the number of spawned processes below a set maximum (self.max_num_cpu)
-				p = mp.Pool( self.max_num_cpu )
-				p.map( self.proc_dict[field], tables )
-			else:
-				for table in tables:
-					try:
-						self.proc_dict[field]( table )
-					except Exception as e:
-						log = open( self.err_log_fp, 'a' )
-						log.write( "\nError while processing %s.\nProccessing field: %s\n%s\n" % ( table, field, str( e ) ) )
-						log.close()
 
+"""
+Class which wraps a single GeoPackage. Needs neither arcpy nor ArcGIS, so it runs on any machine.
+"""
+class SQLiteDataProcessor( DataProcessor ):
+	# @param GPKG = The file path to the GeoPackage
+	# @param cache_dir = The directory holding the point caches written at import time. Defaults to a directory beside the GeoPackage
+	# @param err_log_fp = The error log. Defaults to a file beside the GeoPackage
+	# @param metrics_fp = The JSON-lines metrics log. If None, nothing is measured
+	def __init__( self, GPKG, TPR='Table_Processing_Record', verbose=False, multiprocessing_on=False, free_cores=4, cache_dir=None, err_log_fp=None, metrics_fp=None, thin_cell_size=THIN_CELL_SIZE, thin_method=THIN_METHOD, thin_on=False, exact_mode=False ):
+		self.GPKG = GPKG
+		if cache_dir == None:
+			cache_dir = defaultCacheDir( self.GPKG )
+		if err_log_fp == None:
+			err_log_fp = os.path.splitext( self.GPKG )[0] + '_proc_err_log.txt'
+		storage = SQLiteBackend( self.GPKG )
+		DataProcessor.__init__( self, storage, TableProcessingRecord( storage, TPR, verbose ), verbose, multiprocessing_on, free_cores, cache_dir, err_log_fp, metrics_fp, thin_cell_size, thin_method, thin_on, exact_mode )
+
+	# Point tables in a GeoPackage are created with x, y and z columns, so there is nothing to add
+	def addXYZData( self, table ):
+		self.updateTableProcessingRecord( table, ['has_xyz',], [1,] )
 		
 def returnTestProcessor():
 	TPR = r"Table_Processing_Record"
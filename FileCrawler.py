@@ -0,0 +1,59 @@
+# File Crawler
+# Finds every file under a directory tree with os.scandir, scanning many directories at once on a pool of threads. On a network file system almost all of a crawl
+# is spent waiting on the server, so while one thread waits on a directory listing the others carry on. Records are yielded as each directory is scanned,
+# so whatever consumes them can start work long before the crawl is finished.
+# Each file's size and modification time come from the scan itself and travel with its record, so nothing downstream needs to stat the file again.
+# As with os.walk, symbolic links to directories are not followed, and directories which cannot be read are skipped.
+import os
+import os.path
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+CRAWL_THREADS = 16 # The default number of directories scanned at once
+
+FileRecord = namedtuple( 'FileRecord', ( 'ext', 'path', 'size', 'mtime_ns' ) )
+
+# Scans a single directory
+# @return = A ( list of FileRecords, list of subdirectory paths ) tuple
+def scanDirectory( directory, extensions ):
+	records = list()
+	subdirectories = list()
+	try:
+		with os.scandir( directory ) as entries:
+			for entry in entries:
+				try:
+					if entry.is_dir( follow_symlinks=False ):
+						subdirectories.append( entry.path )
+						continue
+					ext = os.path.splitext( entry.name )[1]
+					if extensions != None and ext not in extensions:
+						continue
+					if entry.is_file():
+						stat = entry.stat()
+						records.append( FileRecord( ext, entry.path, stat.st_size, stat.st_mtime_ns ) )
+				except OSError:
+					pass # The file vanished, or is a broken link
+	except OSError:
+		pass
+	return ( records, subdirectories )
+
+# Generator which crawls a directory tree, yielding a FileRecord for every file in it. Records come in no particular order
+# @param extensions = If given, only files with one of these extensions (with the dot, as os.path.splitext returns them) are yielded
+# @param threads = The number of directories scanned at once
+def crawlFiles( root, extensions=None, threads=CRAWL_THREADS ):
+	if extensions != None:
+		extensions = set( extensions )
+	executor = ThreadPoolExecutor( max( 1, threads ) )
+	try:
+		pending = set( [executor.submit( scanDirectory, root, extensions )] )
+		while len( pending ):
+			( done, pending ) = wait( pending, return_when=FIRST_COMPLETED )
+			for future in done:
+				( records, subdirectories ) = future.result()
+				for directory in subdirectories:
+					pending.add( executor.submit( scanDirectory, directory, extensions ) )
+				for record in records:
+					yield record
+	finally:
+		# If the consumer stops early, the directories not yet scanned are dropped
+		executor.shutdown( wait=True, cancel_futures=True )
@@ -0,0 +1,136 @@
+# Grid Thinning
+# Thins a table's points onto a regular XY grid in one streaming pass, keeping one representative point per occupied cell, and the number of points in the cell.
+# Each point's cell is hashed into a single int64 key, so a chunk is reduced to one row per cell with a sort, and never needs a grid array the size of the extent.
+# The representative of a cell is chosen by its z value:
+#	min		The shallowest point (the smallest z)
+#	max		The deepest point (the largest z)
+#	median	The point holding the median z of the cell (the lower of the two middle points when the cell has an even count)
+#	centre	The point nearest the centre of the cell
+# Ties go to the point with the smallest OID, so thinning a table twice gives the same result.
+# For min, max and centre only the best point of each cell seen so far is kept, so memory grows with the number of occupied cells. A median needs every
+# z value of a cell, so for median the whole table is held until finish(): its memory is O(rows), not O(cells), and it should only be asked for on
+# tables which fit in memory
+import numpy as np
+
+THIN_CELL_SIZE = 50.0 # The default width and height of a cell, in XY units (metres, once tables are projected)
+THIN_METHOD = 'min' # The shoal-biased choice. Memory grows with the number of occupied cells (see above for why median is not the default)
+THIN_METHODS = ( 'min', 'max', 'median', 'centre' )
+THIN_SUFFIX = '_thin'
+KEY_OFFSET = 2 ** 31 # Shifts a row index into the low 32 bits of a cell key
+
+# Returns the name of the table a table is thinned into
+def thinnedTableName( table ):
+	return table + THIN_SUFFIX
+
+# Raised when a thinning method is asked for which does not exist
+class ThinningMethodException( Exception ):
+	def __init__( self, method ):
+		self.method = method
+
+	def __str__( self ):
+		return "Unknown thinning method '%s'. Expected one of %s" % ( self.method, ", ".join( THIN_METHODS ) )
+
+class GridThinner( object ):
+	# @param cell_size = The width and height of a grid cell. Cell ( i, j ) covers i * size <= x < ( i + 1 ) * size, j * size <= y < ( j + 1 ) * size
+	# @param method = How the representative point of a cell is chosen, one of THIN_METHODS
+	def __init__( self, cell_size=THIN_CELL_SIZE, method=THIN_METHOD ):
+		if method not in THIN_METHODS:
+			raise ThinningMethodException( method )
+		self.cell_size = float( cell_size )
+		self.method = method
+		self.kept = None # The reduced rows: one per cell, or every row for a median
+		self.pending = list() # Rows added since the last compaction
+		self.pending_rows = 0
+		self.size = 0
+
+	# Hashes the cell of each point into an int64: the column index in the high 32 bits, the row index in the low 32
+	def cellKeys( self, X, Y ):
+		I = np.floor( X / self.cell_size ).astype( np.int64 )
+		J = np.floor( Y / self.cell_size ).astype( np.int64 )
+		return ( I << 32 ) + ( J + KEY_OFFSET )
+
+	# Returns the value each point is ranked by within its cell. The point with the smallest rank represents the cell
+	def rankPoints( self, X, Y, Z ):
+		if self.method == 'min':
+			return Z
+		if self.method == 'max':
+			return -Z
+		if self.method == 'centre':
+			half = self.cell_size / 2.0
+			DX = X - ( np.floor( X / self.cell_size ) * self.cell_size + half )
+			DY = Y - ( np.floor( Y / self.cell_size ) * self.cell_size + half )
+			return DX * DX + DY * DY
+		return Z # A median sorts by z too, but picks the middle of each cell rather than the first
+
+	# Adds a chunk of points. Points with a NaN coordinate are ignored
+	def add( self, X, Y, Z, OID ):
+		X = np.asarray( X, dtype=np.float64 )
+		Y = np.asarray( Y, dtype=np.float64 )
+		Z = np.asarray( Z, dtype=np.float64 )
+		OID = np.asarray( OID, dtype=np.int64 )
+		valid = ~( np.isnan( X ) | np.isnan( Y ) | np.isnan( Z ) )
+		if not valid.all():
+			( X, Y, Z, OID ) = ( X[valid], Y[valid], Z[valid], OID[valid] )
+		if len( X ) == 0:
+			return
+		rows = { 'key':self.cellKeys( X, Y ), 'rank':self.rankPoints( X, Y, Z ), 'x':X, 'y':Y, 'z':Z, 'oid':OID, 'count':np.ones( len( X ), dtype=np.int64 ) }
+		if self.method != 'median':
+			rows = self.reduce( rows )
+		self.pending.append( rows )
+		self.pending_rows += len( rows['key'] )
+		self.size += len( X )
+		# Compacting whenever the pending rows outnumber the kept ones keeps the total work proportional to the number of rows, not rows * chunks
+		if self.method != 'median' and self.pending_rows > ( 0 if self.kept == None else len( self.kept['key'] ) ):
+			self.compact()
+
+	# Merges the pending rows into the kept ones
+	def compact( self ):
+		parts = self.pending if self.kept == None else [self.kept] + self.pending
+		if len( parts ) == 0:
+			return
+		rows = dict( ( column, np.concatenate( [part[column] for part in parts] ) ) for column in parts[0] )
+		self.kept = rows if self.method == 'median' else self.reduce( rows )
+		self.pending = list()
+		self.pending_rows = 0
+
+	# Sorts rows by cell, then rank, then OID
+	# @return = The sorted rows, and the index of the first row of each cell
+	def sortByCell( self, rows ):
+		order = np.lexsort( ( rows['oid'], rows['rank'], rows['key'] ) )
+		rows = dict( ( column, values[order] ) for ( column, values ) in rows.items() )
+		starts = np.flatnonzero( np.concatenate( ( [True], rows['key'][1:] != rows['key'][:-1] ) ) )
+		return ( rows, starts )
+
+	# Reduces rows to the best ranked row of each cell, carrying the total count of the cell
+	def reduce( self, rows ):
+		( rows, starts ) = self.sortByCell( rows )
+		counts = np.add.reduceat( rows['count'], starts )
+		rows = dict( ( column, values[starts] ) for ( column, values ) in rows.items() )
+		rows['count'] = counts
+		return rows
+
+	# Returns the number of occupied cells. For a median this compacts, so it costs a sort of every point
+	def getCellCount( self ):
+		self.compact()
+		if self.kept == None:
+			return 0
+		if self.method == 'median':
+			return len( np.unique( self.kept['key'] ) )
+		return len( self.kept['key'] )
+
+	# Returns the thinned points, one per occupied cell, ordered by cell
+	# @return = A dictionary of 'x', 'y', 'z', 'oid' (the OID of the representative point in the source table) and 'count' (the number of points in its cell)
+	def finish( self ):
+		self.compact()
+		if self.kept == None:
+			empty = dict( ( column, np.empty( 0, dtype=np.float64 ) ) for column in ( 'x', 'y', 'z' ) )
+			empty.update( { 'oid':np.empty( 0, dtype=np.int64 ), 'count':np.empty( 0, dtype=np.int64 ) } )
+			return empty
+		if self.method == 'median':
+			( rows, starts ) = self.sortByCell( self.kept )
+			counts = np.diff( np.concatenate( ( starts, [len( rows['key'] )] ) ) )
+			middles = starts + ( counts - 1 ) // 2
+			result = dict( ( column, rows[column][middles] ) for column in ( 'x', 'y', 'z', 'oid' ) )
+			result['count'] = counts.astype( np.int64 )
+			return result
+		return dict( ( column, self.kept[column] ) for column in ( 'x', 'y', 'z', 'oid', 'count' ) )
@@ -0,0 +1,108 @@
+# Import Manifest
+# Records every source file a DataImporter has imported: its size, modification time and a hash of its contents, and the table it became.
+# On a re-run, a file whose size and modification time are unchanged is skipped without being opened. Only a file whose size or modification time
+# has changed is hashed, and only one whose contents have actually changed is imported again.
+# The manifest is a small SQLite database beside the imported data, so it works the same whatever the data is stored in, and worker processes can share it.
+import os
+import os.path
+import time
+import sqlite3
+import hashlib
+
+HASH_BLOCK_SIZE = 1048576 # Bytes read at a time while hashing a file
+
+# The states classify() can find a file in
+NEW = 'new' # Never imported
+UNCHANGED = 'unchanged' # Same size and modification time as when it was imported
+TOUCHED = 'touched' # Size or modification time changed, but the contents did not
+CHANGED = 'changed' # The contents changed since it was imported
+
+# Returns the default manifest path for a GDB or GeoPackage: a sibling file named after it
+def defaultManifestPath( DB ):
+	return os.path.normpath( DB ) + '_manifest.sqlite'
+
+# Returns the hash of a file's contents
+def hashFile( fp ):
+	digest = hashlib.blake2b( digest_size=20 )
+	with open( fp, 'rb' ) as f:
+		block = f.read( HASH_BLOCK_SIZE )
+		while len( block ):
+			digest.update( block )
+			block = f.read( HASH_BLOCK_SIZE )
+	return digest.hexdigest()
+
+class ImportManifest( object ):
+	# @param fp = The path of the manifest database. It is created if it does not exist
+	# @param timeout = Seconds to wait for another process's write to finish before giving up
+	def __init__( self, fp, timeout=60.0 ):
+		self.fp = fp
+		self.timeout = timeout
+		self.connection = None
+		self.entries = None
+		self.execute( "CREATE TABLE IF NOT EXISTS import_manifest ( path TEXT PRIMARY KEY, tbl_name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL, date_imported TEXT NOT NULL )" )
+
+	# The connection cannot be pickled, so a copy of the manifest sent to a worker process opens its own
+	def __getstate__( self ):
+		state = dict( self.__dict__ )
+		state['connection'] = None
+		return state
+
+	def connect( self ):
+		if self.connection == None:
+			self.connection = sqlite3.connect( self.fp, timeout=self.timeout, isolation_level=None )
+			self.connection.execute( "PRAGMA journal_mode=WAL" )
+		return self.connection
+
+	def execute( self, sql, parameters=() ):
+		return self.connect().execute( sql, parameters )
+
+	def close( self ):
+		if self.connection != None:
+			self.connection.close()
+			self.connection = None
+
+	# Reads the whole manifest into memory, so that checking tens of thousands of files costs one query
+	def load( self ):
+		self.entries = dict()
+		for ( path, table, size, mtime_ns, digest ) in self.execute( "SELECT path, tbl_name, size, mtime_ns, hash FROM import_manifest" ):
+			self.entries[path] = ( table, size, mtime_ns, digest )
+
+	def getEntry( self, fp ):
+		if self.entries == None:
+			self.load()
+		return self.entries.get( os.path.abspath( fp ) )
+
+	# Works out whether a file has changed since it was imported. The file is only read if its size or modification time has changed
+	# @param size, mtime_ns = The file's size and modification time (in nanoseconds), if the caller already has them. Otherwise the file is stat'ed
+	# @return = A ( state, hash ) tuple. The hash is None if the file was not read
+	def classify( self, fp, size=None, mtime_ns=None ):
+		( size, mtime_ns ) = self.getStat( fp, size, mtime_ns )
+		entry = self.getEntry( fp )
+		if entry == None:
+			return ( NEW, None )
+		( table, old_size, old_mtime_ns, digest ) = entry
+		if size == old_size and mtime_ns == old_mtime_ns:
+			return ( UNCHANGED, digest )
+		new_digest = hashFile( fp )
+		if new_digest == digest:
+			return ( TOUCHED, new_digest )
+		return ( CHANGED, new_digest )
+
+	# Records that fp has been imported as table
+	# @param digest = The hash of the file, if the caller already has it
+	# @param size, mtime_ns = As for classify
+	def record( self, fp, table, digest=None, size=None, mtime_ns=None ):
+		fp = os.path.abspath( fp )
+		( size, mtime_ns ) = self.getStat( fp, size, mtime_ns )
+		if digest == None:
+			digest = hashFile( fp )
+		self.execute( "INSERT OR REPLACE INTO import_manifest ( path, tbl_name, size, mtime_ns, hash, date_imported ) VALUES ( ?, ?, ?, ?, ?, ? )", ( fp, table, size, mtime_ns, digest, time.strftime( "%Y/%m/%d" ) ) )
+		if self.entries != None:
+			self.entries[fp] = ( table, size, mtime_ns, digest )
+
+	# Returns a file's ( size, mtime_ns ), from the passed values if there are any, otherwise from os.stat
+	def getStat( self, fp, size, mtime_ns ):
+		if size == None or mtime_ns == None:
+			stat = os.stat( fp )
+			return ( stat.st_size, stat.st_mtime_ns )
+		return ( size, mtime_ns )
@@ -0,0 +1,235 @@
+# Import Pipeline
+# Imports text point files (m77t and xyz) with reading, parsing and writing overlapped, so that the disk never waits on the parser or the parser on the database:
+#	Reader threads read each file in blocks of whole lines, and hand every block to a pool of parse processes
+#	The parse processes turn blocks into typed ( X, Y, Z ) columns, dropping malformed and NaN rows, exactly as the chunk readers do
+#	A single writer, the calling thread, appends the parsed columns to the database and the point caches in file order, and registers each finished table in the TPR
+# The queue between the readers and the writer is bounded, which bounds the number of blocks in flight: readers wait while the writer falls behind, and the
+# writer waits while the parsers do. Throughput settles at whichever of the disk, the parsers or the database is slowest.
+# Everything touching the database runs in the calling thread, so the storage backend, TPR and manifest are never shared between threads.
+import os
+import os.path
+import io
+import time
+import queue
+import threading
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+from M77TReader import readHeader, parseLines
+from PointCache import PointCacheWriter, cachePath
+from ImportScheduler import ImportResult
+from Instrumentation import readPeakRSS
+
+READER_THREADS = 4 # The default number of files read at once
+QUEUE_DEPTH = 16 # The default number of blocks allowed between the readers and the writer
+BLOCK_BYTES = 8388608 # The default size of a block read from a file. A block is extended to the end of its last line
+PUT_POLL = 0.1 # Seconds a reader waits on a full queue before checking whether the pipeline has been stopped
+
+# The kinds of item passed from the readers to the writer
+START = 'start' # A file's header has been read
+BLOCK = 'block' # A block of a file is being parsed. The payload is the pending parse result
+END = 'end' # Every block of a file has been handed over
+FAILED = 'failed' # A file could not be read. The payload is the exception
+DONE = 'done' # A reader has run out of files
+
+# Returns the indices of the x, y and z columns of a file open for binary reading, positioned past any header
+def readM77tIndices( reader, fp ):
+	return readHeader( io.StringIO( reader.readline().decode( 'utf-8', 'replace' ) ), fp )
+
+def readXYZIndices( reader, fp ):
+	return [0, 1, 2]
+
+# The file types the pipeline can import, and the function which reads the header of each
+PIPELINE_FORMATS = { '.m77t':readM77tIndices, '.xyz':readXYZIndices }
+
+# Parses a block of whole lines. Runs in a parse process
+# @return = A ( X, Y, Z ) tuple of float64 arrays with every malformed or NaN row removed, or None if no row survives
+def parseBlock( block, indices ):
+	points = parseLines( block.decode( 'utf-8', 'replace' ).splitlines(), indices )
+	points = points[~np.isnan( points ).any( axis=1 )]
+	if len( points ) == 0:
+		return None
+	return ( np.ascontiguousarray( points[:, 0] ), np.ascontiguousarray( points[:, 1] ), np.ascontiguousarray( points[:, 2] ) )
+
+# A file the writer is part way through
+PipelineFile = namedtuple( 'PipelineFile', ( 'table', 'cache', 'start', 'count', 'error' ) )
+
+class ImportPipeline( object ):
+	# @param importer = The DataImporter whose storage, TPR, manifest and point caches the files are imported into
+	# @param spatial_reference = The SpatialReference of the imported points
+	# @param parse_workers = The number of parse processes
+	# @param readers = The number of reader threads
+	# @param queue_depth = The number of blocks allowed between the readers and the writer
+	# @param formats = A dictionary of file extension to header function, as PIPELINE_FORMATS. Files of any other type are imported by the importer's own
+	# import function, on the writer
+	def __init__( self, importer, spatial_reference, parse_workers, readers=READER_THREADS, queue_depth=QUEUE_DEPTH, block_bytes=BLOCK_BYTES, formats=PIPELINE_FORMATS, verbose=False ):
+		self.importer = importer
+		self.spatial_reference = spatial_reference
+		self.parse_workers = max( 1, parse_workers )
+		self.readers = max( 1, readers )
+		self.queue_depth = max( 1, queue_depth )
+		self.block_bytes = block_bytes
+		self.formats = formats
+		self.verbose = verbose
+
+	def printIfVerbose( self, message ):
+		if self.verbose:
+			print( message )
+
+	# Imports the passed files
+	# @param files = An iterable of file paths or FileRecords. It is consumed as the readers need more files, so it may be a crawl still in progress
+	# @return = A dictionary with an ImportResult for every file the pipeline imported, and the wall clock time
+	def run( self, files ):
+		start = time.perf_counter()
+		self.files = iter( files )
+		self.exhausted = False
+		self.claimed = set()
+		self.stopped = threading.Event()
+		self.file_queue = queue.Queue()
+		self.write_queue = queue.Queue( self.queue_depth )
+		self.pool = multiprocessing.Pool( self.parse_workers )
+		threads = [threading.Thread( target=self.readFiles, daemon=True ) for index in range( 0, self.readers )]
+		for thread in threads:
+			thread.start()
+		self.states = dict()
+		self.results = list()
+		finished = 0
+		try:
+			while finished < len( threads ):
+				self.feed()
+				( kind, path, payload ) = self.write_queue.get()
+				if kind == DONE:
+					finished += 1
+				else:
+					self.write( kind, path, payload )
+			self.pool.close()
+		except:
+			self.pool.terminate()
+			raise
+		finally:
+			self.stopped.set()
+			# Wakes any reader still waiting for a file
+			for thread in threads:
+				self.file_queue.put( None )
+			for thread in threads:
+				thread.join()
+			self.pool.join()
+		self.importer.tpr.flush()
+		wall = time.perf_counter() - start
+		self.printIfVerbose( "Pipelined import of %d files took %.1f seconds." % ( len( self.results ), wall ) )
+		return { 'results':self.results, 'wall_seconds':wall }
+
+	# Tops the readers' file queue up from the files iterable. Files the pipeline cannot read are imported on the spot, and files whose table is
+	# already in the TPR, or claimed by another file of this run, are skipped
+	def feed( self ):
+		while not self.exhausted and self.file_queue.qsize() < self.readers:
+			record = next( self.files, None )
+			if record == None:
+				self.exhausted = True
+				for index in range( 0, self.readers ):
+					self.file_queue.put( None )
+				return
+			path = record if isinstance( record, str ) else record.path
+			table = self.importer.getTableName( path )
+			if os.path.splitext( path )[1] not in self.formats:
+				self.importer.importFile( path )
+			elif self.importer.tablePresentInTPR( table ) or table in self.claimed:
+				self.printIfVerbose( "%s already present in TPR. Cancelling import." % table )
+			else:
+				self.claimed.add( table )
+				self.file_queue.put( path )
+
+	# Puts an item on the write queue, waiting while it is full, unless the pipeline is stopped
+	def put( self, item ):
+		while not self.stopped.is_set():
+			try:
+				self.write_queue.put( item, timeout=PUT_POLL )
+				return
+			except queue.Full:
+				continue
+
+	# Body of a reader thread. Reads files from the file queue until it is handed None
+	def readFiles( self ):
+		while not self.stopped.is_set():
+			path = self.file_queue.get()
+			if path == None:
+				self.put( ( DONE, None, None ) )
+				return
+			try:
+				with open( path, 'rb' ) as reader:
+					indices = self.formats[os.path.splitext( path )[1]]( reader, path )
+					self.put( ( START, path, None ) )
+					while not self.stopped.is_set():
+						block = reader.read( self.block_bytes )
+						if len( block ) == 0:
+							break
+						block += reader.readline()
+						self.put( ( BLOCK, path, self.pool.apply_async( parseBlock, ( block, indices ) ) ) )
+				self.put( ( END, path, None ) )
+			except Exception as e:
+				self.put( ( FAILED, path, e ) )
+
+	# Handles one item from the readers
+	def write( self, kind, path, payload ):
+		importer = self.importer
+		if kind == START:
+			table = importer.getTableName( path )
+			self.printIfVerbose( "Importing %s..." % path )
+			try:
+				importer.storage.createPointTable( table, self.spatial_reference )
+				self.states[path] = PipelineFile( table, PointCacheWriter( cachePath( importer.cache_dir, table ) ), time.perf_counter(), 0, None )
+			except Exception as e:
+				self.states[path] = PipelineFile( table, None, time.perf_counter(), 0, None )
+				self.fail( path, e )
+			return
+		state = self.states.get( path )
+		if kind == FAILED:
+			self.fail( path, payload )
+		elif state == None or state.error != None:
+			return # The file failed, so the rest of it is dropped
+		elif kind == BLOCK:
+			try:
+				points = payload.get()
+				if points != None:
+					importer.storage.appendPoints( state.table, *points )
+					state.cache.append( *points )
+					self.states[path] = state._replace( count=state.count + len( points[0] ) )
+			except Exception as e:
+				self.fail( path, e )
+		elif kind == END:
+			self.finish( path )
+
+	# Registers a fully written file's table, the way the importer's own import functions do
+	def finish( self, path ):
+		importer = self.importer
+		state = self.states.pop( path )
+		state.cache.close()
+		importer.addTableToTableRecord( state.table )
+		if importer.manifest != None:
+			importer.manifest.record( path, state.table )
+		self.record( path, state, None )
+		self.printIfVerbose( "Done importing %s (%d points)." % ( path, state.count ) )
+
+	# Drops whatever was written of a file which failed
+	def fail( self, path, error ):
+		importer = self.importer
+		state = self.states.get( path )
+		self.printIfVerbose( "Error importing %s: %s" % ( path, error ) )
+		if state == None:
+			state = PipelineFile( importer.getTableName( path ), None, time.perf_counter(), 0, None )
+		elif state.error != None:
+			return
+		if state.cache != None:
+			state.cache.abort()
+		if importer.storage.tableExists( state.table ):
+			importer.storage.deleteTable( state.table )
+		self.states[path] = state._replace( cache=None, error=error )
+		self.record( path, state, error )
+
+	# Adds a file's result, and writes it to the importer's metrics log
+	def record( self, path, state, error ):
+		seconds = time.perf_counter() - state.start
+		self.results.append( ImportResult( path, seconds, None if error == None else str( error ) ) )
+		if self.importer.metrics.enabled:
+			self.importer.metrics.write( { 'kind':'import', 'name':'pipeline', 'table':state.table, 'rows':state.count, 'wall_s':seconds,
+											'peak_rss_mb':readPeakRSS(), 'error':None if error == None else str( error ) } )
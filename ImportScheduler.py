@@ -0,0 +1,187 @@
+# Import Scheduler
+# Imports many files in parallel through a single long-lived pool of worker processes.
+# Each worker builds its own importer once, when it starts, so only lightweight task descriptors (a path and a size) ever cross between processes.
+# Files are handed out largest first, so that one huge cruise file cannot be left until last and stretch the run. Small files are grouped into batches of
+# roughly equal size, so that the overhead of handing out a task does not dominate thousands of tiny files.
+# Files can also be handed out as they are found (runStream), so that importing starts while a crawl is still going. Files found but not yet handed out wait in
+# a priority queue, and a worker which frees up gets the largest of them, so a huge file found late still goes out ahead of the small ones waiting with it.
+# Every batch reports which worker ran it and for how long, from which the scheduler works out how busy each worker was.
+import os
+import time
+import heapq
+import queue
+import multiprocessing
+from collections import namedtuple
+
+BATCHES_PER_WORKER = 4 # Small files are grouped so that there are about this many batches' worth of bytes per worker
+MIN_BATCH_BYTES = 1048576 # Files are never grouped into batches smaller than this
+STREAM_LOOKAHEAD = 10000 # The most files runStream holds found but not handed out. Past this, the crawl waits for a worker to free up
+
+# reload = The worker rereads the file's TPR row before importing the file. Set for a file whose old table was dropped after the workers started, which they would
+# otherwise still see in their copy of the TPR
+ImportTask = namedtuple( 'ImportTask', ( 'path', 'size', 'reload' ), defaults=( False, ) )
+ImportResult = namedtuple( 'ImportResult', ( 'path', 'seconds', 'error' ) )
+
+# The importer owned by this worker process. Built once by initializeWorker
+worker_importer = None
+
+def initializeWorker( importer_class, importer_kwargs ):
+	global worker_importer
+	worker_importer = importer_class( **importer_kwargs )
+
+# Imports every file of a batch in the calling worker, then flushes the worker's TPR once for the whole batch
+# @return = A ( process ID, busy seconds, list of ImportResults ) tuple
+def runBatch( batch ):
+	results = list()
+	busy = 0.0
+	for task in batch:
+		start = time.perf_counter()
+		error = None
+		try:
+			if task.reload:
+				worker_importer.tpr.refresh( [worker_importer.getTableName( task.path )] )
+			worker_importer.importFile( task.path )
+		except Exception as e:
+			error = str( e )
+		seconds = time.perf_counter() - start
+		busy += seconds
+		results.append( ImportResult( task.path, seconds, error ) )
+	# Nothing is left buffered between batches, since a worker's TPR disappears with the worker
+	start = time.perf_counter()
+	worker_importer.tpr.flush()
+	busy += time.perf_counter() - start
+	return ( os.getpid(), busy, results )
+
+class ImportScheduler( object ):
+	# @param importer = The importer whose configuration the workers copy. It must provide getWorkerConfig()
+	# @param num_workers = The number of worker processes
+	def __init__( self, importer, num_workers, verbose=False ):
+		self.importer = importer
+		self.num_workers = max( 1, num_workers )
+		self.verbose = verbose
+		self.pool = None
+
+	def printIfVerbose( self, message ):
+		if self.verbose:
+			print( message )
+
+	# Starts the worker pool. The pool stays up until close(), so any number of runs can share it
+	def start( self ):
+		if self.pool == None:
+			( importer_class, importer_kwargs ) = self.importer.getWorkerConfig()
+			self.pool = multiprocessing.Pool( self.num_workers, initializeWorker, ( importer_class, importer_kwargs ) )
+
+	def close( self ):
+		if self.pool != None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	# Orders files largest first, and groups the small ones into batches
+	# @param files = An iterable of file paths or ImportTasks. The size of a plain path is looked up
+	# @return = A list of batches, each a list of ImportTasks
+	def schedule( self, files ):
+		tasks = [file if isinstance( file, ImportTask ) else ImportTask( file, os.path.getsize( file ) ) for file in files]
+		tasks.sort( key=lambda task: task.size, reverse=True )
+		total = sum( task.size for task in tasks )
+		batch_bytes = max( MIN_BATCH_BYTES, total // ( self.num_workers * BATCHES_PER_WORKER ) )
+		batches = list()
+		batch = list()
+		size = 0
+		for task in tasks:
+			batch.append( task )
+			size += task.size
+			if size >= batch_bytes:
+				batches.append( batch )
+				batch = list()
+				size = 0
+		if len( batch ):
+			batches.append( batch )
+		return batches
+
+	# Imports the passed files on the worker pool
+	# @return = A dictionary with the results of every file, the wall clock time, and the utilization (fraction of the wall clock time spent busy) of each worker
+	def run( self, files ):
+		self.start()
+		batches = self.schedule( files )
+		start = time.perf_counter()
+		# chunksize=1 hands each batch to whichever worker is free next
+		return self.collect( self.pool.imap_unordered( runBatch, batches, 1 ), start )
+
+	# Imports files on the worker pool as they arrive. Each worker is handed a batch as soon as it is free, made of the largest files found so far (see popBatch),
+	# so workers start on the first files while later ones are still being found. One batch is queued behind each running one, so a worker never sits idle
+	# waiting for the crawl to reach its next file
+	# @param tasks = An iterable of ImportTasks, typically a generator fed by a crawl
+	# @param lookahead = The most files held back waiting for a worker. Past this, the crawl is paused until one frees up
+	# @return = As for run
+	def runStream( self, tasks, lookahead=STREAM_LOOKAHEAD ):
+		self.start()
+		start = time.perf_counter()
+		finished = queue.Queue() # The outcome of each batch, put there by the pool's result thread as the batch finishes
+		pending = list() # A heap of ( -size, order found, ImportTask ), so the largest file found comes off first
+		outcomes = list()
+		running = 0
+		for ( found, task ) in enumerate( tasks ):
+			heapq.heappush( pending, ( -task.size, found, task ) )
+			running = self.dispatch( pending, finished, outcomes, running, lookahead )
+		# Every file has been found, so the rest go out largest first as workers free up
+		running = self.dispatch( pending, finished, outcomes, running, 0 )
+		while running > 0:
+			running -= self.reap( finished, outcomes, True )
+		return self.collect( outcomes, start )
+
+	# Hands batches to the pool, largest files first, while there is room for them. With lookahead or more files waiting, waits for a batch to finish
+	# rather than return to the crawl
+	# @return = The number of batches still running
+	def dispatch( self, pending, finished, outcomes, running, lookahead ):
+		running -= self.reap( finished, outcomes, False )
+		while len( pending ) and ( running < 2 * self.num_workers or len( pending ) >= lookahead ):
+			if running >= 2 * self.num_workers:
+				running -= self.reap( finished, outcomes, True )
+				continue
+			self.pool.apply_async( runBatch, ( self.popBatch( pending ), ), callback=finished.put, error_callback=finished.put )
+			running += 1
+		return running
+
+	# Takes the largest waiting file, and smaller ones after it, until the batch holds MIN_BATCH_BYTES or nothing is left
+	def popBatch( self, pending ):
+		batch = list()
+		size = 0
+		while len( pending ) and size < MIN_BATCH_BYTES:
+			task = heapq.heappop( pending )[2]
+			batch.append( task )
+			size += task.size
+		return batch
+
+	# Moves the outcomes of finished batches into outcomes. A batch which raised outside runBatch's own error handling raises here
+	# @param block = If True, waits for at least one batch to finish
+	# @return = The number of batches moved
+	def reap( self, finished, outcomes, block ):
+		moved = 0
+		while True:
+			try:
+				outcome = finished.get( block and moved == 0 )
+			except queue.Empty:
+				return moved
+			if isinstance( outcome, BaseException ):
+				raise outcome
+			outcomes.append( outcome )
+			moved += 1
+
+	# Gathers the outcomes of the batches of a run, reporting any failed file
+	# @param outcomes = An iterable of the ( process ID, busy seconds, list of ImportResults ) tuples returned by runBatch
+	# @param start = The perf_counter time the run started
+	def collect( self, outcomes, start ):
+		busy = dict()
+		results = list()
+		for ( pid, seconds, batch_results ) in outcomes:
+			busy[pid] = busy.get( pid, 0.0 ) + seconds
+			for result in batch_results:
+				if result.error != None:
+					self.printIfVerbose( "Error importing %s: %s" % ( result.path, result.error ) )
+			results.extend( batch_results )
+		wall = time.perf_counter() - start
+		utilization = dict( ( pid, busy[pid] / wall ) for pid in busy ) if wall > 0 else dict()
+		for pid in sorted( utilization ):
+			self.printIfVerbose( "Worker %d busy %.0f%% of %.1f seconds." % ( pid, 100.0 * utilization[pid], wall ) )
+		return { 'results':results, 'wall_seconds':wall, 'utilization':utilization }
@@ -0,0 +1,169 @@
+# Instrumentation
+# Records what every import and every processing stage costs, per table, as one JSON object per line in a metrics log:
+#	time, pid, kind ('import' or 'stage'), name, table, wall_s, cpu_s, rows, read_bytes, write_bytes, peak_rss_mb, error
+# Bytes are the process's logical reads and writes (/proc/self/io), and the memory peak is reset before each measurement, so both are per measurement. Linux only;
+# elsewhere they are left out, and the memory peak comes from the resource module, or psutil on Windows, or is None if neither is there. Lines are appended with a single write each, so worker processes can share one log.
+# With no log file, measure() hands back a shared do-nothing measurement, so instrumentation costs nothing when it is off.
+# Summarize a log from the command line: python Instrumentation.py <log> [--top N]
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+# resource only exists on Unix, and the processors must still import on Windows, where the ArcGIS backend runs
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Resets the kernel's peak resident memory counter for this process, so the next measurement's peak stands on its own. Linux only
+# @return = True if the counter could be reset
+def resetPeakRSS():
+	try:
+		with open( '/proc/self/clear_refs', 'w' ) as f:
+			f.write( '5' )
+		return True
+	except OSError:
+		return False
+
+# Returns the peak resident memory of this process in MB: since the last resetPeakRSS if it could be reset, otherwise since the process started.
+# None where no source of it is available
+def readPeakRSS():
+	try:
+		with open( '/proc/self/status' ) as f:
+			for line in f:
+				if line.startswith( 'VmHWM:' ):
+					return int( line.split()[1] ) / 1024.0
+	except OSError:
+		pass
+	if resource != None:
+		return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+	try:
+		import psutil
+	except ImportError:
+		return None
+	# Windows reports the peak working set, the nearest it has to a peak resident size
+	memory = psutil.Process().memory_info()
+	return getattr( memory, 'peak_wset', memory.rss ) / 1048576.0
+
+# Returns the ( bytes read, bytes written ) by this process so far, or ( None, None ) where /proc/self/io is not available
+def readIOCounters():
+	counters = dict()
+	try:
+		with open( '/proc/self/io' ) as f:
+			for line in f:
+				( name, value ) = line.split( ':' )
+				counters[name] = int( value )
+	except OSError:
+		return ( None, None )
+	return ( counters.get( 'rchar' ), counters.get( 'wchar' ) )
+
+# A measurement which does nothing. Shared by every measure() of a disabled log
+class NullMeasurement( object ):
+	enabled = False
+
+	def __enter__( self ):
+		return self
+
+	def __exit__( self, exc_type, exc_value, traceback ):
+		return False
+
+	def setRows( self, rows ):
+		pass
+
+NULL_MEASUREMENT = NullMeasurement()
+
+# Measures one import or stage on one table, and appends the result to the log when the block ends. An exception is recorded, then passed on
+class Measurement( object ):
+	enabled = True
+
+	def __init__( self, log, kind, name, table ):
+		self.log = log
+		self.record = { 'kind':kind, 'name':name, 'table':table, 'rows':None }
+
+	def setRows( self, rows ):
+		self.record['rows'] = None if rows == None else int( rows )
+
+	def __enter__( self ):
+		resetPeakRSS()
+		( self.read_bytes, self.write_bytes ) = readIOCounters()
+		self.cpu = time.process_time()
+		self.wall = time.perf_counter()
+		return self
+
+	def __exit__( self, exc_type, exc_value, traceback ):
+		self.record['wall_s'] = time.perf_counter() - self.wall
+		self.record['cpu_s'] = time.process_time() - self.cpu
+		( read_bytes, write_bytes ) = readIOCounters()
+		if read_bytes != None and self.read_bytes != None:
+			self.record['read_bytes'] = read_bytes - self.read_bytes
+			self.record['write_bytes'] = write_bytes - self.write_bytes
+		self.record['peak_rss_mb'] = readPeakRSS()
+		self.record['error'] = None if exc_value == None else str( exc_value )
+		self.log.write( self.record )
+		return False
+
+class MetricsLog( object ):
+	# @param fp = The JSON-lines file measurements are appended to. If None, nothing is measured
+	def __init__( self, fp=None ):
+		self.fp = fp
+		self.enabled = fp != None
+
+	# Returns a context manager measuring the block it wraps
+	# @param kind = 'import' or 'stage'
+	# @param name = The import function or stage
+	def measure( self, kind, name, table ):
+		if not self.enabled:
+			return NULL_MEASUREMENT
+		return Measurement( self, kind, name, table )
+
+	def write( self, record ):
+		line = dict( time=time.strftime( "%Y-%m-%dT%H:%M:%S" ), pid=os.getpid() )
+		line.update( record )
+		handle = os.open( self.fp, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644 )
+		try:
+			os.write( handle, ( json.dumps( line ) + "\n" ).encode( 'utf-8' ) )
+		finally:
+			os.close( handle )
+
+# Reads every record of a metrics log
+def readMetrics( fp ):
+	with open( fp ) as f:
+		return [json.loads( line ) for line in f if line.strip()]
+
+# Totals the wall time of a metrics log by stage and by table, and picks out the slowest single measurements
+# @param top = How many entries each ranking keeps
+# @return = A dictionary with 'stages' and 'tables', lists of ( name, total seconds, count ) tuples, and 'slowest', a list of records, all slowest first
+def summarize( records, top=10 ):
+	stages = defaultdict( lambda: [0.0, 0] )
+	tables = defaultdict( lambda: [0.0, 0] )
+	for record in records:
+		for ( totals, key ) in ( ( stages, "%s:%s" % ( record['kind'], record['name'] ) ), ( tables, record['table'] ) ):
+			totals[key][0] += record['wall_s']
+			totals[key][1] += 1
+	rank = lambda totals: sorted( ( ( key, totals[key][0], totals[key][1] ) for key in totals ), key=lambda entry: entry[1], reverse=True )[:top]
+	slowest = sorted( records, key=lambda record: record['wall_s'], reverse=True )[:top]
+	return { 'stages':rank( stages ), 'tables':rank( tables ), 'slowest':slowest }
+
+def printSummary( summary ):
+	for ( title, key ) in ( ( "Slowest stages", 'stages' ), ( "Slowest tables", 'tables' ) ):
+		print( "%s:" % title )
+		for ( name, seconds, count ) in summary[key]:
+			print( "  %-40s %10.2f s over %d measurements" % ( name, seconds, count ) )
+	print( "Slowest single measurements:" )
+	for record in summary['slowest']:
+		memory = "?" if record.get( 'peak_rss_mb' ) == None else "%.0f" % record['peak_rss_mb']
+		print( "  %-40s %10.2f s  %s rows  %s MB%s" % ( "%s:%s on %s" % ( record['kind'], record['name'], record['table'] ), record['wall_s'], record['rows'],
+				memory, "  FAILED: %s" % record['error'] if record.get( 'error' ) else "" ) )
+
+def main( argv=None ):
+	parser = argparse.ArgumentParser( description="Ranks the slowest stages and tables in a metrics log" )
+	parser.add_argument( 'log', help="The JSON-lines metrics log" )
+	parser.add_argument( '--top', type=int, default=10 )
+	args = parser.parse_args( argv )
+	printSummary( summarize( readMetrics( args.log ), args.top ) )
+	return 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
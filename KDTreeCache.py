@@ -0,0 +1,104 @@
+# KD Tree Cache
+# Keeps built KD trees on disk, so that scoring an unchanged table again (with a different K, say) skips building its tree entirely.
+# Trees are keyed by a hash of the XY coordinates they index, the leaf size, and the SciPy version, since the saved form is SciPy's own pickled state.
+# Each tree is a directory of .npy arrays and a small JSON file; the arrays are opened memory-mapped when the tree is loaded.
+# The least recently used trees are evicted whenever the cache grows past its disk budget.
+import os
+import os.path
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import scipy
+from scipy.spatial import cKDTree
+
+DISK_BUDGET = 10 * 1024 ** 3 # The default disk budget, in bytes
+STATE_FILE = 'state.json'
+
+class KDTreeCache( object ):
+	# @param directory = The directory the trees are kept in. It is created if it does not exist
+	# @param budget = The number of bytes the cache may use on disk
+	def __init__( self, directory, budget=DISK_BUDGET ):
+		self.directory = directory
+		self.budget = budget
+		if not os.path.isdir( directory ):
+			os.makedirs( directory )
+
+	# Returns the cache key of a tree over XY with the passed leaf size
+	def getKey( self, XY, leaf_size ):
+		digest = hashlib.blake2b( digest_size=20 )
+		digest.update( ( "%s:%d:%d:" % ( scipy.__version__, int( leaf_size ), XY.shape[0] ) ).encode( 'ascii' ) )
+		digest.update( np.ascontiguousarray( XY, dtype=np.float64 ).data )
+		return digest.hexdigest()
+
+	def getPath( self, key ):
+		return os.path.join( self.directory, key )
+
+	# Returns the tree stored under key, or None if there is none
+	def load( self, key ):
+		path = self.getPath( key )
+		try:
+			with open( os.path.join( path, STATE_FILE ) ) as f:
+				items = json.load( f )
+			state = tuple( np.load( os.path.join( path, item['array'] ), mmap_mode='r' ) if isinstance( item, dict ) else item for item in items )
+		except ( OSError, ValueError ):
+			return None
+		tree = cKDTree.__new__( cKDTree )
+		tree.__setstate__( state )
+		os.utime( os.path.join( path, STATE_FILE ) ) # Marks the tree as recently used
+		return tree
+
+	# Saves a tree under key, then evicts trees until the cache fits its budget again. The tree appears atomically: it is written to a temporary directory and renamed into place
+	def store( self, key, tree ):
+		path = self.getPath( key )
+		temp = tempfile.mkdtemp( dir=self.directory, prefix='.writing_' )
+		try:
+			items = list()
+			for ( index, item ) in enumerate( tree.__getstate__() ):
+				if isinstance( item, np.ndarray ):
+					name = "%d.npy" % index
+					np.save( os.path.join( temp, name ), item )
+					items.append( { 'array':name } )
+				else:
+					items.append( item )
+			with open( os.path.join( temp, STATE_FILE ), 'w' ) as f:
+				json.dump( items, f )
+			if os.path.isdir( path ):
+				shutil.rmtree( path, ignore_errors=True )
+			os.replace( temp, path )
+		except:
+			shutil.rmtree( temp, ignore_errors=True )
+			raise
+		self.evict()
+
+	# Returns the tree over XY, from the cache if it is there, otherwise built and added to the cache
+	def getTree( self, XY, leaf_size ):
+		XY = np.ascontiguousarray( XY, dtype=np.float64 )
+		key = self.getKey( XY, leaf_size )
+		tree = self.load( key )
+		if tree == None:
+			tree = cKDTree( XY, leafsize=int( leaf_size ) )
+			self.store( key, tree )
+		return tree
+
+	# Returns ( last used, bytes, path ) for every tree in the cache
+	def getEntries( self ):
+		entries = list()
+		for name in os.listdir( self.directory ):
+			path = os.path.join( self.directory, name )
+			state = os.path.join( path, STATE_FILE )
+			if name.startswith( '.' ) or not os.path.isfile( state ):
+				continue
+			size = sum( os.path.getsize( os.path.join( path, f ) ) for f in os.listdir( path ) )
+			entries.append( ( os.path.getmtime( state ), size, path ) )
+		return entries
+
+	# Deletes the least recently used trees until the cache is within its disk budget
+	def evict( self ):
+		entries = sorted( self.getEntries() )
+		total = sum( size for ( used, size, path ) in entries )
+		while total > self.budget and len( entries ):
+			( used, size, path ) = entries.pop( 0 )
+			shutil.rmtree( path, ignore_errors=True )
+			total -= size
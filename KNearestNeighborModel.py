@@ -4,35 +4,136 @@
 # Date created: 8/APR/2015
 # Takes in an array of XYZ coordinates (potentially among other data), then calculates expected values for each point based on its' neighboring points
 # The difference between this expected value and the observed value is called the residual
-from scipy.spatial import KDTree as kd
-import sys
+from scipy.spatial import cKDTree
+import numpy as np
 import math
+import time
 
-# TODO: Optional - Automatically adjust the number of neighbors used in the calculation to attain a desired rate of points processed per second
 NUM_NN = 150 # The default number of nearest neighbors to search for
-MAXIMUM_RECURSION_DEPTH = 2000 # The default maximum depth of recursion allowed.
+MAXIMUM_RECURSION_DEPTH = 2000 # Kept for callers of Get/SetMaximumRecursionDepth. cKDTree is not recursive in Python, so it no longer affects the tree
+LEAF_SIZE = 16 # The default KD Tree leaf size. SciPy's own default, and the fastest of 8 to 64 for k=150 queries over 1M points
+BATCH_SIZE = 65536 # The default number of points queried at once by the batch residual engine. Bounds the size of the neighbor index array ( BATCH_SIZE x NUM_NN )
+K_CANDIDATES = ( 8, 16, 32, 48, 64, 96, 128, 150, 200, 300, 500 ) # The neighbor counts calibration chooses between, smallest first
+CALIBRATION_SAMPLE = 2000 # The number of points timed for each candidate neighbor count
+IDW_POWER = 2.0 # The power of the distance by which the inverse-distance-weighted estimate divides each neighbor's weight
+
+# Neighbor Scores
+# Computes several estimates of each point from one neighbor query. Every estimator is an array kernel over the n x k matrices of its neighbors' Z values and
+# distances, and the statistics several estimators share (the neighbor mean and median) are computed once, so each extra estimator costs array math, not a query.
+# As with CalculateResidual, a point is among its own neighbors.
+class NeighborScores( object ):
+	# @param Z = The observed Z value of each of n points
+	# @param NZ = A n x k array of the Z values of each point's neighbors
+	# @param DIST = A n x k array of the distances to those neighbors
+	def __init__( self, Z, NZ, DIST ):
+		self.Z = Z
+		self.NZ = NZ
+		self.DIST = DIST
+		self.STATISTICS = dict()
+
+	# Returns a statistic, computing it the first time it is asked for
+	def Statistic( self, NAME, FUNCTION ):
+		if NAME not in self.STATISTICS:
+			self.STATISTICS[NAME] = FUNCTION()
+		return self.STATISTICS[NAME]
+
+	def Mean( self ):
+		return self.Statistic( 'mean', lambda: self.NZ.mean( axis=1 ) )
+
+	def Median( self ):
+		return self.Statistic( 'median', lambda: np.median( self.NZ, axis=1 ) )
+
+	def Std( self ):
+		return self.Statistic( 'std', lambda: self.NZ.std( axis=1 ) )
+
+	# Residual = OBSERVED - EXPECTED, with the neighbor mean as the expected value. The same value as CalculateResidual
+	def Residual( self ):
+		return self.Z - self.Mean()
+
+	def MedianResidual( self ):
+		return self.Z - self.Median()
+
+	# Residual from the inverse-distance-weighted mean of the neighbors. Neighbors at distance 0 (the point itself, and any duplicate of it) would take all of the
+	# weight, so they are left out. NaN for a point with no other neighbor
+	def IDWResidual( self ):
+		with np.errstate( divide='ignore', invalid='ignore' ):
+			WEIGHTS = np.where( self.DIST > 0, 1.0 / np.power( self.DIST, IDW_POWER ), 0.0 )
+			return self.Z - ( WEIGHTS * self.NZ ).sum( axis=1 ) / WEIGHTS.sum( axis=1 )
+
+	# The standard deviation of the neighbors' Z values
+	def LocalStd( self ):
+		return self.Std()
+
+	# The residual in units of the local standard deviation. NaN where the neighbors all share one Z value
+	def ZScore( self ):
+		with np.errstate( divide='ignore', invalid='ignore' ):
+			return np.where( self.Std() > 0, self.Residual() / self.Std(), np.nan )
+
+	# The median absolute deviation of the neighbors' Z values from their median
+	def LocalMAD( self ):
+		return np.median( np.abs( self.NZ - self.Median()[:, np.newaxis] ), axis=1 )
+
+# The estimators a score can be made of, by the name of the column each is written to
+ESTIMATORS = { 'residual':NeighborScores.Residual, 'resid_med':NeighborScores.MedianResidual, 'resid_idw':NeighborScores.IDWResidual,
+				'local_std':NeighborScores.LocalStd, 'z_score':NeighborScores.ZScore, 'local_mad':NeighborScores.LocalMAD }
+ALL_ESTIMATORS = ( 'residual', 'resid_med', 'resid_idw', 'local_std', 'z_score', 'local_mad' )
+
+# Scores points from one neighbor query
+# @param NN = A n x k array of the indexes of each point's neighbors in ALL_Z
+# @param NAMES = The names of the estimators, as keys of ESTIMATORS
+# @return = A n x len( NAMES ) array, one column per estimator
+def ScoreNeighbors( Z, ALL_Z, NN, DIST, NAMES ):
+	SCORES = NeighborScores( Z, ALL_Z[NN], DIST )
+	return np.column_stack( [ESTIMATORS[NAME]( SCORES ) for NAME in NAMES] )
+
+# Returns the X, Y and Z columns of a table of points as float64 arrays. Columns which are already float64 arrays are returned as views, not copies
+# @param TABLE = A dictionary of column arrays or a structured array, whose columns the indexes name; or a n x m array or list of rows, whose columns the indexes number
+def GetColumns( TABLE, X_INDEX, Y_INDEX, Z_INDEX ):
+	if isinstance( TABLE, dict ) or getattr( getattr( TABLE, 'dtype', None ), 'names', None ) != None:
+		return tuple( np.asarray( TABLE[INDEX], dtype=np.float64 ) for INDEX in ( X_INDEX, Y_INDEX, Z_INDEX ) )
+	# A list of rows is converted once, into a single compact array
+	TABLE = np.asarray( TABLE, dtype=np.float64 )
+	return ( TABLE[:, X_INDEX], TABLE[:, Y_INDEX], TABLE[:, Z_INDEX] )
 
 # Options for construction of KD tree. Mostly matter based on the system being used (memory, speed, etc.)
 
-# The indexes of the three values within the array
+# The points are held as three float64 columns (self.X, self.Y and self.Z), which are views of the data passed in wherever it allows, so a model over
+# a table's memory-mapped point cache or column arrays holds no copy of them. The KD Tree keeps the one contiguous copy of the XY values it needs, and
+# the batch engines query it with that copy, so building a model over n points costs 16 bytes per point for the XY values, plus the tree's index.
 class KNNModel( object ):
-	def __init__( self, data, x_index, y_index, z_index, NUM_NN=150, MRD=2000, LS=None ):
+	# @param data = The points, in any layout GetColumns accepts
+	# @param x_index, y_index, z_index = The columns of data holding the x, y and z values: positions in each row, or names of columns
+	# @param CACHE = A KDTreeCache to take the KD Tree from, or to add it to once built. If None, the tree is always built
+	def __init__( self, data, x_index, y_index, z_index, NUM_NN=150, MRD=2000, LS=LEAF_SIZE, CACHE=None ):
 		self.data = data
-		self.size = len( data )
+		self.CACHE = CACHE
 		# The data array provided to the class to build the KD Tree from can contain data other than XYZ data. Here we define the indices at which these values in particular can be found in each row of the provided data
 		self.INDEX_OF_X_VALUES = x_index
 		self.INDEX_OF_Y_VALUES = y_index
 		self.INDEX_OF_Z_VALUES = z_index
+		( self.X, self.Y, self.Z ) = GetColumns( data, x_index, y_index, z_index )
+		self.size = len( self.Z )
 		self.NUM_NN = NUM_NN # The default number of nearest neighbors to search for
-		self.MAXIMUM_RECURSION_DEPTH = MRD # The default maximum depth of recursion allowed.
-		if LS != None:
-			self.LEAF_SIZE = LS
-		else:
-			self.LEAF_SIZE = float( self.size / ( math.pow( 2.0, math.log2( float( self.MAXIMUM_RECURSION_DEPTH + 1 ) ) - 1 )) + 100 ) # I don't really understand this math very well, but it works. It basically calculates the minimum possible leaf size while keeping the number of recursive calls below the MRD
-		if LEAF_SIZE < 1: # The leaves have a minimum size of 1
-			LEAF_SIZE = 1
+		self.MAXIMUM_RECURSION_DEPTH = MRD
+		# A leaf size which grew with the table (as the old recursion limit needed) makes every query scan thousands of points per leaf, so it is fixed
+		if LS == None:
+			LS = LEAF_SIZE
+		self.LEAF_SIZE = max( int( LS ), 1 ) # The leaves have a minimum size of 1
 		self.KD = self.CreateKDTree()
 			
+	# Builds a model over separate X, Y and Z column arrays, such as the columns read from storage, without copying them
+	# @param TREE_CACHE = A KDTreeCache, as for the constructor
+	@classmethod
+	def FromColumns( cls, X, Y, Z, NUM_NN=150, MRD=2000, LS=LEAF_SIZE, TREE_CACHE=None ):
+		return cls( { 'x':X, 'y':Y, 'z':Z }, 'x', 'y', 'z', NUM_NN, MRD, LS, TREE_CACHE )
+
+	# Builds a model from a memory-mapped point cache (see PointCache.py). The cache's columns are read straight from the page cache, with no parse step or copy
+	# @param CACHE = An open PointCache
+	# @param TREE_CACHE = A KDTreeCache, as for the constructor
+	@classmethod
+	def FromPointCache( cls, CACHE, NUM_NN=150, MRD=2000, LS=LEAF_SIZE, TREE_CACHE=None ):
+		return cls.FromColumns( CACHE.x, CACHE.y, CACHE.z, NUM_NN, MRD, LS, TREE_CACHE )
+
 	def GetNumberOfNearestNeighbors( self ):
 		return self.NUM_NN
 
@@ -45,25 +146,40 @@ class KNNModel( object ):
 	def SetMaximumRecursionDepth( self, MAX ):
 		self.MAXIMUM_RECURSION_DEPTH = MAX
 
+	# Returns the X, Y and Z columns of TABLE. The model's own columns if TABLE is the data the model was built from
+	def GetColumnsOf( self, TABLE ):
+		if TABLE is self.data:
+			return ( self.X, self.Y, self.Z )
+		return GetColumns( TABLE, self.INDEX_OF_X_VALUES, self.INDEX_OF_Y_VALUES, self.INDEX_OF_Z_VALUES )
+
+	# Returns the contiguous n x 2 array of XY values the KD Tree was built over. Not a copy: it is the tree's own
+	def GetXY( self ):
+		return self.KD.data
+
+	# Returns a n x 2 array of the XY values of TABLE
 	def GetXYdata( self, TABLE ):
-		XY = list()
-		for ROW in TABLE:
-			XY.append( ( ROW[self.INDEX_OF_X_VALUES], ROW[self.INDEX_OF_Y_VALUES] ) )
-		return XY
-		
+		if TABLE is self.data:
+			return self.GetXY()
+		( X, Y, Z ) = self.GetColumnsOf( TABLE )
+		return np.column_stack( ( X, Y ) )
+
+	# Returns a n x 3 array of the XYZ values of TABLE. This is a new array, so the batch engines use the columns instead
 	def GetXYZdata( self, TABLE ):
-		XYZ = list()
-		for ROW in TABLE:
-			XYZ.append( ( ROW[self.INDEX_OF_X_VALUES], ROW[self.INDEX_OF_Y_VALUES], ROW[self.INDEX_OF_Z_VALUES] ) )
-		return XYZ
+		return np.column_stack( self.GetColumnsOf( TABLE ) )
 
 	def GetZValueAt( self, TABLE, INDEX ):
+		if TABLE is self.data:
+			return self.Z[INDEX]
 		return TABLE[INDEX][self.INDEX_OF_Z_VALUES]
 
 	def GetXValueAt( self, TABLE, INDEX ):
+		if TABLE is self.data:
+			return self.X[INDEX]
 		return TABLE[INDEX][self.INDEX_OF_X_VALUES]
 		
 	def GetYValueAt( self, TABLE, INDEX ):
+		if TABLE is self.data:
+			return self.Y[INDEX]
 		return TABLE[INDEX][self.INDEX_OF_Y_VALUES]
 
 	# Retrieve the indexes of those points in TABLE closest to the point at index INDEX in TABLE
@@ -74,7 +190,7 @@ class KNNModel( object ):
 	# distances to the nearest neighbors, not the indexes
 	def GetKNNIndexes( self, INDEX, KD, TABLE, Distances=False ):
 		# Retrieve the indexes of the K (NUM_NN) nearest neighbors
-		result = KD.query( ( self.GetXValueAt( TABLE, INDEX ), self.GetYValueAt( TABLE, INDEX ) ), k=self.NUM_NN )
+		result = KD.query( ( self.GetXValueAt( TABLE, INDEX ), self.GetYValueAt( TABLE, INDEX ) ), k=min( self.NUM_NN, self.size ) )
 		if Distances == False:
 			# The return of KD.query() is actually a list of lists, with the first list being a list of distances, 
 			# and the second being a list of indexes. We only want the indexes, so we grab the list at index 1
@@ -89,25 +205,21 @@ class KNNModel( object ):
 	# @param table = The table of values
 	def GetAvgNN( self, INDEX, TABLE ):
 		# Retrieve the indexes of the K (NUM_NN) nearest neighbors
-		NN = GetKNNIndexes( INDEX, self.KD, TABLE )
+		NN = self.GetKNNIndexes( INDEX, self.KD, TABLE )
 		# Sum the Z values of the nearest neighbors
 		sum = 0
-		for INDEX in NN:
-			sum += GetZValueAt( TABLE, INDEX )
+		for NN_INDEX in NN:
+			sum += self.GetZValueAt( TABLE, NN_INDEX )
 		# Return the average Z value
 		return sum / len( NN )
 
-	# Creates and populates a KD Tree from the XY values of the passed data
-	# Assumes that the table's x and y values will be in the predicted indexes (0 and 1, respectively)
+	# Creates and populates a KD Tree from the XY values of the passed data, or loads it from the tree cache if the same points were indexed before
+	# The tree is built in compiled code, so unlike the old pure Python KDTree it needs no change to the recursion limit
 	def CreateKDTree( self ):
-		# Here we increase the recursive limit. By both increasing the recursive limit, and defining our maximum leaf size 
-		# based on the recursive limit and the size of the data set, we can improve our efficiency
-		old_limit = sys.getrecursionlimit()
-		sys.setrecursionlimit( self.MAXIMUM_RECURSION_DEPTH )
-		XY = self.GetXYdata( self.data )
-		KD = kd( XY, LEAF_SIZE )
-		sys.setrecursionlimit( old_limit ) # Here we reset the recursive limit back to it's old, not-awesome value
-		return KD
+		XY = np.column_stack( ( self.X, self.Y ) )
+		if self.CACHE != None:
+			return self.CACHE.getTree( XY, int( self.LEAF_SIZE ) )
+		return cKDTree( XY, leafsize=int( self.LEAF_SIZE ) )
 		
 	# Calculates the residual of the point at INDEX in TABLE
 	# @param INDEX = The index in TABLE of the point in question 
@@ -121,10 +233,255 @@ class KNNModel( object ):
 	# Calculates the residuals of all points contained in the passed table
 	# @param TABLE = A nx3 array of n xyz coordinates.
 	# @return = An nx4 array. Each of the n rows contains the original xyz values, plus the calculated residual for that data point.
+	# This is the slow, one query per point path. Use CalculateAllResidualsBatch for anything large
 	def CalculateAllResiduals( self, TABLE ):
-		KD = CreateKDTree( TABLE )
+		RESIDUALS = list()
 		INDEX = 0
 		while INDEX < len( TABLE ):
-			RESIDUALS.append( CalculateResidual( INDEX, KD, TABLE ) )
+			RESIDUALS.append( ( self.GetXValueAt( TABLE, INDEX ), self.GetYValueAt( TABLE, INDEX ), self.GetZValueAt( TABLE, INDEX ), self.CalculateResidual( INDEX, TABLE ) ) )
 			INDEX += 1
-		return RESIDUALS
\ No newline at end of file
+		return RESIDUALS
+
+	# Calculates the residuals of all points at once. Issues one bulk k-nearest query per batch of points, and averages the neighbors' Z values with array operations instead of a Python loop
+	# Produces the same values as CalculateAllResiduals
+	# @param XYZ = A nx3 array of n xyz coordinates. If None, the data the model was built from is used, along with the model's KD Tree
+	# @param workers = The number of worker threads the KD Tree query may use. -1 uses all available cores
+	# @param batch_size = The number of points queried at once. Bounds memory use to roughly batch_size x NUM_NN indexes
+	# @return = An nx4 array. Each of the n rows contains the original xyz values, plus the calculated residual for that data point.
+	def CalculateAllResidualsBatch( self, XYZ=None, workers=-1, batch_size=BATCH_SIZE ):
+		return self.CalculateAllScoresBatch( ( 'residual', ), XYZ, workers, batch_size )
+
+	# Calculates several scores of every point (see NeighborScores) from a single batched neighbor query, keeping both the distances and the indexes it returns
+	# @param NAMES = The estimators to calculate, as keys of ESTIMATORS
+	# @param XYZ, workers, batch_size = As for CalculateAllResidualsBatch
+	# @return = An n x ( 3 + len( NAMES ) ) array. Each of the n rows contains the original xyz values, then one column per estimator, in the order of NAMES
+	def CalculateAllScoresBatch( self, NAMES=ALL_ESTIMATORS, XYZ=None, workers=-1, batch_size=BATCH_SIZE ):
+		SCORES = self.CalculateScoresBatch( NAMES, XYZ, workers, batch_size )
+		if XYZ is None:
+			( X, Y, Z ) = ( self.X, self.Y, self.Z )
+		else:
+			( X, Y, Z ) = GetColumns( XYZ, 0, 1, 2 )
+		return np.column_stack( ( X, Y, Z, SCORES ) )
+
+	# Calculates several scores of every point, as CalculateAllScoresBatch, without copying the xyz values into the result
+	# The model's own points are queried straight from the KD Tree's XY array, so the only memory allocated besides the result is one batch of neighbors
+	# @return = An n x len( NAMES ) array, one column per estimator, in the order of NAMES
+	def CalculateScoresBatch( self, NAMES=ALL_ESTIMATORS, XYZ=None, workers=-1, batch_size=BATCH_SIZE ):
+		if XYZ is None:
+			( XY, Z, KD ) = ( self.GetXY(), self.Z, self.KD )
+		else:
+			( X, Y, Z ) = GetColumns( XYZ, 0, 1, 2 )
+			KD = cKDTree( np.column_stack( ( X, Y ) ), leafsize=int( self.LEAF_SIZE ) )
+			XY = KD.data
+		n = len( Z )
+		k = min( self.NUM_NN, n )
+		SCORES = np.empty( ( n, len( NAMES ) ), dtype=np.float64 )
+		for start in range( 0, n, batch_size ):
+			stop = min( start + batch_size, n )
+			( DIST, NN ) = KD.query( XY[start:stop], k=k, workers=workers )
+			# query() drops the neighbor axis when k == 1
+			NN = NN.reshape( stop - start, k )
+			DIST = DIST.reshape( stop - start, k )
+			SCORES[start:stop] = ScoreNeighbors( Z[start:stop], Z, NN, DIST, NAMES )
+		return SCORES
+
+	# Times the batch scoring of a sample of points with K neighbors: the same query and ScoreNeighbors call CalculateScoresBatch makes for each batch.
+	# The best of two runs is kept, so one hiccup does not skew the choice
+	# @param NAMES = The estimators to time, as keys of ESTIMATORS
+	# @return = Points per second
+	def TimeResiduals( self, XY, Z, INDEXES, K, workers=-1, NAMES=( 'residual', ) ):
+		best = None
+		for run in range( 2 ):
+			start = time.perf_counter()
+			( DIST, NN ) = self.KD.query( XY[INDEXES], k=K, workers=workers )
+			SCORES = ScoreNeighbors( Z[INDEXES], Z, NN.reshape( len( INDEXES ), K ), DIST.reshape( len( INDEXES ), K ), NAMES )
+			elapsed = time.perf_counter() - start
+			if best == None or elapsed < best:
+				best = elapsed
+		return len( INDEXES ) / best if best > 0 else float( 'inf' )
+
+	# Picks the largest neighbor count whose residuals can be calculated at TARGET_RATE points per second, timing a sample of the points at each candidate
+	# If even the smallest candidate is too slow, the smallest is returned
+	# @param INDEXES = The points to draw the sample from. If None, all points
+	# @return = A ( K, measured points per second ) tuple
+	def ChooseNumberOfNeighbors( self, TARGET_RATE, INDEXES=None, CANDIDATES=K_CANDIDATES, SAMPLE_SIZE=CALIBRATION_SAMPLE, workers=-1, seed=0, NAMES=( 'residual', ) ):
+		if INDEXES is None:
+			INDEXES = np.arange( self.size )
+		if len( INDEXES ) > SAMPLE_SIZE:
+			INDEXES = np.sort( np.random.default_rng( seed ).choice( INDEXES, SAMPLE_SIZE, replace=False ) )
+		CANDIDATES = sorted( set( min( K, self.size ) for K in CANDIDATES ) )
+		( chosen, chosen_rate ) = ( CANDIDATES[0], None )
+		for K in CANDIDATES:
+			rate = self.TimeResiduals( self.GetXY(), self.Z, INDEXES, K, workers, NAMES )
+			if chosen_rate == None:
+				chosen_rate = rate
+			# Larger K is only ever slower, so the first candidate to miss the target ends the search
+			if rate < TARGET_RATE:
+				break
+			( chosen, chosen_rate ) = ( K, rate )
+		return ( chosen, chosen_rate )
+
+	# Converts a time budget for the whole data set into a target rate in points per second
+	def TargetRate( self, TARGET_RATE=None, TIME_BUDGET=None ):
+		if ( TARGET_RATE == None ) == ( TIME_BUDGET == None ):
+			raise ValueError( "Give exactly one of a target rate or a time budget" )
+		if TARGET_RATE != None:
+			return float( TARGET_RATE )
+		return self.size / float( TIME_BUDGET )
+
+	# Sets the number of nearest neighbors to the largest which meets a target throughput, or finishes the whole data set within a time budget
+	# The choice is recorded in self.CALIBRATION, so that the results can be reproduced by building a model with the recorded NUM_NN
+	# @param TARGET_RATE = Points per second
+	# @param TIME_BUDGET = Seconds for the whole data set
+	# @param NAMES = The estimators which will be calculated with the chosen K, and so are timed
+	# @return = The chosen number of neighbors
+	def CalibrateNumberOfNeighbors( self, TARGET_RATE=None, TIME_BUDGET=None, CANDIDATES=K_CANDIDATES, SAMPLE_SIZE=CALIBRATION_SAMPLE, workers=-1, NAMES=( 'residual', ) ):
+		rate = self.TargetRate( TARGET_RATE, TIME_BUDGET )
+		( K, measured ) = self.ChooseNumberOfNeighbors( rate, None, CANDIDATES, SAMPLE_SIZE, workers, NAMES=NAMES )
+		self.SetNumberOfNearestNeighbors( K )
+		self.CALIBRATION = { 'num_nn':K, 'target_rate':rate, 'measured_rate':measured, 'sample_size':min( SAMPLE_SIZE, self.size ) }
+		return K
+
+	# Calculates the residuals of all points with a neighbor count calibrated to meet a target throughput or time budget
+	# With REGION_SIZE, the XY extent is split into square regions, and each region is calibrated on its own sample, so that dense regions can use a different K from sparse ones
+	# @param TARGET_RATE = Points per second
+	# @param TIME_BUDGET = Seconds for the whole data set
+	# @param REGION_SIZE = The width and height of a region, in XY units. If None, one K is chosen for the whole data set
+	# @return = An nx5 array. Each of the n rows contains the original xyz values, the residual, and the number of neighbors it was calculated with
+	def CalculateAllResidualsAdaptive( self, TARGET_RATE=None, TIME_BUDGET=None, REGION_SIZE=None, CANDIDATES=K_CANDIDATES, SAMPLE_SIZE=CALIBRATION_SAMPLE, workers=-1, batch_size=BATCH_SIZE ):
+		rate = self.TargetRate( TARGET_RATE, TIME_BUDGET )
+		XY = self.GetXY()
+		if REGION_SIZE == None:
+			REGIONS = [np.arange( self.size )]
+		else:
+			CELLS = np.floor( ( XY - XY.min( axis=0 ) ) / float( REGION_SIZE ) ).astype( np.int64 )
+			( KEYS, INVERSE ) = np.unique( CELLS, axis=0, return_inverse=True )
+			ORDER = np.argsort( INVERSE.ravel(), kind='stable' )
+			REGIONS = np.split( ORDER, np.cumsum( np.bincount( INVERSE.ravel() ) )[:-1] )
+		RESULT = np.empty( ( self.size, 5 ), dtype=np.float64 )
+		( RESULT[:, 0], RESULT[:, 1], RESULT[:, 2] ) = ( self.X, self.Y, self.Z )
+		Z = self.Z
+		for INDEXES in REGIONS:
+			( K, measured ) = self.ChooseNumberOfNeighbors( rate, INDEXES, CANDIDATES, SAMPLE_SIZE, workers )
+			for start in range( 0, len( INDEXES ), batch_size ):
+				BATCH = INDEXES[start:start + batch_size]
+				( DIST, NN ) = self.KD.query( XY[BATCH], k=K, workers=workers )
+				RESULT[BATCH, 3] = Z[BATCH] - Z[NN.reshape( len( BATCH ), K )].mean( axis=1 )
+			RESULT[INDEXES, 4] = K
+		return RESULT
+
+# Tiled KNN Model
+# Calculates residuals for point sets too large to hold in memory. The XY extent is split into square tiles, and each tile is loaded along with a halo of
+# surrounding points wide enough to contain the K nearest neighbors of every point in the tile. Only the tile's interior points are scored, so every point is
+# scored exactly once, and peak memory is bounded by the size of a tile plus its halo rather than the size of the whole table.
+# Residuals are identical to those of the in-memory KNNModel, including at tile borders: any point whose K-th neighbor lies further away than the edge of the
+# loaded halo is rescored with a wider halo.
+class TiledKNNModel( object ):
+	# @param READ_BOX = A function( xmin, ymin, xmax, ymax ) which returns an array of the points with xmin <= x < xmax and ymin <= y < ymax.
+	# The first three columns must be x, y and z. Any further columns (an OID, for instance) are carried through to the results untouched
+	# @param EXTENT = A ( xmin, ymin, xmax, ymax ) tuple covering every point in the data set
+	# @param TILE_SIZE = The width and height of a tile, in XY units. Controls peak memory
+	# @param HALO = The initial width of the halo around each tile. If None, it is estimated from the point density of each tile
+	# @param READ_QUERY = A function( xmin, ymin, xmax, ymax ) which returns the points of a tile to score, laid out like READ_BOX's. If None, every point READ_BOX
+	# returns for the tile is scored. Lets a subset of the points (one table of many, say) be scored against all of them
+	# @param TILES = The interior bounds of the tiles to score. If None, every tile covering the extent is scored
+	# @param NAMES = The estimators to calculate, as keys of ESTIMATORS (see NeighborScores)
+	def __init__( self, READ_BOX, EXTENT, TILE_SIZE, NUM_NN=NUM_NN, HALO=None, LS=LEAF_SIZE, READ_QUERY=None, TILES=None, NAMES=( 'residual', ) ):
+		self.READ_BOX = READ_BOX
+		self.EXTENT = EXTENT
+		self.TILE_SIZE = float( TILE_SIZE )
+		self.NUM_NN = NUM_NN
+		self.HALO = HALO
+		self.LEAF_SIZE = LS
+		self.READ_QUERY = READ_QUERY
+		self.TILES = TILES
+		self.NAMES = NAMES
+
+	def GetNumberOfNearestNeighbors( self ):
+		return self.NUM_NN
+
+	def SetNumberOfNearestNeighbors( self, NUM ):
+		self.NUM_NN = NUM
+
+	# Returns the interior bounds of every tile covering the extent as ( xmin, ymin, xmax, ymax ) tuples
+	# The outermost tiles are left open ended, so that points lying exactly on the maximum edge of the extent still belong to a tile
+	def GetTiles( self ):
+		if self.TILES != None:
+			return list( self.TILES )
+		( xmin, ymin, xmax, ymax ) = self.EXTENT
+		num_x = max( 1, int( math.ceil( ( xmax - xmin ) / self.TILE_SIZE ) ) )
+		num_y = max( 1, int( math.ceil( ( ymax - ymin ) / self.TILE_SIZE ) ) )
+		X_EDGES = [xmin + i * self.TILE_SIZE for i in range( num_x + 1 )]
+		Y_EDGES = [ymin + j * self.TILE_SIZE for j in range( num_y + 1 )]
+		X_EDGES[0] = Y_EDGES[0] = -np.inf
+		X_EDGES[-1] = Y_EDGES[-1] = np.inf
+		TILES = list()
+		for i in range( num_x ):
+			for j in range( num_y ):
+				TILES.append( ( X_EDGES[i], Y_EDGES[j], X_EDGES[i + 1], Y_EDGES[j + 1] ) )
+		return TILES
+
+	# Estimates a halo wide enough to hold the K nearest neighbors of a tile's points, assuming the points are spread evenly over the tile
+	# @param TILE = The bounds of the tile. Tiles passed in TILES may be any size, so a bounded tile's own area is used. Open ended tiles are taken to be TILE_SIZE square
+	def EstimateHalo( self, NUM_POINTS, TILE=None ):
+		if self.HALO != None:
+			return self.HALO
+		AREA = self.TILE_SIZE * self.TILE_SIZE
+		if TILE != None and np.isfinite( TILE ).all():
+			AREA = ( TILE[2] - TILE[0] ) * ( TILE[3] - TILE[1] )
+		if NUM_POINTS == 0:
+			return math.sqrt( AREA )
+		radius = math.sqrt( self.NUM_NN * AREA / ( math.pi * NUM_POINTS ) )
+		return 2.0 * radius
+
+	# Calculates the residuals of the interior points of a single tile
+	# @param TILE = The interior bounds of the tile, as returned by GetTiles
+	# @return = An array of the tile's points, with one column per estimator appended (just the residual, by default). None if the tile is empty
+	def CalculateTileResiduals( self, TILE, workers=-1 ):
+		( xmin, ymin, xmax, ymax ) = TILE
+		# The tile's own points, scored against the tile plus its halo. The halo is estimated from every point in the tile, not just the ones scored
+		TILE_POINTS = np.asarray( self.READ_BOX( xmin, ymin, xmax, ymax ), dtype=np.float64 )
+		if self.READ_QUERY == None:
+			QUERY_POINTS = TILE_POINTS
+		else:
+			QUERY_POINTS = np.asarray( self.READ_QUERY( xmin, ymin, xmax, ymax ), dtype=np.float64 )
+		if len( QUERY_POINTS ) == 0:
+			return None
+		halo = self.EstimateHalo( len( TILE_POINTS ), TILE )
+		RESULT = np.empty( ( len( QUERY_POINTS ), QUERY_POINTS.shape[1] + len( self.NAMES ) ), dtype=np.float64 )
+		RESULT[:, :QUERY_POINTS.shape[1]] = QUERY_POINTS
+		PENDING = np.arange( len( QUERY_POINTS ) )
+		while True:
+			# Load the tile plus its halo
+			POINTS = np.asarray( self.READ_BOX( xmin - halo, ymin - halo, xmax + halo, ymax + halo ), dtype=np.float64 )
+			COVERS = self.BoxCoversExtent( xmin - halo, ymin - halo, xmax + halo, ymax + halo )
+			# With fewer than K points loaded, some of every point's K neighbors lie outside the box, so the halo is widened before anything is scored
+			if len( POINTS ) < self.NUM_NN and not COVERS:
+				halo *= 2.0
+				continue
+			QUERY = QUERY_POINTS[PENDING]
+			k = min( self.NUM_NN, len( POINTS ) )
+			KD = cKDTree( POINTS[:, :2], leafsize=self.LEAF_SIZE )
+			( DIST, NN ) = KD.query( QUERY[:, :2], k=k, workers=workers )
+			DIST = DIST.reshape( len( QUERY ), k )
+			NN = NN.reshape( len( QUERY ), k )
+			RESULT[PENDING, QUERY_POINTS.shape[1]:] = ScoreNeighbors( QUERY[:, 2], POINTS[:, 2], NN, DIST, self.NAMES )
+			# Any point outside the loaded box is at least this far from the query point. If the K-th neighbor is closer than that, the neighbors are exact
+			MARGIN = np.minimum.reduce( [QUERY[:, 0] - ( xmin - halo ), ( xmax + halo ) - QUERY[:, 0],
+										QUERY[:, 1] - ( ymin - halo ), ( ymax + halo ) - QUERY[:, 1]] )
+			PENDING = PENDING[DIST[:, -1] >= MARGIN]
+			if len( PENDING ) == 0 or COVERS:
+				return RESULT
+			halo *= 2.0
+
+	# Returns True if the passed box contains the whole extent, in which case no wider halo could add any points
+	def BoxCoversExtent( self, xmin, ymin, xmax, ymax ):
+		return xmin <= self.EXTENT[0] and ymin <= self.EXTENT[1] and xmax > self.EXTENT[2] and ymax > self.EXTENT[3]
+
+	# Calculates the residuals of every point in the data set, one tile at a time
+	# @return = A generator yielding one array per non-empty tile. Each row holds the point's original columns, plus one column per estimator
+	def CalculateAllResiduals( self, workers=-1 ):
+		for TILE in self.GetTiles():
+			RESULT = self.CalculateTileResiduals( TILE, workers )
+			if RESULT is not None:
+				yield RESULT
@@ -0,0 +1,106 @@
+# M77T Reader
+# Streams point data out of NGDC M77T (tab delimited MGD77T) cruise files in fixed-size chunks of typed NumPy columns.
+# Only the position and depth columns are parsed, and rows missing any of them are dropped as they are read, so memory use depends on the chunk size and not on the length of the cruise.
+# Chunks are parsed natively, by pandas' C parser where pandas is installed and by NumPy's otherwise. A chunk holding a malformed line is split until the
+# line is cornered in a block of at most SLOW_BLOCK lines, and only that block is parsed one line at a time in Python.
+import io
+import csv
+import itertools
+import warnings
+import numpy as np
+try:
+	import pandas
+except ImportError:
+	pandas = None
+
+CHUNK_SIZE = 100000 # The default number of lines parsed at once
+SLOW_BLOCK = 64 # Blocks of at most this many lines which the native parsers reject are parsed one line at a time
+X_FIELD = 'LON'
+Y_FIELD = 'LAT'
+Z_FIELD = 'CORR_DEPTH'
+
+class M77TFieldNotPresentException( Exception ):
+	def __init__( self, file, field ):
+		self.file = file
+		self.field = field
+
+	def __str__( self ):
+		return "Field '%s' is not present in the header of M77T file %s" % ( self.field, self.file )
+
+# Converts a single field to a float. Empty fields become NaN, so that the row can be dropped along with any explicitly missing values
+def parseField( field ):
+	field = field.strip()
+	if field == "":
+		return np.nan
+	return float( field )
+
+# Parses a chunk of lines into an nx3 array, one line at a time. Malformed lines (too few fields, or fields which are not numbers) become rows of NaN
+# This is the slow path, only used on the small blocks around lines the native parsers reject (see parseLines)
+def parseLinesSlowly( lines, indices ):
+	rows = np.full( ( len( lines ), len( indices ) ), np.nan )
+	for ( line_num, line ) in enumerate( lines ):
+		row = line.split( '\t' )
+		try:
+			rows[line_num] = [parseField( row[index] ) for index in indices]
+		except ( IndexError, ValueError ):
+			continue
+	return rows
+
+# Writes 'nan' into every empty field, since NumPy's parser rejects them. Each pass over '\t\t' consumes the tab which begins the next field, so it takes two
+def fillBlankFields( text ):
+	if not text.endswith( '\n' ):
+		text += '\n'
+	text = ( '\n' + text ).replace( '\t\t', '\tnan\t' ).replace( '\t\t', '\tnan\t' ).replace( '\t\n', '\tnan\n' ).replace( '\n\t', '\nnan\t' )
+	return text[1:]
+
+# Parses a chunk of lines into an nx3 array in C, with empty fields as NaN. Blank lines are skipped
+# Raises ValueError on a malformed line. A line with too few fields also raises it with NumPy, and becomes a row of NaN with pandas
+def parseLinesNatively( lines, indices ):
+	if pandas != None:
+		try:
+			frame = pandas.read_csv( io.StringIO( ''.join( lines ) ), sep='\t', header=None, usecols=indices, dtype=np.float64, engine='c', quoting=csv.QUOTE_NONE )
+		except pandas.errors.EmptyDataError:
+			return np.empty( ( 0, len( indices ) ) ) # Nothing but blank lines
+		# Columns come back in file order, and are labelled with their indices
+		return frame[list( indices )].to_numpy( dtype=np.float64 ).reshape( -1, len( indices ) )
+	with warnings.catch_warnings():
+		# A chunk of nothing but blank lines is not worth a warning
+		warnings.simplefilter( 'ignore', UserWarning )
+		return np.loadtxt( io.StringIO( fillBlankFields( ''.join( lines ) ) ), dtype=np.float64, delimiter='\t', comments=None, usecols=indices, ndmin=2 ).reshape( -1, len( indices ) )
+
+# Parses a chunk of lines into an nx3 array of the requested columns
+def parseLines( lines, indices ):
+	try:
+		return parseLinesNatively( lines, indices )
+	except ValueError:
+		if len( lines ) <= SLOW_BLOCK:
+			return parseLinesSlowly( lines, indices )
+	half = len( lines ) // 2
+	return np.concatenate( ( parseLines( lines[:half], indices ), parseLines( lines[half:], indices ) ) )
+
+# Reads the header of an open M77T file, and returns the column indices of the x, y and z fields
+def readHeader( reader, fp ):
+	fields = [field.strip() for field in reader.readline().split( '\t' )]
+	indices = list()
+	for field in ( X_FIELD, Y_FIELD, Z_FIELD ):
+		if field not in fields:
+			raise M77TFieldNotPresentException( fp, field )
+		indices.append( fields.index( field ) )
+	return indices
+
+# Generator which streams the points out of an M77T file
+# @param fp = The file path to the M77T file
+# @param chunk_size = The number of lines parsed at once. Bounds memory use
+# @return = Yields ( X, Y, Z ) tuples of float64 arrays, one per chunk. Rows with a missing or malformed longitude, latitude or depth are already removed. Chunks which lose every row are skipped
+def readM77tChunks( fp, chunk_size=CHUNK_SIZE ):
+	with open( fp, 'r' ) as reader:
+		indices = readHeader( reader, fp )
+		while True:
+			lines = list( itertools.islice( reader, chunk_size ) )
+			if len( lines ) == 0:
+				return
+			points = parseLines( lines, indices )
+			points = points[~np.isnan( points ).any( axis=1 )]
+			if len( points ) == 0:
+				continue
+			yield ( np.ascontiguousarray( points[:, 0] ), np.ascontiguousarray( points[:, 1] ), np.ascontiguousarray( points[:, 2] ) )
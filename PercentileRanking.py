@@ -0,0 +1,92 @@
+# Percentile Ranking
+# Ranks points by depth and converts the ranks to percentiles. The deepest (highest z) point is in the 0th percentile.
+# Tied depths always get the same percentile: a point's rank is the number of points strictly deeper than it.
+# Two ways of ranking are provided:
+#	rankDescending - Sorts the whole column in memory
+#	ExternalRanker - For columns larger than memory. Sorts the column in runs written to disk, merges the runs into one sorted file, then ranks each chunk against it
+import os
+import shutil
+import tempfile
+import numpy as np
+
+MERGE_BLOCK_VALUES = 4194304 # The most values held in memory at once while merging runs, across all of them
+
+# Converts ranks to whole percentiles of size
+def ranksToPercentiles( ranks, size ):
+	return ( np.asarray( ranks, dtype=np.int64 ) * 100 ) // size
+
+# Returns the rank of every value of Z: the number of values strictly greater than it
+def rankDescending( Z ):
+	NEG = -np.asarray( Z, dtype=np.float64 )
+	return np.searchsorted( np.sort( NEG ), NEG, side='left' )
+
+# Ranks a column too large to sort in memory. Feed every chunk of the column to addRun, then pass the chunks again through rank.
+# Memory use is bounded by the chunk size: the sorted runs live in temporary files, and are only ever read memory-mapped.
+# The first call to rank merges the runs into one sorted file, reading each run once, so that every chunk is ranked with a single search instead of one per run.
+class ExternalRanker( object ):
+	# @param temp_dir = The directory the sorted runs are written under. Defaults to the system's temporary directory
+	def __init__( self, temp_dir=None ):
+		self.directory = tempfile.mkdtemp( prefix='percentile_runs_', dir=temp_dir )
+		self.runs = list()
+		self.size = 0
+		self.merged = None # The merged runs, memory-mapped, once rank has been called
+		self.files = 0 # The number of files written, so every file gets a new name
+
+	# Sorts a chunk of the column and writes it to disk as a run
+	def addRun( self, Z ):
+		np.save( self.newFile( 'run' ), np.sort( -np.asarray( Z, dtype=np.float64 ) ) )
+		self.size += len( Z )
+		self.merged = None
+
+	def newFile( self, name ):
+		fp = os.path.join( self.directory, "%s_%d.npy" % ( name, self.files ) )
+		self.files += 1
+		self.runs.append( fp )
+		return fp
+
+	# Merges every run into one sorted file, which replaces them. Each run is read once, MERGE_BLOCK_VALUES / ( number of runs ) values at a time.
+	# Every buffered value up to the smallest of the buffers' last values comes before any value still on disk, so those are written out each round, and
+	# the buffers they empty are refilled
+	def merge( self ):
+		runs = [np.load( fp, mmap_mode='r' ) for fp in self.runs]
+		block = max( 1, MERGE_BLOCK_VALUES // max( 1, len( runs ) ) )
+		starts = [0] * len( runs )
+		buffers = [np.empty( 0 )] * len( runs )
+		fp = os.path.join( self.directory, "merged_%d.npy" % self.files )
+		merged = np.lib.format.open_memmap( fp, mode='w+', dtype=np.float64, shape=( self.size, ) )
+		written = 0
+		while written < self.size:
+			for ( number, run ) in enumerate( runs ):
+				if len( buffers[number] ) == 0 and starts[number] < len( run ):
+					buffers[number] = np.array( run[starts[number]:starts[number] + block] )
+					starts[number] += len( buffers[number] )
+			limit = min( values[-1] for values in buffers if len( values ) )
+			ends = [np.searchsorted( values, limit, side='right' ) for values in buffers]
+			values = np.sort( np.concatenate( [values[:end] for ( values, end ) in zip( buffers, ends )] ) )
+			merged[written:written + len( values )] = values
+			written += len( values )
+			buffers = [values[end:] for ( values, end ) in zip( buffers, ends )]
+		merged.flush()
+		del merged
+		del runs
+		for run in self.runs:
+			os.remove( run )
+		self.files += 1
+		self.runs = [fp]
+		self.merged = np.load( fp, mmap_mode='r' )
+
+	# Returns the rank of every value of Z among all the values added with addRun
+	# The chunk is searched for in sorted order, so each search starts near the last one and walks the merged file forward, instead of jumping about it
+	def rank( self, Z ):
+		if self.merged is None:
+			self.merge()
+		NEG = -np.asarray( Z, dtype=np.float64 )
+		order = np.argsort( NEG, kind='stable' )
+		ranks = np.empty( len( NEG ), dtype=np.int64 )
+		ranks[order] = np.searchsorted( self.merged, NEG[order], side='left' )
+		return ranks
+
+	# Deletes the runs
+	def close( self ):
+		self.merged = None
+		shutil.rmtree( self.directory, ignore_errors=True )
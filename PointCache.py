@@ -0,0 +1,148 @@
+# Point Cache
+# A compact, columnar, on-disk copy of a table's points, written once at import time and opened memory-mapped by every later stage.
+# Reopening a cache costs nothing but page faults: there is no text to parse and no cursor to walk.
+#
+# File layout (all values little endian):
+#	Header (64 bytes): magic 'DRPC', format version (uint32), point count (uint64), zero padding
+#	OID column: count int64 values
+#	X column: count float64 values
+#	Y column: count float64 values
+#	Z column: count float64 values
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+MAGIC = b'DRPC'
+VERSION = 1
+HEADER_FORMAT = '<4sIQ'
+HEADER_SIZE = 64
+EXTENSION = '.drpc'
+COLUMNS = ( ( 'oid', np.dtype( '<i8' ) ), ( 'x', np.dtype( '<f8' ) ), ( 'y', np.dtype( '<f8' ) ), ( 'z', np.dtype( '<f8' ) ) )
+SCAN_SIZE = 1000000 # The number of points examined at once when scanning a cache for the points inside a box
+
+class PointCacheFormatException( Exception ):
+	def __init__( self, fp, reason ):
+		self.fp = fp
+		self.reason = reason
+
+	def __str__( self ):
+		return "%s is not a valid point cache: %s" % ( self.fp, self.reason )
+
+# Returns the default cache directory for a GDB: a sibling directory named after the GDB
+def defaultCacheDir( GDB ):
+	return os.path.normpath( GDB ) + '_cache'
+
+# Returns the path of the point cache for a table
+def cachePath( cache_dir, table ):
+	return os.path.join( cache_dir, os.path.basename( table ) + EXTENSION )
+
+# Writes a point cache one chunk at a time. Since the point count is not known until the last chunk arrives, each column is spooled to its own temporary file
+# and the columns are concatenated behind the header on close. The finished cache replaces any existing file atomically, so a reader never sees half a cache.
+class PointCacheWriter( object ):
+	# @param fp = The path of the cache file to write
+	def __init__( self, fp ):
+		self.fp = fp
+		self.size = 0
+		directory = os.path.dirname( os.path.abspath( fp ) )
+		if not os.path.isdir( directory ):
+			os.makedirs( directory )
+		self.spools = [tempfile.TemporaryFile( dir=directory ) for ( name, dtype ) in COLUMNS]
+
+	# Appends a chunk of points to the cache
+	# @param OID = The object IDs of the points. If None, IDs continue sequentially from 1, the way a new feature class numbers its rows
+	def append( self, X, Y, Z, OID=None ):
+		if OID is None:
+			OID = np.arange( self.size + 1, self.size + len( X ) + 1 )
+		for ( spool, ( name, dtype ), column ) in zip( self.spools, COLUMNS, ( OID, X, Y, Z ) ):
+			spool.write( np.ascontiguousarray( column, dtype=dtype ).tobytes() )
+		self.size += len( X )
+
+	# Writes the header and the spooled columns to the cache file
+	def close( self ):
+		directory = os.path.dirname( os.path.abspath( self.fp ) )
+		( handle, temp_fp ) = tempfile.mkstemp( dir=directory, suffix=EXTENSION )
+		try:
+			with os.fdopen( handle, 'wb' ) as out:
+				out.write( struct.pack( HEADER_FORMAT, MAGIC, VERSION, self.size ).ljust( HEADER_SIZE, b'\0' ) )
+				for spool in self.spools:
+					spool.seek( 0 )
+					shutil.copyfileobj( spool, out )
+			os.replace( temp_fp, self.fp )
+		except:
+			os.remove( temp_fp )
+			raise
+		finally:
+			for spool in self.spools:
+				spool.close()
+		return self.size
+
+	# Discards the spooled columns without writing the cache. Any existing cache file is left as it was
+	def abort( self ):
+		for spool in self.spools:
+			spool.close()
+
+# Writes a whole set of points to a cache in one go
+def writePointCache( fp, X, Y, Z, OID=None ):
+	writer = PointCacheWriter( fp )
+	writer.append( X, Y, Z, OID )
+	return writer.close()
+
+# A read-only, memory-mapped view of a point cache. The oid, x, y and z attributes are NumPy arrays backed directly by the file
+class PointCache( object ):
+	def __init__( self, fp ):
+		self.fp = fp
+		with open( fp, 'rb' ) as reader:
+			header = reader.read( HEADER_SIZE )
+		if len( header ) < HEADER_SIZE:
+			raise PointCacheFormatException( fp, "file is too short to hold a header" )
+		( magic, version, self.size ) = struct.unpack_from( HEADER_FORMAT, header )
+		if magic != MAGIC:
+			raise PointCacheFormatException( fp, "bad magic number" )
+		if version != VERSION:
+			raise PointCacheFormatException( fp, "unsupported version %d" % version )
+		offset = HEADER_SIZE
+		for ( name, dtype ) in COLUMNS:
+			if self.size == 0:
+				column = np.empty( 0, dtype=dtype )
+			else:
+				column = np.memmap( fp, dtype=dtype, mode='r', offset=offset, shape=( self.size, ) )
+			setattr( self, name, column )
+			offset += self.size * dtype.itemsize
+
+	def __len__( self ):
+		return self.size
+
+	# Drops the cache's memory maps, so that the file can be replaced or deleted. Windows refuses to replace a file while any map of it is open, so
+	# neither this cache nor any slice of its columns may still be held. The cache cannot be read afterwards
+	def close( self ):
+		for ( name, dtype ) in COLUMNS:
+			setattr( self, name, None )
+
+	# Returns the ( xmin, ymin, xmax, ymax ) extent of the points
+	def getExtent( self ):
+		return ( float( self.x.min() ), float( self.y.min() ), float( self.x.max() ), float( self.y.max() ) )
+
+	# Returns a nx4 array of the x, y, z and oid values of every point with xmin <= x < xmax and ymin <= y < ymax
+	# The cache is scanned in slices, so memory use is bounded by the number of points inside the box. Usable as the READ_BOX function of a TiledKNNModel
+	def readBox( self, xmin, ymin, xmax, ymax ):
+		parts = list()
+		for start in range( 0, self.size, SCAN_SIZE ):
+			stop = min( start + SCAN_SIZE, self.size )
+			X = self.x[start:stop]
+			Y = self.y[start:stop]
+			inside = np.flatnonzero( ( X >= xmin ) & ( X < xmax ) & ( Y >= ymin ) & ( Y < ymax ) ) + start
+			if len( inside ):
+				parts.append( np.column_stack( ( self.x[inside], self.y[inside], self.z[inside], self.oid[inside] ) ) )
+		if len( parts ) == 0:
+			return np.empty( ( 0, 4 ) )
+		return np.concatenate( parts )
+
+# Opens the cache for a table, or returns None if the table has not been cached
+def openPointCache( cache_dir, table ):
+	fp = cachePath( cache_dir, table )
+	if not os.path.exists( fp ):
+		return None
+	return PointCache( fp )
@@ -0,0 +1,37 @@
+# Point Geometry
+# Encodes whole columns of points as GeoPackage geometry blobs at once. Every point of a column is laid out in one NumPy record array, so no
+# per-point geometry object is ever built: the only per-point work left is slicing the finished buffer into the blobs the database is handed.
+#
+# Blob layout (GeoPackage 1.2, section 2.1.3), little endian:
+#	GeoPackage header (8 bytes): magic 'GP', version 0, flags (little endian, no envelope), SRS ID (int32)
+#	ISO WKB point: byte order 1, geometry type (uint32: 1 for Point, 1001 for Point Z), x, y[, z] (float64)
+import numpy as np
+
+GPKG_FLAGS = 0x01 # Little endian byte order, no envelope, not empty, standard binary
+WKB_POINT = 1
+WKB_POINT_Z = 1001
+
+HEADER_FIELDS = [( 'magic', 'S2' ), ( 'version', 'u1' ), ( 'flags', 'u1' ), ( 'srs_id', '<i4' ), ( 'byte_order', 'u1' ), ( 'wkb_type', '<u4' ), ( 'x', '<f8' ), ( 'y', '<f8' )]
+POINT_DTYPE = np.dtype( HEADER_FIELDS ) # Packed: NumPy only pads structured dtypes when asked to align them
+POINT_Z_DTYPE = np.dtype( HEADER_FIELDS + [( 'z', '<f8' )] )
+
+# Encodes points as GeoPackage geometry blobs
+# @param srs_id = The SRS ID written into every blob. It must match the srs_id of the table's geometry column
+# @param Z = If given, the points are encoded as Point Z
+# @return = A list of bytes, one blob per point
+def encodeGeoPackagePoints( X, Y, srs_id, Z=None ):
+	records = np.empty( len( X ), dtype=POINT_DTYPE if Z is None else POINT_Z_DTYPE )
+	records['magic'] = b'GP'
+	records['version'] = 0
+	records['flags'] = GPKG_FLAGS
+	records['srs_id'] = srs_id
+	records['byte_order'] = 1
+	records['wkb_type'] = WKB_POINT if Z is None else WKB_POINT_Z
+	records['x'] = X
+	records['y'] = Y
+	if Z is not None:
+		records['z'] = Z
+	buffer = records.tobytes()
+	size = records.dtype.itemsize
+	return [buffer[start:start + size] for start in range( 0, len( buffer ), size )]
+
@@ -0,0 +1,67 @@
+# Processing Plan
+# Describes the processing stages a DataProcessor applies to its tables, and orders them so that every stage runs after the stages it depends on.
+# Each stage is keyed by the TPR field which records whether it has run. A stage may also declare the columns it reads and the columns it writes,
+# and supply a compute function working on columns already in memory. Such stages are fusable: every pending fusable stage of a table can then share
+# a single read of the table's columns and a single write of their results.
+
+class StageDependencyException( Exception ):
+	def __init__( self, flag, reason ):
+		self.flag = flag
+		self.reason = reason
+
+	def __str__( self ):
+		return "Cannot plan processing stage '%s': %s" % ( self.flag, self.reason )
+
+class ProcessingStage( object ):
+	# @param flag = The TPR field recording the stage. Tables with 0 in it have not undergone the stage
+	# @param apply = Function( table ) which runs the stage on its own, straight against storage
+	# @param compute = Function( table, columns ) which runs the stage on a dictionary of columns already in memory, and returns a
+	#	( dictionary of new column name to array, dictionary of TPR field to value ) tuple. None if the stage can only run against storage
+	# @param depends = The flags of the stages which must have run first
+	# @param reads = The fields compute needs in its columns
+	# @param writes = The ( name, type ) of every column compute returns. The columns are added to the table before they are written
+	def __init__( self, flag, apply, compute=None, depends=(), reads=(), writes=() ):
+		self.flag = flag
+		self.apply = apply
+		self.compute = compute
+		self.depends = tuple( depends )
+		self.reads = tuple( reads )
+		self.writes = tuple( writes )
+
+	def isFusable( self ):
+		return self.compute != None
+
+	def __repr__( self ):
+		return "ProcessingStage( '%s' )" % self.flag
+
+# Orders stages so that each comes after every stage it depends on. Stages with no ordering between them keep the order they were given in
+# @param stages = A dictionary of flag to ProcessingStage, such as DataProcessor.defineProcessingDictionary returns
+# @return = A list of ProcessingStages
+def planStages( stages ):
+	for flag in stages:
+		for dependency in stages[flag].depends:
+			if dependency not in stages:
+				raise StageDependencyException( flag, "depends on unknown stage '%s'" % dependency )
+	plan = list()
+	planned = set()
+	remaining = list( stages )
+	while len( remaining ):
+		ready = [flag for flag in remaining if all( dependency in planned for dependency in stages[flag].depends )]
+		if len( ready ) == 0:
+			raise StageDependencyException( remaining[0], "its dependencies form a cycle among %s" % ", ".join( remaining ) )
+		# Only the first ready stage is taken, so that declaration order decides between independent stages
+		plan.append( stages[ready[0]] )
+		planned.add( ready[0] )
+		remaining.remove( ready[0] )
+	return plan
+
+# Returns the fields a group of fusable stages must read from storage: everything they read, less the columns written by earlier stages of the group
+def fusedReads( stages ):
+	fields = list()
+	written = set()
+	for stage in stages:
+		for field in stage.reads:
+			if field not in written and field not in fields:
+				fields.append( field )
+		written.update( name for ( name, field_type ) in stage.writes )
+	return fields
@@ -0,0 +1,269 @@
+# Spatial Tile Index
+# One spatial index over the points of every table in a database, so that a table's residuals see neighbors from every survey overlapping it, not just its own.
+# The plane is cut into a fixed grid of square tiles. Each table's points are sorted by the tile they fall in, and stored as one point cache (see PointCache.py),
+# so that the points of a table in any one tile (a fragment) are a contiguous range of its cache:
+#	<directory>/index.json						The tile size, fixed when the index is created
+#	<directory>/tables/<table>.drpc				The points of table, sorted by tile
+#	<directory>/tables/<table>.json				The tiles table has points in, and the first row of each tile's fragment in its cache
+# Tile ( i, j ) covers i * size <= x < ( i + 1 ) * size, j * size <= y < ( j + 1 ) * size. Adding a table writes two files however many tiles its points
+# spread over, so sparse surveys (tracklines, say) cost no more to index than dense ones. Tables are independent of each other, so worker processes can index tables at once.
+# A table's JSON file is written after its cache and removed before it: a table without one is invisible to readers.
+# Readers load the tile layout of every table once, and then visit only the tiles a box overlaps.
+import os
+import os.path
+import json
+import math
+import tempfile
+import numpy as np
+from PointCache import PointCache, writePointCache, EXTENSION
+
+TILE_SIZE = 20000.0 # The default width and height of a tile, in XY units (metres, once tables are projected)
+INDEX_FILE = 'index.json'
+BLOCK_POINTS = 65536 # The default number of a table's points scored together when calculating its residuals (see groupTiles)
+MAX_BLOCK_POINTS = 4194304 # The default limit on the points of all tables in one block of tiles scored together
+
+# Returns the directory of the tile index kept among a database's point caches
+def tileIndexDir( cache_dir ):
+	return os.path.join( cache_dir, 'tile_index' )
+
+class SpatialTileIndex( object ):
+	# @param directory = The directory the index is kept in. It is created if it does not exist
+	# @param tile_size = The tile size of a new index. An existing index keeps the tile size it was created with
+	def __init__( self, directory, tile_size=TILE_SIZE ):
+		self.directory = directory
+		self.tables_dir = os.path.join( directory, 'tables' )
+		if not os.path.isdir( self.tables_dir ):
+			os.makedirs( self.tables_dir, exist_ok=True )
+		index_fp = os.path.join( directory, INDEX_FILE )
+		if not os.path.exists( index_fp ):
+			self.writeJSON( index_fp, { 'tile_size':float( tile_size ) } )
+		with open( index_fp ) as f:
+			self.tile_size = json.load( f )['tile_size']
+		self.layout = None # Table -> { tile:( start, stop ) }, loaded by getLayout
+		self.tile_tables = None # Tile -> the tables with a fragment in it
+		self.caches = dict() # Table -> its open PointCache
+
+	# Writes a JSON file atomically, so a reader never sees half of one
+	def writeJSON( self, fp, content ):
+		( handle, temp_fp ) = tempfile.mkstemp( dir=os.path.dirname( fp ), suffix='.json' )
+		try:
+			with os.fdopen( handle, 'w' ) as f:
+				json.dump( content, f )
+			os.replace( temp_fp, fp )
+		except:
+			os.remove( temp_fp )
+			raise
+
+	def getTablePath( self, table ):
+		return os.path.join( self.tables_dir, table + '.json' )
+
+	def getCachePath( self, table ):
+		return os.path.join( self.tables_dir, table + EXTENSION )
+
+	# Returns the ( xmin, ymin, xmax, ymax ) bounds of a tile
+	def getTileBounds( self, tile ):
+		( i, j ) = tile
+		return ( i * self.tile_size, j * self.tile_size, ( i + 1 ) * self.tile_size, ( j + 1 ) * self.tile_size )
+
+	# Returns the names of every table in the index
+	def getTables( self ):
+		return [os.path.splitext( name )[0] for name in os.listdir( self.tables_dir ) if name.endswith( '.json' )]
+
+	def hasTable( self, table ):
+		return os.path.exists( self.getTablePath( table ) )
+
+	# Reads a table's JSON file
+	# @return = A dictionary of tile, as an ( i, j ) tuple, to the ( start, stop ) rows of the table's cache holding its points in the tile
+	def readTableTiles( self, table ):
+		with open( self.getTablePath( table ) ) as f:
+			entry = json.load( f )
+		stops = entry['starts'][1:] + [entry['size']]
+		return dict( ( tuple( tile ), ( start, stop ) ) for ( tile, start, stop ) in zip( entry['tiles'], entry['starts'], stops ) )
+
+	# Returns the tile layout of every table, read once and kept. Tables added or removed by another process after it is read are not seen
+	def getLayout( self ):
+		if self.layout == None:
+			self.layout = dict()
+			self.tile_tables = dict()
+			for table in self.getTables():
+				try:
+					tiles = self.readTableTiles( table )
+				except OSError:
+					continue # The table was removed while we were looking
+				self.layout[table] = tiles
+				for tile in tiles:
+					self.tile_tables.setdefault( tile, list() ).append( table )
+		return self.layout
+
+	# Forgets the loaded layout and open caches, so that the next read sees the index as it is now
+	def refresh( self ):
+		self.layout = None
+		self.tile_tables = None
+		self.caches = dict()
+
+	# Returns the tiles table has points in, as ( i, j ) tuples
+	def getTableTiles( self, table ):
+		return list( self.readTableTiles( table ).keys() )
+
+	# Returns the names of the tables with a fragment in tile
+	def getTileTables( self, tile ):
+		self.getLayout()
+		return list( self.tile_tables.get( tuple( tile ), list() ) )
+
+	# Returns every tile holding points of any table
+	def getTiles( self ):
+		self.getLayout()
+		return list( self.tile_tables.keys() )
+
+	# Returns the ( xmin, ymin, xmax, ymax ) bounds of the populated tiles, which contain every point in the index. None if the index is empty
+	def getExtent( self ):
+		tiles = self.getTiles()
+		if len( tiles ) == 0:
+			return None
+		I = [i for ( i, j ) in tiles]
+		J = [j for ( i, j ) in tiles]
+		return ( min( I ) * self.tile_size, min( J ) * self.tile_size, ( max( I ) + 1 ) * self.tile_size, ( max( J ) + 1 ) * self.tile_size )
+
+	# Adds a table's points to the index, replacing any points it had there before
+	def addTable( self, table, X, Y, Z, OID ):
+		self.removeTable( table )
+		X = np.asarray( X, dtype=np.float64 )
+		Y = np.asarray( Y, dtype=np.float64 )
+		I = np.floor( X / self.tile_size ).astype( np.int64 )
+		J = np.floor( Y / self.tile_size ).astype( np.int64 )
+		# Sorting by tile puts each fragment's points next to each other, in their original order
+		order = np.lexsort( ( J, I ) )
+		( I, J ) = ( I[order], J[order] )
+		starts = np.flatnonzero( np.concatenate( ( [True], ( np.diff( I ) != 0 ) | ( np.diff( J ) != 0 ) ) ) ) if len( order ) else np.empty( 0, dtype=np.int64 )
+		writePointCache( self.getCachePath( table ), X[order], Y[order], np.asarray( Z )[order], np.asarray( OID )[order] )
+		tiles = [( int( I[start] ), int( J[start] ) ) for start in starts]
+		self.writeJSON( self.getTablePath( table ), { 'tiles':tiles, 'starts':starts.tolist(), 'size':len( X ) } )
+		self.refresh()
+		return tiles
+
+	# Removes a table's points from the index. Returns True if the table was in the index
+	def removeTable( self, table ):
+		if not self.hasTable( table ):
+			return False
+		os.remove( self.getTablePath( table ) )
+		if os.path.exists( self.getCachePath( table ) ):
+			os.remove( self.getCachePath( table ) )
+		self.refresh()
+		return True
+
+	# Returns the x, y, z and oid columns of a table's cache, as plain arrays over the memory map (slicing a np.memmap costs far more than slicing an array)
+	def getCache( self, table ):
+		if table not in self.caches:
+			cache = PointCache( self.getCachePath( table ) )
+			self.caches[table] = tuple( np.asarray( getattr( cache, column ) ) for column in ( 'x', 'y', 'z', 'oid' ) )
+		return self.caches[table]
+
+	# Returns a nx4 array of the x, y, z and oid values of a table's points in some of its tiles
+	# Fragments which lie next to each other in the table's cache (neighboring tiles of one column, say) are read as one range
+	def readFragments( self, table, tiles ):
+		layout = self.getLayout()[table]
+		ranges = sorted( layout[tuple( tile )] for tile in tiles )
+		merged = list()
+		for ( start, stop ) in ranges:
+			if len( merged ) and merged[-1][1] == start:
+				merged[-1] = ( merged[-1][0], stop )
+			else:
+				merged.append( ( start, stop ) )
+		rows = np.concatenate( [np.arange( start, stop ) for ( start, stop ) in merged] ) if len( merged ) > 1 else slice( *merged[0] )
+		return np.column_stack( [column[rows] for column in self.getCache( table )] )
+
+	# Returns a nx4 array of the x, y, z and oid values of a table's points in one tile
+	def readFragment( self, table, tile ):
+		return self.readFragments( table, [tile] )
+
+	# Returns the populated tiles overlapping a box. Tiles which only touch the box are included too, in case a point on the tile's edge was rounded into it
+	# Only the tiles in the box's range of rows and columns are looked up, unless the box spans more tiles than are populated
+	def getTilesInBox( self, xmin, ymin, xmax, ymax ):
+		tiles = self.getTiles()
+		if len( tiles ) == 0:
+			return list()
+		( emin, fmin, emax, fmax ) = self.getExtent()
+		( xmin, ymin, xmax, ymax ) = ( max( xmin, emin ), max( ymin, fmin ), min( xmax, emax ), min( ymax, fmax ) )
+		if xmin > xmax or ymin > ymax:
+			return list()
+		( imin, imax ) = ( int( math.ceil( xmin / self.tile_size ) ) - 1, int( math.floor( xmax / self.tile_size ) ) )
+		( jmin, jmax ) = ( int( math.ceil( ymin / self.tile_size ) ) - 1, int( math.floor( ymax / self.tile_size ) ) )
+		if ( imax - imin + 1 ) * ( jmax - jmin + 1 ) > len( tiles ):
+			return [( i, j ) for ( i, j ) in tiles if imin <= i <= imax and jmin <= j <= jmax]
+		return [( i, j ) for i in range( imin, imax + 1 ) for j in range( jmin, jmax + 1 ) if ( i, j ) in self.tile_tables]
+
+	# Returns a nx4 array of the x, y, z and oid values of every indexed point with xmin <= x < xmax and ymin <= y < ymax, whichever table it belongs to
+	# Usable as the READ_BOX function of a TiledKNNModel
+	# @param tables = If given, only the points of these tables are returned
+	def readBox( self, xmin, ymin, xmax, ymax, tables=None ):
+		tables = None if tables == None else set( tables )
+		by_table = dict()
+		for tile in self.getTilesInBox( xmin, ymin, xmax, ymax ):
+			for table in self.tile_tables[tile]:
+				if tables == None or table in tables:
+					by_table.setdefault( table, list() ).append( tile )
+		parts = list()
+		for ( table, tiles ) in by_table.items():
+			points = self.readFragments( table, tiles )
+			inside = ( points[:, 0] >= xmin ) & ( points[:, 0] < xmax ) & ( points[:, 1] >= ymin ) & ( points[:, 1] < ymax )
+			if inside.any():
+				parts.append( points[inside] )
+		if len( parts ) == 0:
+			return np.empty( ( 0, 4 ) )
+		return np.concatenate( parts )
+
+	# Returns the number of points of every table in each populated tile
+	def getTilePoints( self ):
+		counts = dict()
+		for tiles in self.getLayout().values():
+			for ( tile, ( start, stop ) ) in tiles.items():
+				counts[tile] = counts.get( tile, 0 ) + stop - start
+		return counts
+
+	# Groups the tiles a table has points in into square blocks of factor x factor tiles, doubling factor while its blocks hold fewer than block_points of
+	# its points on average, so that a sparse table (a trackline, say) is scored in a few large blocks rather than many near-empty tiles.
+	# Blocks never grow to hold more than max_points points of all tables, so a sparse table crossing a dense one does not load the dense one whole
+	# @return = A dictionary of the ( xmin, ymin, xmax, ymax ) bounds of each block to the tiles in it
+	def groupTiles( self, table, block_points=BLOCK_POINTS, max_points=MAX_BLOCK_POINTS ):
+		tiles = self.getLayout()[table]
+		if len( tiles ) == 0:
+			return dict()
+		size = sum( stop - start for ( start, stop ) in tiles.values() )
+		tile_points = self.getTilePoints()
+		# Blocks are counted from the table's lowest tile, so that doubling factor always ends in a single block
+		imin = min( i for ( i, j ) in tiles )
+		jmin = min( j for ( i, j ) in tiles )
+		key = lambda i, j, factor: ( ( i - imin ) // factor, ( j - jmin ) // factor )
+		group = lambda factor: dict( ( key( i, j, factor ), list() ) for ( i, j ) in tiles )
+		factor = 1
+		while True:
+			blocks = group( factor )
+			if len( blocks ) <= 1 or size / len( blocks ) >= block_points:
+				break
+			coarser = group( factor * 2 )
+			totals = dict()
+			for ( ( i, j ), count ) in tile_points.items():
+				block = key( i, j, factor * 2 )
+				if block in coarser:
+					totals[block] = totals.get( block, 0 ) + count
+			if max( totals.values() ) > max_points:
+				break
+			factor *= 2
+		for ( i, j ) in tiles:
+			blocks[key( i, j, factor )].append( ( i, j ) )
+		bounds = lambda bi, bj: self.getTileBounds( ( imin + bi * factor, jmin + bj * factor ) )[:2] + self.getTileBounds( ( imin + ( bi + 1 ) * factor - 1, jmin + ( bj + 1 ) * factor - 1 ) )[2:]
+		return dict( ( bounds( bi, bj ), members ) for ( ( bi, bj ), members ) in blocks.items() )
+
+	# Calculates the residuals of a table's points against the points of every table in the index. Only the blocks of tiles the table has points in
+	# (see groupTiles), and the halos around them, are read
+	# TiledKNNModel is imported here rather than at the top of the module, so that tables can be added and removed in environments without scipy
+	# @param NAMES = The estimators to calculate (see NeighborScores)
+	# @return = A generator yielding one array per block: the x, y, z and oid of each of the table's points, plus one column per estimator
+	def calculateResiduals( self, table, NUM_NN=150, workers=-1, NAMES=( 'residual', ), block_points=BLOCK_POINTS, max_points=MAX_BLOCK_POINTS ):
+		from KNearestNeighborModel import TiledKNNModel
+		self.refresh()
+		blocks = self.groupTiles( table, block_points, max_points )
+		# The table's points are read whole from its fragments rather than by box, so a point rounded into a tile it lies just outside of is still scored
+		read_query = lambda xmin, ymin, xmax, ymax: self.readFragments( table, blocks[( xmin, ymin, xmax, ymax )] )
+		model = TiledKNNModel( self.readBox, self.getExtent(), self.tile_size, NUM_NN, READ_QUERY=read_query, TILES=list( blocks.keys() ), NAMES=NAMES )
+		return model.CalculateAllResiduals( workers )
@@ -0,0 +1,514 @@
+# Storage Backend
+# The importers and processors never talk to a database directly. They go through a StorageBackend, which provides the handful of table operations the
+# pipeline needs, always in bulk: whole columns are read and written as NumPy arrays rather than one row at a time.
+# Two backends are provided:
+#	ArcGDBBackend - A File Geodatabase, through arcpy. Only available where arcpy is installed
+#	SQLiteBackend - A GeoPackage (an SQLite database), through the standard library. Runs anywhere
+import os
+import os.path
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+from PointGeometry import encodeGeoPackagePoints
+try:
+	import arcpy
+except ImportError:
+	arcpy = None # Only the ArcGDBBackend needs arcpy
+
+OID_FIELD = 'OID@' # Refers to a table's object ID field, whatever its name in the underlying database
+CHUNK_SIZE = 500000 # The default number of rows read at once by iterColumns
+KEY_BATCH = 500 # The number of keys readRowsByKey looks up with each query
+
+# A spatial reference, as understood by every backend: an EPSG code (used by the GeoPackage), a name, and the WKT (used by arcpy)
+SpatialReference = namedtuple( 'SpatialReference', ( 'srs_id', 'name', 'wkt' ) )
+
+class StorageBackendException( Exception ):
+	def __init__( self, path, reason ):
+		self.path = path
+		self.reason = reason
+
+	def __str__( self ):
+		return "Storage error in %s: %s" % ( self.path, self.reason )
+
+# The interface every storage backend provides. Field types are given with the arcpy names: 'SHORT', 'LONG', 'FLOAT', 'DOUBLE', 'TEXT', 'DATE' or 'BLOB'
+class StorageBackend( object ):
+	def __init__( self, path ):
+		self.path = path
+
+	# Returns the names of all the data tables in the database
+	def listTables( self ):
+		raise NotImplementedError()
+
+	def tableExists( self, table ):
+		raise NotImplementedError()
+
+	# Returns the number of rows in table
+	def getCount( self, table ):
+		raise NotImplementedError()
+
+	# Returns the names of the fields of table
+	def getFields( self, table ):
+		raise NotImplementedError()
+
+	# Returns the real name of table's object ID field
+	def getOIDField( self, table ):
+		raise NotImplementedError()
+
+	# Adds a field to table. Does nothing if the field is already present
+	def addField( self, table, field, field_type ):
+		raise NotImplementedError()
+
+	# Creates a plain (non-spatial) table
+	# @param fields = A list of ( name, type, default ) tuples. default may be None
+	def createTable( self, table, fields ):
+		raise NotImplementedError()
+
+	# Creates an empty point table ready to receive points from appendPoints
+	# @param spatial_reference = The SpatialReference of the points
+	def createPointTable( self, table, spatial_reference ):
+		raise NotImplementedError()
+
+	# Appends points to a table made by createPointTable. Returns the number of points written
+	def appendPoints( self, table, X, Y, Z ):
+		raise NotImplementedError()
+
+	def deleteTable( self, table ):
+		raise NotImplementedError()
+
+	# Reads whole columns of table
+	# @param fields = The fields to read. OID_FIELD reads the object IDs
+	# @return = A dictionary of field name to NumPy array
+	def readColumns( self, table, fields ):
+		raise NotImplementedError()
+
+	# Generator which reads columns of table in chunks of at most chunk_size rows. Yields dictionaries like those returned by readColumns
+	def iterColumns( self, table, fields, chunk_size=CHUNK_SIZE ):
+		raise NotImplementedError()
+
+	# Writes whole columns of table back in bulk
+	# @param oids = The object IDs of the rows being written
+	# @param columns = A dictionary of field name to array of values, in the same order as oids
+	def writeColumns( self, table, oids, columns ):
+		raise NotImplementedError()
+
+	# Writes point geometry for every row of table from its coordinates, in bulk, replacing any existing geometry
+	# @param oids = The object IDs of the rows, in the same order as X and Y
+	# @param spatial_reference = The SpatialReference of X and Y
+	# @param spatial_index = If True, the table's spatial index is (re)built in the same pass
+	def writeGeometry( self, table, oids, X, Y, spatial_reference, spatial_index=True ):
+		raise NotImplementedError()
+
+	# Row-level access, used by the TableProcessingRecord. rows are tuples in the order of fields
+	def readRows( self, table, fields ):
+		raise NotImplementedError()
+
+	# Reads only the rows of table whose key_field holds one of keys, as readRows does
+	def readRowsByKey( self, table, key_field, keys, fields ):
+		raise NotImplementedError()
+
+	def insertRows( self, table, fields, rows ):
+		raise NotImplementedError()
+
+	# @param updates = A dictionary of key value to a dictionary of field name to new value
+	def updateRowsByKey( self, table, key_field, updates ):
+		raise NotImplementedError()
+
+	def deleteRowsByKey( self, table, key_field, keys ):
+		raise NotImplementedError()
+
+	# Context manager wrapping a group of writes in a single transaction
+	@contextmanager
+	def transaction( self ):
+		yield
+
+# Stores tables in a File Geodatabase (and dataset within, if specified) through arcpy
+class ArcGDBBackend( StorageBackend ):
+	def __init__( self, GDB, dataset=None ):
+		if arcpy == None:
+			raise StorageBackendException( GDB, "arcpy is not available" )
+		self.GDB = GDB
+		self.path = GDB
+		if dataset != None:
+			self.path = os.path.join( GDB, dataset )
+
+	def getPath( self, table ):
+		return os.path.join( self.path, table )
+
+	def listTables( self ):
+		return arcpy.ListFeatureClasses() + arcpy.ListTables()
+
+	def tableExists( self, table ):
+		return arcpy.Exists( self.getPath( table ) )
+
+	def getCount( self, table ):
+		return int( arcpy.GetCount_management( self.getPath( table ) ).getOutput( 0 ) )
+
+	def getFields( self, table ):
+		return [f.name for f in arcpy.ListFields( self.getPath( table ) )]
+
+	def getOIDField( self, table ):
+		return arcpy.Describe( self.getPath( table ) ).OIDFieldName
+
+	def addField( self, table, field, field_type ):
+		if field not in self.getFields( table ):
+			arcpy.AddField_management( self.getPath( table ), field, field_type )
+
+	def createTable( self, table, fields ):
+		arcpy.CreateTable_management( self.path, table )
+		for ( name, field_type, default ) in fields:
+			arcpy.AddField_management( self.getPath( table ), name, field_type )
+			if default != None:
+				arcpy.AssignDefaultToField_management( self.getPath( table ), name, default )
+
+	def createPointTable( self, table, spatial_reference ):
+		arcpy.CreateFeatureclass_management( self.path, table, "POINT", "", "DISABLED", "ENABLED", spatial_reference.wkt )
+
+	def appendPoints( self, table, X, Y, Z ):
+		iCur = arcpy.da.InsertCursor( self.getPath( table ), ( 'SHAPE@XYZ', ) )
+		for point in zip( X.tolist(), Y.tolist(), Z.tolist() ):
+			iCur.insertRow( ( point, ) )
+		del iCur
+		return len( X )
+
+	def deleteTable( self, table ):
+		arcpy.Delete_management( self.getPath( table ) )
+
+	def toColumns( self, array, fields ):
+		return dict( ( field, np.ascontiguousarray( array[field] ) ) for field in fields )
+
+	def readColumns( self, table, fields ):
+		return self.toColumns( arcpy.da.TableToNumPyArray( self.getPath( table ), list( fields ), skip_nulls=False ), fields )
+
+	# Reads the table in ranges of object IDs, so that each chunk is fetched as one bulk array
+	def iterColumns( self, table, fields, chunk_size=CHUNK_SIZE ):
+		fp = self.getPath( table )
+		oid_field = self.getOIDField( table )
+		sCur = arcpy.da.SearchCursor( fp, ( OID_FIELD, ), sql_clause=( None, "ORDER BY %s DESC" % oid_field ) )
+		last = next( iter( sCur ), ( 0, ) )[0]
+		del sCur
+		for start in range( 0, last + 1, chunk_size ):
+			where_clause = "%s >= %d AND %s < %d" % ( oid_field, start, oid_field, start + chunk_size )
+			array = arcpy.da.TableToNumPyArray( fp, list( fields ), where_clause, skip_nulls=False )
+			if len( array ):
+				yield self.toColumns( array, fields )
+
+	def writeColumns( self, table, oids, columns ):
+		oids = np.asarray( oids )
+		sorter = np.argsort( oids, kind='stable' )
+		sorted_oids = oids[sorter]
+		fields = list( columns.keys() )
+		values = [np.asarray( columns[field] ) for field in fields]
+		uCur = arcpy.da.UpdateCursor( self.getPath( table ), [OID_FIELD] + fields )
+		for row in uCur:
+			pos = np.searchsorted( sorted_oids, row[0] )
+			if pos == len( sorted_oids ) or sorted_oids[pos] != row[0]:
+				continue
+			index = sorter[pos]
+			uCur.updateRow( [row[0]] + [column[index].item() for column in values] )
+		del uCur
+
+	# The points are written through SHAPE@XY tuples, so no arcpy.Point or arcpy.PointGeometry is ever built.
+	# The coordinates are written in place, so the feature class's spatial reference is then redefined to match them
+	def writeGeometry( self, table, oids, X, Y, spatial_reference, spatial_index=True ):
+		oids = np.asarray( oids )
+		sorter = np.argsort( oids, kind='stable' )
+		sorted_oids = oids[sorter]
+		X = np.asarray( X, dtype=np.float64 )
+		Y = np.asarray( Y, dtype=np.float64 )
+		uCur = arcpy.da.UpdateCursor( self.getPath( table ), [OID_FIELD, 'SHAPE@XY'] )
+		for row in uCur:
+			pos = np.searchsorted( sorted_oids, row[0] )
+			if pos == len( sorted_oids ) or sorted_oids[pos] != row[0]:
+				continue
+			index = sorter[pos]
+			uCur.updateRow( [row[0], ( X[index].item(), Y[index].item() )] )
+		del uCur
+		arcpy.DefineProjection_management( self.getPath( table ), arcpy.SpatialReference( text=spatial_reference.wkt ) )
+		if spatial_index:
+			arcpy.AddSpatialIndex_management( self.getPath( table ) )
+
+	def readRows( self, table, fields ):
+		sCur = arcpy.da.SearchCursor( self.getPath( table ), fields )
+		rows = [tuple( row ) for row in sCur]
+		del sCur
+		return rows
+
+	# Keys are text, and are matched KEY_BATCH at a time with an IN clause
+	def readRowsByKey( self, table, key_field, keys, fields ):
+		keys = list( keys )
+		rows = list()
+		field = arcpy.AddFieldDelimiters( self.getPath( table ), key_field )
+		for start in range( 0, len( keys ), KEY_BATCH ):
+			where = "%s IN ( %s )" % ( field, ", ".join( "'%s'" % key.replace( "'", "''" ) for key in keys[start:start + KEY_BATCH] ) )
+			sCur = arcpy.da.SearchCursor( self.getPath( table ), fields, where )
+			rows.extend( tuple( row ) for row in sCur )
+			del sCur
+		return rows
+
+	def insertRows( self, table, fields, rows ):
+		iCur = arcpy.da.InsertCursor( self.getPath( table ), fields )
+		for row in rows:
+			iCur.insertRow( row )
+		del iCur
+
+	def updateRowsByKey( self, table, key_field, updates ):
+		fields = sorted( set( field for key in updates for field in updates[key] ) )
+		uCur = arcpy.da.UpdateCursor( self.getPath( table ), [key_field] + fields )
+		for row in uCur:
+			if row[0] in updates:
+				changes = updates[row[0]]
+				uCur.updateRow( [row[0]] + [changes.get( field, row[index + 1] ) for ( index, field ) in enumerate( fields )] )
+		del uCur
+
+	def deleteRowsByKey( self, table, key_field, keys ):
+		uCur = arcpy.da.UpdateCursor( self.getPath( table ), ( key_field, ) )
+		for row in uCur:
+			if row[0] in keys:
+				uCur.deleteRow()
+		del uCur
+
+	@contextmanager
+	def transaction( self ):
+		with arcpy.da.Editor( self.GDB ):
+			yield
+
+SQLITE_TYPES = { 'SHORT':'INTEGER', 'LONG':'INTEGER', 'FLOAT':'REAL', 'DOUBLE':'REAL', 'TEXT':'TEXT', 'DATE':'TEXT', 'BLOB':'BLOB', 'GEOMETRY':'BLOB' }
+NUMPY_TYPES = { 'INTEGER':np.int64, 'REAL':np.float64 } # Any other column type is read as an object array
+GPKG_APPLICATION_ID = 0x47504B47 # 'GPKG'
+GPKG_USER_VERSION = 10200 # GeoPackage 1.2
+GEOMETRY_COLUMN = 'geom'
+RTREE_EXTENSION = 'http://www.geopackage.org/spec120/#extension_rtree'
+RTREE_CACHE_KB = 262144 # SQLite page cache used while filling a spatial index. RTree inserts touch pages all over the index, and run about twice as fast with a large cache
+SQLITE_OID = 'fid' # The GeoPackage convention for the integer primary key of a table
+
+# Quotes an SQL identifier
+def quote( name ):
+	return '"%s"' % name.replace( '"', '""' )
+
+# The name the GeoPackage RTree extension gives a table's spatial index
+def rtreeName( table ):
+	return "rtree_%s_%s" % ( table, GEOMETRY_COLUMN )
+
+# Stores tables in a GeoPackage, which is an SQLite database laid out to the OGC GeoPackage standard, so the results open directly in QGIS, GDAL and ArcGIS.
+# Every table has an integer 'fid' primary key, which plays the part of the object ID. Point tables hold plain x, y and z columns.
+class SQLiteBackend( StorageBackend ):
+	# @param path = The path to the GeoPackage. It is created if it does not exist
+	# @param timeout = Seconds to wait for another process's write to finish before giving up
+	def __init__( self, path, timeout=60.0 ):
+		self.path = path
+		self.timeout = timeout
+		self.connection = None
+		self.depth = 0 # How many transaction() blocks we are inside
+		self.initializeGeoPackage()
+
+	# The connection cannot be pickled, so a copy of the backend sent to a worker process opens its own
+	def __getstate__( self ):
+		state = dict( self.__dict__ )
+		state['connection'] = None
+		state['depth'] = 0
+		return state
+
+	def connect( self ):
+		if self.connection == None:
+			# isolation_level=None leaves transactions to transaction(), rather than the sqlite3 module's implicit ones
+			self.connection = sqlite3.connect( self.path, timeout=self.timeout, isolation_level=None )
+			self.connection.execute( "PRAGMA journal_mode=WAL" ) # Lets readers carry on while a writer works
+			self.connection.execute( "PRAGMA synchronous=NORMAL" )
+		return self.connection
+
+	def execute( self, sql, parameters=() ):
+		return self.connect().execute( sql, parameters )
+
+	def close( self ):
+		if self.connection != None:
+			self.connection.close()
+			self.connection = None
+
+	@contextmanager
+	def transaction( self ):
+		if self.depth == 0:
+			self.execute( "BEGIN IMMEDIATE" )
+		self.depth += 1
+		try:
+			yield
+		except:
+			self.depth -= 1
+			if self.depth == 0:
+				self.execute( "ROLLBACK" )
+			raise
+		self.depth -= 1
+		if self.depth == 0:
+			self.execute( "COMMIT" )
+
+	# Creates the tables every GeoPackage must have
+	def initializeGeoPackage( self ):
+		with self.transaction():
+			self.execute( "PRAGMA application_id=%d" % GPKG_APPLICATION_ID )
+			self.execute( "PRAGMA user_version=%d" % GPKG_USER_VERSION )
+			self.execute( "CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys ( srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT )" )
+			self.execute( "CREATE TABLE IF NOT EXISTS gpkg_contents ( table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER )" )
+			self.execute( "CREATE TABLE IF NOT EXISTS gpkg_geometry_columns ( table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY ( table_name, column_name ) )" )
+			self.addSpatialReference( SpatialReference( 4326, 'WGS 84 geodetic', 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]' ) )
+			self.addSpatialReference( SpatialReference( -1, 'Undefined cartesian SRS', 'undefined' ) )
+			self.addSpatialReference( SpatialReference( 0, 'Undefined geographic SRS', 'undefined' ) )
+
+	def addSpatialReference( self, spatial_reference ):
+		( srs_id, name, wkt ) = spatial_reference
+		self.execute( "INSERT OR IGNORE INTO gpkg_spatial_ref_sys ( srs_name, srs_id, organization, organization_coordsys_id, definition ) VALUES ( ?, ?, ?, ?, ? )",
+					( name, srs_id, 'EPSG' if srs_id > 0 else 'NONE', srs_id, wkt ) )
+
+	# Records a new table in gpkg_contents. Tables only become 'features' once they are given a geometry column
+	def registerTable( self, table, srs_id=None ):
+		self.execute( "INSERT OR REPLACE INTO gpkg_contents ( table_name, data_type, identifier, srs_id ) VALUES ( ?, 'attributes', ?, ? )", ( table, table, srs_id ) )
+
+	def listTables( self ):
+		return [row[0] for row in self.execute( "SELECT table_name FROM gpkg_contents ORDER BY table_name" )]
+
+	def tableExists( self, table ):
+		return self.execute( "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", ( table, ) ).fetchone() != None
+
+	def getCount( self, table ):
+		return self.execute( "SELECT COUNT(*) FROM %s" % quote( table ) ).fetchone()[0]
+
+	# Returns a list of ( name, sqlite type ) tuples
+	def getFieldTypes( self, table ):
+		return [( row[1], row[2].upper() ) for row in self.execute( "PRAGMA table_info(%s)" % quote( table ) )]
+
+	def getFields( self, table ):
+		return [name for ( name, field_type ) in self.getFieldTypes( table )]
+
+	def getOIDField( self, table ):
+		return SQLITE_OID
+
+	def addField( self, table, field, field_type ):
+		if field not in self.getFields( table ):
+			self.execute( "ALTER TABLE %s ADD COLUMN %s %s" % ( quote( table ), quote( field ), SQLITE_TYPES[field_type.upper()] ) )
+
+	def createTable( self, table, fields ):
+		columns = ["%s INTEGER PRIMARY KEY AUTOINCREMENT" % SQLITE_OID]
+		for ( name, field_type, default ) in fields:
+			column = "%s %s" % ( quote( name ), SQLITE_TYPES[field_type.upper()] )
+			if default != None:
+				column += " DEFAULT %r" % ( default, )
+			columns.append( column )
+		with self.transaction():
+			self.execute( "CREATE TABLE %s ( %s )" % ( quote( table ), ", ".join( columns ) ) )
+			self.registerTable( table )
+
+	def createPointTable( self, table, spatial_reference ):
+		with self.transaction():
+			self.addSpatialReference( spatial_reference )
+			self.execute( "CREATE TABLE %s ( %s INTEGER PRIMARY KEY AUTOINCREMENT, x REAL, y REAL, z REAL )" % ( quote( table ), SQLITE_OID ) )
+			self.registerTable( table, spatial_reference.srs_id )
+
+	def appendPoints( self, table, X, Y, Z ):
+		with self.transaction():
+			self.connect().executemany( "INSERT INTO %s ( x, y, z ) VALUES ( ?, ?, ? )" % quote( table ), zip( X.tolist(), Y.tolist(), Z.tolist() ) )
+		return len( X )
+
+	def deleteTable( self, table ):
+		with self.transaction():
+			self.execute( "DROP TABLE IF EXISTS %s" % quote( table ) )
+			self.execute( "DROP TABLE IF EXISTS %s" % quote( rtreeName( table ) ) )
+			if self.tableExists( 'gpkg_extensions' ):
+				self.execute( "DELETE FROM gpkg_extensions WHERE table_name=?", ( table, ) )
+			self.execute( "DELETE FROM gpkg_geometry_columns WHERE table_name=?", ( table, ) )
+			self.execute( "DELETE FROM gpkg_contents WHERE table_name=?", ( table, ) )
+
+	def toColumnName( self, field ):
+		if field == OID_FIELD:
+			return SQLITE_OID
+		return field
+
+	# Builds the NumPy dtype of each requested column from the declared column types
+	def getDtypes( self, table, fields ):
+		types = dict( self.getFieldTypes( table ) )
+		return [NUMPY_TYPES.get( types[self.toColumnName( field )], object ) for field in fields]
+
+	def toColumns( self, rows, fields, dtypes ):
+		if len( rows ) == 0:
+			return dict( ( field, np.empty( 0, dtype=dtype ) ) for ( field, dtype ) in zip( fields, dtypes ) )
+		columns = zip( *rows )
+		return dict( ( field, np.array( column, dtype=dtype ) ) for ( field, dtype, column ) in zip( fields, dtypes, columns ) )
+
+	def selectColumns( self, table, fields ):
+		return self.execute( "SELECT %s FROM %s ORDER BY %s" % ( ", ".join( quote( self.toColumnName( field ) ) for field in fields ), quote( table ), SQLITE_OID ) )
+
+	def readColumns( self, table, fields ):
+		return self.toColumns( self.selectColumns( table, fields ).fetchall(), fields, self.getDtypes( table, fields ) )
+
+	def iterColumns( self, table, fields, chunk_size=CHUNK_SIZE ):
+		dtypes = self.getDtypes( table, fields )
+		cursor = self.selectColumns( table, fields )
+		while True:
+			rows = cursor.fetchmany( chunk_size )
+			if len( rows ) == 0:
+				return
+			yield self.toColumns( rows, fields, dtypes )
+
+	# Rows are converted to Python values chunk_size at a time, so only one chunk of the columns is ever held as Python objects
+	def writeColumns( self, table, oids, columns, chunk_size=CHUNK_SIZE ):
+		fields = list( columns.keys() )
+		assignments = ", ".join( "%s=?" % quote( field ) for field in fields )
+		arrays = [np.asarray( columns[field] ) for field in fields] + [np.asarray( oids )]
+		with self.transaction():
+			for start in range( 0, len( arrays[-1] ), chunk_size ):
+				values = [array[start:start + chunk_size].tolist() for array in arrays]
+				self.connect().executemany( "UPDATE %s SET %s WHERE %s=?" % ( quote( table ), assignments, SQLITE_OID ), zip( *values ) )
+
+	# Geometry goes into a 'geom' column of GeoPackage point blobs, encoded a whole chunk at a time (see PointGeometry), and the table becomes a features table.
+	# The spatial index is the GeoPackage RTree extension, filled in the same pass. The standard's maintenance triggers call SpatiaLite functions which
+	# plain SQLite does not have, so they are not created: the index is rebuilt whenever the geometry is rewritten through here
+	def writeGeometry( self, table, oids, X, Y, spatial_reference, spatial_index=True, chunk_size=CHUNK_SIZE ):
+		srs_id = spatial_reference.srs_id
+		X = np.asarray( X, dtype=np.float64 )
+		Y = np.asarray( Y, dtype=np.float64 )
+		oids = np.asarray( oids )
+		rtree = quote( rtreeName( table ) )
+		with self.transaction():
+			self.addSpatialReference( spatial_reference )
+			self.addField( table, GEOMETRY_COLUMN, 'GEOMETRY' )
+			self.execute( "INSERT OR REPLACE INTO gpkg_geometry_columns ( table_name, column_name, geometry_type_name, srs_id, z, m ) VALUES ( ?, ?, 'POINT', ?, 0, 0 )", ( table, GEOMETRY_COLUMN, srs_id ) )
+			bounds = ( X.min(), Y.min(), X.max(), Y.max() ) if len( X ) else ( None, None, None, None )
+			self.execute( "UPDATE gpkg_contents SET data_type='features', srs_id=?, min_x=?, min_y=?, max_x=?, max_y=? WHERE table_name=?", ( srs_id, ) + tuple( None if b is None else float( b ) for b in bounds ) + ( table, ) )
+			cache_size = self.execute( "PRAGMA cache_size" ).fetchone()[0]
+			if spatial_index:
+				self.execute( "PRAGMA cache_size=-%d" % RTREE_CACHE_KB )
+				self.execute( "CREATE TABLE IF NOT EXISTS gpkg_extensions ( table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL, UNIQUE ( table_name, column_name, extension_name ) )" )
+				self.execute( "INSERT OR IGNORE INTO gpkg_extensions ( table_name, column_name, extension_name, definition, scope ) VALUES ( ?, ?, 'gpkg_rtree_index', ?, 'write-only' )", ( table, GEOMETRY_COLUMN, RTREE_EXTENSION ) )
+				self.execute( "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING rtree( id, minx, maxx, miny, maxy )" % rtree )
+				self.execute( "DELETE FROM %s" % rtree )
+			for start in range( 0, len( X ), chunk_size ):
+				( x, y, fids ) = ( X[start:start + chunk_size], Y[start:start + chunk_size], oids[start:start + chunk_size].tolist() )
+				self.connect().executemany( "UPDATE %s SET %s=? WHERE %s=?" % ( quote( table ), quote( GEOMETRY_COLUMN ), SQLITE_OID ), zip( encodeGeoPackagePoints( x, y, srs_id ), fids ) )
+				if spatial_index:
+					( x, y ) = ( x.tolist(), y.tolist() )
+					self.connect().executemany( "INSERT INTO %s VALUES ( ?, ?, ?, ?, ? )" % rtree, zip( fids, x, x, y, y ) )
+			self.execute( "PRAGMA cache_size=%d" % cache_size )
+
+	def readRows( self, table, fields ):
+		return self.selectColumns( table, fields ).fetchall()
+
+	def readRowsByKey( self, table, key_field, keys, fields ):
+		keys = list( keys )
+		rows = list()
+		for start in range( 0, len( keys ), KEY_BATCH ):
+			batch = keys[start:start + KEY_BATCH]
+			rows.extend( self.execute( "SELECT %s FROM %s WHERE %s IN ( %s )" % ( ", ".join( quote( field ) for field in fields ), quote( table ), quote( key_field ), ", ".join( "?" for key in batch ) ), batch ).fetchall() )
+		return rows
+
+	def insertRows( self, table, fields, rows ):
+		with self.transaction():
+			self.connect().executemany( "INSERT INTO %s ( %s ) VALUES ( %s )" % ( quote( table ), ", ".join( quote( field ) for field in fields ), ", ".join( "?" for field in fields ) ), rows )
+
+	def updateRowsByKey( self, table, key_field, updates ):
+		with self.transaction():
+			for key in updates:
+				fields = list( updates[key].keys() )
+				assignments = ", ".join( "%s=?" % quote( field ) for field in fields )
+				self.execute( "UPDATE %s SET %s WHERE %s=?" % ( quote( table ), assignments, quote( key_field ) ), [updates[key][field] for field in fields] + [key] )
+
+	def deleteRowsByKey( self, table, key_field, keys ):
+		with self.transaction():
+			self.connect().executemany( "DELETE FROM %s WHERE %s=?" % ( quote( table ), quote( key_field ) ), [( key, ) for key in keys] )
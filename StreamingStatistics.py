@@ -0,0 +1,100 @@
+# Streaming Statistics
+# Accumulates the aggregate statistics of a column one chunk at a time, in a single pass and constant memory, however large the table.
+# The mean and variance are kept with Welford's method, extended to whole chunks (Chan et al.), so they are as accurate as a two pass calculation.
+# The median and mode come from a histogram of fixed-width bins, so they are exact to within one bin width.
+# Accumulators built over separate chunks, or in separate worker processes, can be merged into one.
+import math
+from collections import Counter
+import numpy as np
+
+BIN_WIDTH = 0.1 # The default histogram bin width, in Z units. Memory use is proportional to the range of the data divided by this
+
+class StreamingStatistics( object ):
+	# @param bin_width = The width of the histogram bins the median and mode are taken from
+	# @param exact_mode = If True, every distinct value is counted so that the mode is exact. Memory then grows with the number of distinct values
+	def __init__( self, bin_width=BIN_WIDTH, exact_mode=False ):
+		self.bin_width = bin_width
+		self.exact_mode = exact_mode
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0 # The sum of squared differences from the mean
+		self.histogram = Counter() # Bin index -> number of values in the bin
+		self.values = Counter() # Value -> number of occurrences. Only filled when exact_mode is on
+
+	# Adds a chunk of values. NaNs are ignored
+	def update( self, Z ):
+		Z = np.asarray( Z, dtype=np.float64 )
+		Z = Z[~np.isnan( Z )]
+		n = len( Z )
+		if n == 0:
+			return
+		mean = Z.mean()
+		m2 = float( ( ( Z - mean ) ** 2.0 ).sum() )
+		self.combine( n, float( mean ), m2 )
+		( bins, counts ) = np.unique( np.floor( Z / self.bin_width ).astype( np.int64 ), return_counts=True )
+		self.histogram.update( dict( zip( bins.tolist(), counts.tolist() ) ) )
+		if self.exact_mode:
+			( values, counts ) = np.unique( Z, return_counts=True )
+			self.values.update( dict( zip( values.tolist(), counts.tolist() ) ) )
+
+	# Folds the count, mean and sum of squares of another set of values into ours
+	def combine( self, n, mean, m2 ):
+		total = self.count + n
+		delta = mean - self.mean
+		self.mean += delta * n / total
+		self.m2 += m2 + delta * delta * self.count * n / total
+		self.count = total
+
+	# Merges another accumulator into this one. Both must use the same bin width
+	def merge( self, other ):
+		if other.bin_width != self.bin_width:
+			raise ValueError( "Cannot merge statistics with bin widths %s and %s" % ( self.bin_width, other.bin_width ) )
+		if other.count == 0:
+			return self
+		self.combine( other.count, other.mean, other.m2 )
+		self.histogram.update( other.histogram )
+		self.values.update( other.values )
+		self.exact_mode = self.exact_mode and other.exact_mode
+		return self
+
+	def getCount( self ):
+		return self.count
+
+	# Every statistic is None until a value has been added
+	def getMean( self ):
+		if self.count == 0:
+			return None
+		return self.mean
+
+	# The population variance, as the processor has always reported it
+	def getVariance( self ):
+		if self.count == 0:
+			return None
+		return self.m2 / self.count
+
+	def getStdDev( self ):
+		if self.count == 0:
+			return None
+		return math.sqrt( self.getVariance() )
+
+	# Returns the value at position index (0 based) of the sorted values, interpolated within its histogram bin
+	def getValueAtRank( self, index ):
+		seen = 0
+		for bin in sorted( self.histogram ):
+			in_bin = self.histogram[bin]
+			if seen + in_bin > index:
+				return ( bin + ( index - seen + 0.5 ) / in_bin ) * self.bin_width
+			seen += in_bin
+		return None
+
+	# The median, taken as the value at position count / 2 of the sorted values
+	def getMedian( self ):
+		return self.getValueAtRank( self.count // 2 )
+
+	# The most common value if exact_mode is on, otherwise the centre of the most populated histogram bin
+	def getMode( self ):
+		if self.count == 0:
+			return None
+		if self.exact_mode:
+			return self.values.most_common( 1 )[0][0]
+		return ( self.histogram.most_common( 1 )[0][0] + 0.5 ) * self.bin_width
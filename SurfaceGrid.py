@@ -0,0 +1,182 @@
+# Surface Grid
+# Builds a gridded surface (a DEM) from point tables, streaming their points through one chunk at a time. Each cell accumulates the count, sum,
+# sum of squares, minimum and maximum of the z values falling in it, so memory is proportional to the number of cells, never to the number of points.
+# A chunk is binned in a handful of vectorized passes (np.bincount and ufunc.at over flat cell indices), with no loop over points.
+# Grids built over separate tables, or in separate worker processes, can be merged into one, as long as they share the same geometry.
+# The finished grid is written as a tiled, compressed GeoTIFF with one band per statistic, and coarser overview levels for display.
+# GDAL is only needed to write the raster, so it is imported there, and the grid can be built in environments without it.
+# Cell ( row, col ) covers xmin + col * size <= x < xmin + ( col + 1 ) * size, ymax - ( row + 1 ) * size < y <= ymax - row * size, so row 0 is the northern edge, as in a raster
+import math
+import numpy as np
+
+SURFACE_CELL_SIZE = 100.0 # The default width and height of a cell, in XY units (metres, once tables are projected)
+SURFACE_BANDS = ( 'mean', 'count', 'std', 'min', 'max' ) # The bands written by default, in order
+NODATA = -9999.0 # Written to every band of a cell without points
+BLOCK_SIZE = 256 # The width and height of a raster tile. Overviews are added until the coarsest fits in one tile
+RASTER_OPTIONS = ( 'TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER', 'BLOCKXSIZE=%d' % BLOCK_SIZE, 'BLOCKYSIZE=%d' % BLOCK_SIZE )
+WRITE_ROWS = 4096 # The number of grid rows turned into band values and written at once
+# The GDAL resampling each band's overviews are built with. Averaging suits the mean and spread, but would turn a count, minimum or maximum into a value
+# no cell holds, so those take the nearest cell instead
+OVERVIEW_RESAMPLING = { 'mean':'AVERAGE', 'std':'AVERAGE', 'count':'NEAREST', 'min':'NEAREST', 'max':'NEAREST' }
+
+class SurfaceGrid( object ):
+	# @param xmin = The x coordinate of the western edge of the grid
+	# @param ymax = The y coordinate of the northern edge of the grid
+	# @param cell_size = The width and height of a cell
+	# @param ncols, nrows = The number of cells across and down the grid
+	def __init__( self, xmin, ymax, cell_size, ncols, nrows ):
+		self.xmin = float( xmin )
+		self.ymax = float( ymax )
+		self.cell_size = float( cell_size )
+		self.ncols = int( ncols )
+		self.nrows = int( nrows )
+		cells = self.ncols * self.nrows
+		self.count = np.zeros( cells, dtype=np.int64 )
+		self.sum = np.zeros( cells, dtype=np.float64 )
+		self.sumsq = np.zeros( cells, dtype=np.float64 )
+		self.min = np.full( cells, np.inf )
+		self.max = np.full( cells, -np.inf )
+		self.dropped = 0 # Points which fell outside the grid
+
+	# Returns a grid covering an extent, snapped outward to whole multiples of the cell size so that grids over overlapping extents line up
+	# @param extent = The ( xmin, ymin, xmax, ymax ) bounds the grid must cover
+	@staticmethod
+	def fromExtent( extent, cell_size=SURFACE_CELL_SIZE ):
+		( xmin, ymin, xmax, ymax ) = extent
+		xmin = math.floor( xmin / cell_size ) * cell_size
+		ymax = math.ceil( ymax / cell_size ) * cell_size
+		ncols = int( math.floor( ( xmax - xmin ) / cell_size ) ) + 1
+		nrows = int( math.floor( ( ymax - ymin ) / cell_size ) ) + 1
+		return SurfaceGrid( xmin, ymax, cell_size, ncols, nrows )
+
+	# Returns a new, empty grid with the same geometry as this one
+	def emptyCopy( self ):
+		return SurfaceGrid( self.xmin, self.ymax, self.cell_size, self.ncols, self.nrows )
+
+	def getGeometry( self ):
+		return ( self.xmin, self.ymax, self.cell_size, self.ncols, self.nrows )
+
+	# Returns the ( xmin, ymin, xmax, ymax ) bounds of the grid
+	def getExtent( self ):
+		return ( self.xmin, self.ymax - self.nrows * self.cell_size, self.xmin + self.ncols * self.cell_size, self.ymax )
+
+	# Returns the GDAL geotransform of the grid
+	def getGeoTransform( self ):
+		return ( self.xmin, self.cell_size, 0.0, self.ymax, 0.0, -self.cell_size )
+
+	# Returns the flat index of the cell each point falls in, and a mask of the points which fall in the grid at all
+	def cellIndices( self, X, Y ):
+		cols = np.floor( ( X - self.xmin ) / self.cell_size ).astype( np.int64 )
+		rows = np.floor( ( self.ymax - Y ) / self.cell_size ).astype( np.int64 )
+		inside = ( cols >= 0 ) & ( cols < self.ncols ) & ( rows >= 0 ) & ( rows < self.nrows )
+		return ( rows * self.ncols + cols, inside )
+
+	# Adds a chunk of points. Points with a NaN coordinate, or outside the grid, are ignored
+	def add( self, X, Y, Z ):
+		X = np.asarray( X, dtype=np.float64 )
+		Y = np.asarray( Y, dtype=np.float64 )
+		Z = np.asarray( Z, dtype=np.float64 )
+		valid = ~( np.isnan( X ) | np.isnan( Y ) | np.isnan( Z ) )
+		if not valid.all():
+			( X, Y, Z ) = ( X[valid], Y[valid], Z[valid] )
+		( cells, inside ) = self.cellIndices( X, Y )
+		if not inside.all():
+			self.dropped += int( len( inside ) - np.count_nonzero( inside ) )
+			( cells, Z ) = ( cells[inside], Z[inside] )
+		if len( cells ) == 0:
+			return
+		size = len( self.count )
+		self.count += np.bincount( cells, minlength=size )
+		self.sum += np.bincount( cells, weights=Z, minlength=size )
+		self.sumsq += np.bincount( cells, weights=Z * Z, minlength=size )
+		np.minimum.at( self.min, cells, Z )
+		np.maximum.at( self.max, cells, Z )
+
+	# Merges another grid into this one. Both must have the same geometry
+	def merge( self, other ):
+		if other.getGeometry() != self.getGeometry():
+			raise ValueError( "Cannot merge grids with geometries %s and %s" % ( other.getGeometry(), self.getGeometry() ) )
+		self.count += other.count
+		self.sum += other.sum
+		self.sumsq += other.sumsq
+		np.minimum( self.min, other.min, out=self.min )
+		np.maximum( self.max, other.max, out=self.max )
+		self.dropped += other.dropped
+		return self
+
+	# Returns the number of cells holding at least one point
+	def getFilledCells( self ):
+		return int( np.count_nonzero( self.count ) )
+
+	# Returns the values of one statistic for a range of rows, as a 2D array with NaN in every empty cell
+	# @param band = One of 'mean', 'count', 'std' (the population standard deviation), 'min' or 'max'
+	def getBand( self, band, start=0, stop=None ):
+		if stop == None:
+			stop = self.nrows
+		cells = slice( start * self.ncols, stop * self.ncols )
+		count = self.count[cells]
+		empty = count == 0
+		with np.errstate( invalid='ignore', divide='ignore' ):
+			if band == 'count':
+				values = count.astype( np.float64 )
+			elif band == 'mean':
+				values = self.sum[cells] / count
+			elif band == 'std':
+				mean = self.sum[cells] / count
+				values = np.sqrt( np.maximum( self.sumsq[cells] / count - mean * mean, 0.0 ) )
+			elif band == 'min':
+				values = self.min[cells].copy()
+			elif band == 'max':
+				values = self.max[cells].copy()
+			else:
+				raise ValueError( "Unknown band '%s'. Expected one of %s" % ( band, ", ".join( SURFACE_BANDS ) ) )
+		values[empty] = np.nan
+		return values.reshape( stop - start, self.ncols )
+
+	# Returns the overview factors of the grid: powers of two, until the coarsest level fits in a single tile
+	def getOverviewLevels( self ):
+		levels = list()
+		factor = 2
+		while max( self.ncols, self.nrows ) / ( factor / 2 ) > BLOCK_SIZE:
+			levels.append( factor )
+			factor *= 2
+		return levels
+
+	# Writes the grid as a tiled, compressed GeoTIFF, one float32 band per statistic, with overviews. Empty cells hold NODATA
+	# The bands are computed and written WRITE_ROWS rows at a time, so writing needs little more memory than the grid itself
+	# @param spatial_reference = The SpatialReference of the points. Its EPSG code is used if it has one, otherwise its WKT
+	# @param bands = The statistics to write, in band order (see getBand)
+	# @param resampling = The GDAL resampling method the overviews of every band are built with. If None, each band uses its own (see OVERVIEW_RESAMPLING)
+	def writeRaster( self, fp, spatial_reference=None, bands=SURFACE_BANDS, resampling=None ):
+		from osgeo import gdal, osr
+		gdal.UseExceptions()
+		driver = gdal.GetDriverByName( 'GTiff' )
+		dataset = driver.Create( fp, self.ncols, self.nrows, len( bands ), gdal.GDT_Float32, list( RASTER_OPTIONS ) )
+		dataset.SetGeoTransform( self.getGeoTransform() )
+		if spatial_reference != None:
+			srs = osr.SpatialReference()
+			if spatial_reference.srs_id != None and spatial_reference.srs_id > 0:
+				srs.ImportFromEPSG( spatial_reference.srs_id )
+			else:
+				srs.ImportFromWkt( spatial_reference.wkt )
+			dataset.SetProjection( srs.ExportToWkt() )
+		for ( number, band ) in enumerate( bands, 1 ):
+			raster_band = dataset.GetRasterBand( number )
+			raster_band.SetDescription( band )
+			raster_band.SetNoDataValue( NODATA )
+			for start in range( 0, self.nrows, WRITE_ROWS ):
+				stop = min( start + WRITE_ROWS, self.nrows )
+				values = self.getBand( band, start, stop )
+				values[np.isnan( values )] = NODATA
+				raster_band.WriteArray( values.astype( np.float32 ), 0, start )
+		levels = self.getOverviewLevels()
+		if len( levels ):
+			# 'NONE' only lays the overview levels out. Each band's are then filled with its own resampling
+			dataset.BuildOverviews( 'NONE', levels )
+			for ( number, band ) in enumerate( bands, 1 ):
+				raster_band = dataset.GetRasterBand( number )
+				overviews = [raster_band.GetOverview( level ) for level in range( raster_band.GetOverviewCount() )]
+				gdal.RegenerateOverviews( raster_band, overviews, resampling if resampling != None else OVERVIEW_RESAMPLING[band] )
+		dataset.FlushCache()
+		dataset = None
+		return fp
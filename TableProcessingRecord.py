@@ -0,0 +1,231 @@
+# Table Processing Record
+# Wraps the Table Processing Record (TPR), the table inside the database which records every imported table and which processing steps have been applied to it.
+# The whole record is read into an in-memory index once, so membership checks and lookups never touch the database. Inserts, updates and deletes are
+# buffered and written back in a single transaction by flush(), which holds a lock file so that several worker processes can share one TPR safely.
+# All database access goes through a StorageBackend, so the same class serves a File Geodatabase or a GeoPackage.
+import os
+import os.path
+import time
+
+KEY_FIELD = 'tbl_name'
+# The fields of a new TPR, as ( name, type, default ) tuples. Every processing flag starts at 0, meaning not yet done
+TPR_FIELDS = ( ( KEY_FIELD, 'TEXT', None ),
+				( 'date_added', 'TEXT', None ),
+				( 'tbl_size', 'LONG', 0 ),
+				( 'has_x', 'SHORT', 0 ),
+				( 'has_xyz', 'SHORT', 0 ),
+				( 'perc', 'SHORT', 0 ),
+				( 'has_perc', 'SHORT', 0 ),
+				( 'is_proj', 'SHORT', 0 ),
+				( 'has_shp', 'SHORT', 0 ),
+				( 'in_idx', 'SHORT', 0 ),
+				( 'is_thin', 'SHORT', 0 ),
+				( 'num_nn', 'LONG', 0 ), # The number of nearest neighbors the table's residuals were last calculated with, 0 if they never were
+				( 'tbl_std_dev', 'DOUBLE', 0 ),
+				( 'tbl_mean', 'DOUBLE', None ),
+				( 'tbl_med', 'DOUBLE', None ),
+				( 'tbl_mode', 'DOUBLE', None ) )
+FLUSH_SIZE = 500 # The default number of buffered changes which triggers an automatic flush
+LOCK_POLL = 0.1 # Seconds between attempts to take the lock
+LOCK_TIMEOUT = 600.0 # Seconds after which a lock file is assumed to have been left behind by a dead process
+
+class TableNotInTPRException( Exception ):
+	def __init__( self, tpr, table ):
+		self.tpr = tpr
+		self.table = table
+
+	def __str__( self ):
+		return "Table %s is not present in the table processing record %s" % ( self.table, self.tpr )
+
+class TableProcessingRecord( object ):
+	# @param storage - The StorageBackend holding the TPR
+	# @param name - The name of the TPR table. If it does not exist, it is created empty
+	# @param flush_size - Buffered changes are flushed automatically once this many have built up
+	def __init__( self, storage, name="Table_Processing_Record", verbose=False, flush_size=FLUSH_SIZE ):
+		self.storage = storage
+		self.name = name
+		self.verbose = verbose
+		self.flush_size = flush_size
+		# The lock lives beside the database rather than inside it, so that the database never sees it
+		self.lock_fp = "%s_%s.lock" % ( os.path.normpath( storage.path ), name )
+		if not storage.tableExists( name ):
+			storage.createTable( name, TPR_FIELDS )
+		else:
+			self.addMissingFields()
+		self.pending_inserts = dict()
+		self.pending_updates = dict()
+		self.pending_deletes = set()
+		self.load()
+
+	def printIfVerbose( self, message ):
+		if self.verbose:
+			print( message )
+
+	# Adds any field of TPR_FIELDS which an older TPR lacks, and sets it to its default in every existing row
+	# Fields are added outside of the transaction, since a geodatabase does not allow schema changes inside an edit session
+	def addMissingFields( self ):
+		fields = self.storage.getFields( self.name )
+		if all( field in fields for ( field, field_type, default ) in TPR_FIELDS ):
+			return
+		self.acquireLock()
+		try:
+			# Another process may have added them while we waited for the lock
+			fields = self.storage.getFields( self.name )
+			missing = [( field, field_type, default ) for ( field, field_type, default ) in TPR_FIELDS if field not in fields]
+			for ( field, field_type, default ) in missing:
+				self.storage.addField( self.name, field, field_type )
+			with self.storage.transaction():
+				defaults = dict( ( field, default ) for ( field, field_type, default ) in missing if default != None )
+				if len( defaults ):
+					tables = [row[0] for row in self.storage.readRows( self.name, [KEY_FIELD] )]
+					self.storage.updateRowsByKey( self.name, KEY_FIELD, dict( ( table, dict( defaults ) ) for table in tables ) )
+		finally:
+			self.releaseLock()
+
+	# (Re)reads the whole TPR into the index. Buffered changes are kept, and reapplied on top of what was read
+	def load( self ):
+		oid_field = self.storage.getOIDField( self.name )
+		self.fields = [field for field in self.storage.getFields( self.name ) if field != oid_field]
+		self.rows = dict()
+		for row in self.storage.readRows( self.name, self.fields ):
+			self.rows[row[self.fields.index( KEY_FIELD )]] = dict( zip( self.fields, row ) )
+		self.applyPending()
+
+	# Applies the buffered changes to the index
+	def applyPending( self ):
+		for table in self.pending_deletes:
+			self.rows.pop( table, None )
+		for table in self.pending_inserts:
+			self.rows.setdefault( table, dict( self.pending_inserts[table] ) )
+		for table in self.pending_updates:
+			if table in self.rows:
+				self.rows[table].update( self.pending_updates[table] )
+
+	def __contains__( self, table ):
+		return table in self.rows
+
+	def __len__( self ):
+		return len( self.rows )
+
+	def getTables( self ):
+		return list( self.rows.keys() )
+
+	def getFields( self ):
+		return list( self.fields )
+
+	def getValue( self, table, field ):
+		if table not in self.rows:
+			raise TableNotInTPRException( self.name, table )
+		return self.rows[table].get( field )
+
+	# Returns the names of all tables whose value in field equals value. By default, all tables which have not undergone the process recorded in field
+	def selectTables( self, field, value=0 ):
+		return [table for table in self.rows if self.rows[table].get( field ) == value]
+
+	def numPending( self ):
+		return len( self.pending_inserts ) + len( self.pending_updates ) + len( self.pending_deletes )
+
+	def flushIfFull( self ):
+		if self.numPending() >= self.flush_size:
+			self.flush()
+
+	# Buffers a new TPR row for table. If the table's old row is waiting to be deleted, the delete is kept, so that the new row starts from the defaults
+	def addTable( self, table ):
+		self.printIfVerbose( "Adding %s to table record." % table )
+		self.pending_inserts[table] = { KEY_FIELD:table, 'date_added':time.strftime("%Y/%m/%d") }
+		self.rows.setdefault( table, dict( self.pending_inserts[table] ) )
+		self.flushIfFull()
+
+	# Buffers the deletion of table's TPR row. Returns True if the table was in the record, False if not
+	def removeTable( self, table ):
+		self.printIfVerbose( "Removing %s from table record." % table )
+		self.pending_inserts.pop( table, None )
+		self.pending_updates.pop( table, None )
+		self.pending_deletes.add( table )
+		present = self.rows.pop( table, None ) != None
+		self.flushIfFull()
+		return present
+
+	# Buffers an update of the passed fields of table's TPR row
+	def update( self, table, update_fields, update_values ):
+		if table not in self.rows:
+			raise TableNotInTPRException( self.name, table )
+		for index in range( 0, len( update_fields ) ):
+			self.printIfVerbose( "Updating %s to %s for %s." % ( update_fields[index], update_values[index], table ) )
+		changes = dict( zip( update_fields, update_values ) )
+		self.pending_updates.setdefault( table, dict() ).update( changes )
+		self.rows[table].update( changes )
+		self.flushIfFull()
+
+	# Writes changes to a table's row straight to storage, inside whatever storage transaction the caller has open, as well as buffering them like update.
+	# For flags which must commit together with the data they describe: a flag left in the buffer is lost if the process dies before the next flush, while
+	# the data it describes has already been committed. The lock is not taken, since the caller's transaction already holds the database, and only an
+	# existing row is changed. A row which has not been flushed yet gets the changes at the next flush, as usual
+	def updateNow( self, table, update_fields, update_values ):
+		if table not in self.rows:
+			raise TableNotInTPRException( self.name, table )
+		changes = dict( zip( update_fields, update_values ) )
+		self.storage.updateRowsByKey( self.name, KEY_FIELD, { table:changes } )
+		self.pending_updates.setdefault( table, dict() ).update( changes )
+		self.rows[table].update( changes )
+
+	# Takes the cross-process lock on the TPR. A lock older than LOCK_TIMEOUT is assumed to be stale and is broken
+	def acquireLock( self ):
+		while True:
+			try:
+				os.close( os.open( self.lock_fp, os.O_CREAT | os.O_EXCL | os.O_WRONLY ) )
+				return
+			except FileExistsError:
+				try:
+					if time.time() - os.path.getmtime( self.lock_fp ) > LOCK_TIMEOUT:
+						os.remove( self.lock_fp )
+						continue
+				except OSError:
+					continue # The lock was released while we were looking at it
+				time.sleep( LOCK_POLL )
+
+	def releaseLock( self ):
+		os.remove( self.lock_fp )
+
+	# Writes every buffered change to the TPR in one transaction, then rereads the rows it wrote, so the index holds what was committed.
+	# Rows already inserted by another process are updated rather than inserted twice. Only the rows with buffered changes are read, so a flush costs the
+	# same however large the TPR is. Other processes' changes to other rows are only seen after load(), or refresh() of those rows
+	def flush( self ):
+		if self.numPending() == 0:
+			return
+		written = set( self.pending_inserts ) | set( self.pending_updates ) | self.pending_deletes
+		self.acquireLock()
+		try:
+			with self.storage.transaction():
+				present = set( row[0] for row in self.storage.readRowsByKey( self.name, KEY_FIELD, written, [KEY_FIELD] ) )
+				if len( self.pending_deletes ):
+					self.storage.deleteRowsByKey( self.name, KEY_FIELD, self.pending_deletes & present )
+					present -= self.pending_deletes
+				updates = dict()
+				for table in set( self.pending_inserts ) | set( self.pending_updates ):
+					changes = dict( self.pending_inserts.get( table, {} ) )
+					changes.update( self.pending_updates.get( table, {} ) )
+					updates[table] = changes
+				inserts = [table for table in updates if table not in present and table in self.pending_inserts]
+				for table in inserts:
+					# Only the fields we have values for are written, so every other field takes its default
+					fields = list( updates.pop( table ).items() )
+					self.storage.insertRows( self.name, [field for ( field, value ) in fields], [[value for ( field, value ) in fields]] )
+				updates = dict( ( table, updates[table] ) for table in updates if table in present )
+				if len( updates ):
+					self.storage.updateRowsByKey( self.name, KEY_FIELD, updates )
+		finally:
+			self.releaseLock()
+		self.pending_inserts = dict()
+		self.pending_updates = dict()
+		self.pending_deletes = set()
+		self.refresh( written )
+
+	# Rereads the rows of the passed tables into the index, dropping those no longer in the TPR. Buffered changes are reapplied on top, as by load()
+	def refresh( self, tables ):
+		tables = set( tables )
+		for table in tables:
+			self.rows.pop( table, None )
+		for row in self.storage.readRowsByKey( self.name, KEY_FIELD, tables, self.fields ):
+			self.rows[row[self.fields.index( KEY_FIELD )]] = dict( zip( self.fields, row ) )
+		self.applyPending()
@@ -0,0 +1,23 @@
+# XYZ Reader
+# Streams points out of tab delimited x/y/z text files in fixed-size chunks of typed NumPy columns
+import itertools
+import numpy as np
+from M77TReader import parseLines
+
+CHUNK_SIZE = 100000 # The default number of lines parsed at once
+
+# Generator which streams the points out of an XYZ file
+# @param fp = The file path to the XYZ file
+# @param chunk_size = The number of lines parsed at once. Bounds memory use
+# @return = Yields ( X, Y, Z ) tuples of float64 arrays, one per chunk. Rows with a missing or malformed value are already removed
+def readXYZChunks( fp, chunk_size=CHUNK_SIZE ):
+	with open( fp, 'r' ) as reader:
+		while True:
+			lines = list( itertools.islice( reader, chunk_size ) )
+			if len( lines ) == 0:
+				return
+			points = parseLines( lines, [0, 1, 2] )
+			points = points[~np.isnan( points ).any( axis=1 )]
+			if len( points ) == 0:
+				continue
+			yield ( np.ascontiguousarray( points[:, 0] ), np.ascontiguousarray( points[:, 1] ), np.ascontiguousarray( points[:, 2] ) )
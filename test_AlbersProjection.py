@@ -0,0 +1,36 @@
+# Checks the native Alaska Albers projection against reference coordinates. Run with pytest
+import numpy as np
+import pytest
+import AlbersProjection
+from AlbersProjection import AlbersEqualArea, ProjectionAccuracyException, ALASKA_ALBERS_REFERENCE
+from DataProcessor import NAD1983_TO_AkAlb_Transformation
+
+def alaskaAlbers():
+	return AlbersEqualArea.fromWKT( NAD1983_TO_AkAlb_Transformation )
+
+def test_reference_points_within_a_millimetre():
+	assert alaskaAlbers().validate() < 0.001
+
+# Random points over the whole of Alaska and the Aleutians, across the antimeridian, projected both ways
+def test_round_trip_within_a_millimetre():
+	rng = np.random.default_rng( 0 )
+	lon = np.remainder( rng.uniform( -190.0, -128.0, 100000 ) + 180.0, 360.0 ) - 180.0
+	lat = rng.uniform( 50.0, 72.0, 100000 )
+	projection = alaskaAlbers()
+	( x, y ) = projection.forward( lon, lat )
+	( lon2, lat2 ) = projection.inverse( x, y )
+	( x2, y2 ) = projection.forward( lon2, lat2 )
+	assert np.hypot( x2 - x, y2 - y ).max() < 0.001
+
+def test_blocks_on_threads_match_one_block( monkeypatch ):
+	monkeypatch.setattr( AlbersProjection, 'BLOCK_SIZE', 1000 )
+	rng = np.random.default_rng( 1 )
+	( lon, lat ) = ( rng.uniform( -170.0, -130.0, 10500 ), rng.uniform( 52.0, 70.0, 10500 ) )
+	projection = alaskaAlbers()
+	assert np.array_equal( np.column_stack( projection.forward( lon, lat, workers=4 ) ), np.column_stack( projection.forward( lon, lat ) ) )
+
+# A projection one metre off in false easting must be caught
+def test_wrong_parameters_are_rejected():
+	wrong = AlbersEqualArea.fromWKT( NAD1983_TO_AkAlb_Transformation.replace( "'False_Easting',0.0", "'False_Easting',1.0" ) )
+	with pytest.raises( ProjectionAccuracyException ):
+		wrong.validate( ALASKA_ALBERS_REFERENCE )
@@ -0,0 +1,47 @@
+# Checks GridThinner against a brute force thinning of the same points. Run with pytest
+import numpy as np
+import pytest
+from GridThinning import GridThinner, THIN_METHODS
+
+# Thins points one cell at a time with a Python loop: the slow, obvious version of GridThinner
+def bruteForce( X, Y, Z, OID, cell_size, method ):
+	cells = dict()
+	for row in range( len( X ) ):
+		cells.setdefault( ( int( np.floor( X[row] / cell_size ) ), int( np.floor( Y[row] / cell_size ) ) ), list() ).append( row )
+	kept = dict()
+	for ( cell, rows ) in cells.items():
+		if method == 'centre':
+			centre = ( ( cell[0] + 0.5 ) * cell_size, ( cell[1] + 0.5 ) * cell_size )
+			rank = lambda row: ( X[row] - centre[0] ) ** 2 + ( Y[row] - centre[1] ) ** 2
+		elif method == 'max':
+			rank = lambda row: -Z[row]
+		else:
+			rank = lambda row: Z[row]
+		rows = sorted( rows, key=lambda row: ( rank( row ), OID[row] ) )
+		chosen = rows[( len( rows ) - 1 ) // 2] if method == 'median' else rows[0]
+		kept[int( OID[chosen] )] = len( rows )
+	return kept
+
+@pytest.mark.parametrize( 'method', THIN_METHODS )
+def test_matches_brute_force( method ):
+	rng = np.random.default_rng( 0 )
+	n = 5000
+	# Integer depths, so that cells hold ties which must go to the smallest OID
+	( X, Y, Z, OID ) = ( rng.uniform( -500, 500, n ), rng.uniform( -500, 500, n ), rng.integers( 0, 20, n ).astype( np.float64 ), np.arange( 1, n + 1 ) )
+	thinner = GridThinner( 50.0, method )
+	# Chunks of uneven size, so that cells are split across chunks and compactions
+	for ( start, stop ) in ( ( 0, 7 ), ( 7, 1200 ), ( 1200, 1201 ), ( 1201, n ) ):
+		thinner.add( X[start:stop], Y[start:stop], Z[start:stop], OID[start:stop] )
+	points = thinner.finish()
+	expected = bruteForce( X, Y, Z, OID, 50.0, method )
+	assert thinner.size == n
+	assert thinner.getCellCount() == len( expected )
+	assert dict( zip( points['oid'].tolist(), points['count'].tolist() ) ) == expected
+	assert int( points['count'].sum() ) == n
+
+def test_nan_points_are_ignored():
+	thinner = GridThinner( 10.0 )
+	thinner.add( [1.0, np.nan, 2.0, 25.0], [1.0, 1.0, 2.0, 5.0], [3.0, 1.0, np.nan, 4.0], [1, 2, 3, 4] )
+	points = thinner.finish()
+	assert sorted( points['oid'].tolist() ) == [1, 4]
+	assert points['count'].tolist() == [1, 1]
@@ -0,0 +1,77 @@
+# Checks that re-running an import skips unchanged and touched files, and imports a changed file afresh. Run with pytest
+import os
+import numpy as np
+from ImportManifest import ImportManifest, NEW, UNCHANGED, TOUCHED, CHANGED
+from DataImporter import SQLiteDataImporter
+from DataProcessor import SQLiteDataProcessor
+from GridThinning import thinnedTableName
+from PointCache import cachePath, openPointCache
+from SpatialTileIndex import SpatialTileIndex, tileIndexDir
+
+# Writes a tab separated XYZ file of points packed into a few square kilometres of Alaska, so that thinning on a 1 km grid keeps far fewer of them
+def writeXYZ( fp, num_points, seed ):
+	rng = np.random.default_rng( seed )
+	with open( fp, 'w' ) as writer:
+		for ( x, y, z ) in zip( rng.uniform( -150.0, -149.95, num_points ), rng.uniform( 61.0, 61.03, num_points ), rng.uniform( -100.0, -10.0, num_points ) ):
+			writer.write( "%.6f\t%.6f\t%.2f\n" % ( x, y, z ) )
+
+# One run of the importer, as a fresh process would make it
+def runImport( tmp_path ):
+	importer = SQLiteDataImporter( str( tmp_path / 'out.gpkg' ), cache_dir=str( tmp_path / 'cache' ), manifest_fp=str( tmp_path / 'manifest.sqlite' ) )
+	importer.importFilesFromDir( str( tmp_path / 'data' ) )
+	return importer
+
+def classify( tmp_path, fp ):
+	manifest = ImportManifest( str( tmp_path / 'manifest.sqlite' ) )
+	try:
+		return manifest.classify( fp )[0]
+	finally:
+		manifest.close()
+
+def test_reimport_only_changed_files( tmp_path ):
+	os.mkdir( str( tmp_path / 'data' ) )
+	fp = str( tmp_path / 'data' / 'a.xyz' )
+	cache_dir = str( tmp_path / 'cache' )
+	thin = thinnedTableName( 'a' )
+	writeXYZ( fp, 500, 0 )
+	assert classify( tmp_path, fp ) == NEW
+
+	# First run: imported, then processed into a projected, indexed and thinned table
+	importer = runImport( tmp_path )
+	assert importer.storage.getCount( 'a' ) == 500
+	assert classify( tmp_path, fp ) == UNCHANGED
+	processor = SQLiteDataProcessor( str( tmp_path / 'out.gpkg' ), cache_dir=cache_dir, thin_on=True, thin_cell_size=1000.0 )
+	processor.processTables()
+	processor.tpr.flush()
+	assert processor.tpr.getValue( 'a', 'is_proj' ) == 1
+	assert processor.storage.tableExists( thin ) and thin in processor.tpr
+	assert SpatialTileIndex( tileIndexDir( cache_dir ) ).hasTable( 'a' )
+
+	# Unchanged: skipped without touching the table or its record
+	importer = runImport( tmp_path )
+	assert importer.tpr.getValue( 'a', 'is_proj' ) == 1
+	assert thin in importer.tpr
+
+	# Touched: the new modification time is recorded, and nothing is imported
+	stat = os.stat( fp )
+	os.utime( fp, ns=( stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9 ) )
+	assert classify( tmp_path, fp ) == TOUCHED
+	importer = runImport( tmp_path )
+	assert importer.tpr.getValue( 'a', 'is_proj' ) == 1
+	assert thin in importer.tpr
+	assert classify( tmp_path, fp ) == UNCHANGED
+
+	# Changed: the old table, its thinned copy, their caches, index entries and TPR rows are all dropped, and the file is imported afresh
+	writeXYZ( fp, 300, 1 )
+	assert classify( tmp_path, fp ) == CHANGED
+	importer = runImport( tmp_path )
+	assert importer.storage.getCount( 'a' ) == 300
+	assert importer.tpr.getValue( 'a', 'is_proj' ) == 0
+	assert not importer.storage.tableExists( thin )
+	assert thin not in importer.tpr
+	assert not os.path.exists( cachePath( cache_dir, thin ) )
+	cache = openPointCache( cache_dir, 'a' )
+	assert len( cache ) == 300
+	cache.close()
+	assert not SpatialTileIndex( tileIndexDir( cache_dir ) ).hasTable( 'a' )
+	assert classify( tmp_path, fp ) == UNCHANGED
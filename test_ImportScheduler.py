@@ -0,0 +1,45 @@
+# Checks the order the ImportScheduler hands files to its workers. Run with pytest
+import time
+from ImportScheduler import ImportScheduler, ImportTask, MIN_BATCH_BYTES
+
+# Stands in for a worker's TableProcessingRecord, which runBatch flushes after every batch
+class NullRecord( object ):
+	def flush( self ):
+		pass
+
+# Stands in for a DataImporter in the workers: importing a file only takes a little time
+class SleepingImporter( object ):
+	def __init__( self, seconds ):
+		self.seconds = seconds
+		self.tpr = NullRecord()
+
+	def importFile( self, path ):
+		time.sleep( self.seconds )
+
+	def getWorkerConfig( self ):
+		return ( SleepingImporter, { 'seconds':self.seconds } )
+
+def test_stream_hands_out_the_largest_waiting_file_first():
+	# Every file fills a batch of its own. The largest is found last
+	sizes = [MIN_BATCH_BYTES * ( 2 + n ) for n in range( 8 )] + [MIN_BATCH_BYTES * 100]
+	tasks = [ImportTask( 'file%d' % n, size ) for ( n, size ) in enumerate( sizes )]
+	scheduler = ImportScheduler( SleepingImporter( 0.05 ), 1 )
+	try:
+		report = scheduler.runStream( iter( tasks ) )
+	finally:
+		scheduler.close()
+	order = [result.path for result in report['results']]
+	# The first two go out as soon as they are found, one running and one queued behind it. The rest wait, and go out largest first
+	assert order[:2] == ['file0', 'file1']
+	assert order[2:] == ['file%d' % n for n in ( 8, 7, 6, 5, 4, 3, 2 )]
+	assert all( result.error == None for result in report['results'] )
+	assert len( report['utilization'] ) == 1
+
+def test_small_files_are_batched():
+	tasks = [ImportTask( 'file%d' % n, MIN_BATCH_BYTES // 4 ) for n in range( 12 )]
+	scheduler = ImportScheduler( SleepingImporter( 0.0 ), 2 )
+	try:
+		report = scheduler.runStream( iter( tasks ) )
+	finally:
+		scheduler.close()
+	assert sorted( result.path for result in report['results'] ) == sorted( task.path for task in tasks )
@@ -0,0 +1,54 @@
+# Checks the residual engines of KNearestNeighborModel against each other. Run with pytest
+import numpy as np
+import pytest
+from KNearestNeighborModel import KNNModel, TiledKNNModel
+
+# Returns a function( xmin, ymin, xmax, ymax ) reading the points of XYZ inside a box, for use as the READ_BOX of a TiledKNNModel
+def boxReader( XYZ ):
+	def readBox( xmin, ymin, xmax, ymax ):
+		inside = ( XYZ[:, 0] >= xmin ) & ( XYZ[:, 0] < xmax ) & ( XYZ[:, 1] >= ymin ) & ( XYZ[:, 1] < ymax )
+		return XYZ[inside]
+	return readBox
+
+# Returns the residuals of a tiled model in the order of the points of XYZ, matched up by the fourth column (the point's index)
+def tiledResiduals( XYZ, tile_size, num_nn ):
+	POINTS = np.column_stack( ( XYZ, np.arange( len( XYZ ) ) ) )
+	EXTENT = ( XYZ[:, 0].min(), XYZ[:, 1].min(), XYZ[:, 0].max(), XYZ[:, 1].max() )
+	RESULTS = np.concatenate( list( TiledKNNModel( boxReader( POINTS ), EXTENT, tile_size, num_nn ).CalculateAllResiduals( workers=1 ) ) )
+	RESIDUALS = np.empty( len( XYZ ) )
+	RESIDUALS[RESULTS[:, 3].astype( np.int64 )] = RESULTS[:, 4]
+	assert len( RESULTS ) == len( XYZ )
+	return RESIDUALS
+
+def uniformPoints( n, seed=0 ):
+	rng = np.random.default_rng( seed )
+	return np.column_stack( ( rng.uniform( 0, 1000, n ), rng.uniform( 0, 1000, n ), rng.normal( 0, 5, n ) ) )
+
+# A handful of points far away from a larger cluster: no tile or halo around the small cluster holds K points until it reaches the large one
+def clusteredPoints( seed=0 ):
+	rng = np.random.default_rng( seed )
+	SMALL = np.column_stack( ( rng.uniform( 0, 10, 5 ), rng.uniform( 0, 10, 5 ), rng.normal( 0, 5, 5 ) ) )
+	LARGE = np.column_stack( ( rng.uniform( 5000, 5100, 100 ), rng.uniform( 5000, 5100, 100 ), rng.normal( 50, 5, 100 ) ) )
+	return np.concatenate( ( SMALL, LARGE ) )
+
+def test_batch_matches_per_point():
+	XYZ = uniformPoints( 3000 )
+	KNNM = KNNModel( XYZ, 0, 1, 2, NUM_NN=20 )
+	BATCH = KNNM.CalculateAllResidualsBatch( workers=1 )
+	PER_POINT = KNNM.CalculateAllResiduals( KNNM.data )
+	assert np.allclose( BATCH, np.asarray( PER_POINT ) )
+
+@pytest.mark.parametrize( 'XYZ, tile_size, num_nn', [
+	( uniformPoints( 4000 ), 150.0, 30 ),
+	( uniformPoints( 300, seed=1 ), 100.0, 25 ), # Sparse: most tiles hold fewer than K points
+	( clusteredPoints(), 500.0, 10 ),
+] )
+def test_tiled_matches_in_memory( XYZ, tile_size, num_nn ):
+	EXPECTED = KNNModel( XYZ, 0, 1, 2, NUM_NN=num_nn ).CalculateAllResidualsBatch( workers=1 )[:, 3]
+	assert np.allclose( tiledResiduals( XYZ, tile_size, num_nn ), EXPECTED )
+
+# The leaf size must not grow with the table: large leaves make every query scan thousands of points
+def test_leaf_size_does_not_grow_with_the_table():
+	from KNearestNeighborModel import LEAF_SIZE
+	assert KNNModel( uniformPoints( 100 ), 0, 1, 2 ).KD.leafsize == LEAF_SIZE
+	assert KNNModel( uniformPoints( 200000 ), 0, 1, 2 ).KD.leafsize == LEAF_SIZE
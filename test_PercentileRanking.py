@@ -0,0 +1,41 @@
+# Checks the external ranker against the in-memory one. Run with pytest
+import numpy as np
+import pytest
+import PercentileRanking
+from PercentileRanking import rankDescending, ranksToPercentiles, ExternalRanker
+
+def externalRanks( Z, chunk, temp_dir ):
+	ranker = ExternalRanker( str( temp_dir ) )
+	try:
+		for start in range( 0, len( Z ), chunk ):
+			ranker.addRun( Z[start:start + chunk] )
+		return np.concatenate( [ranker.rank( Z[start:start + chunk] ) for start in range( 0, len( Z ), chunk )] )
+	finally:
+		ranker.close()
+
+@pytest.mark.parametrize( 'order', ['random', 'ascending', 'descending'] )
+@pytest.mark.parametrize( 'chunk', [7, 97, 1000, 5000] )
+def test_external_ranks_match_in_memory( tmp_path, monkeypatch, order, chunk ):
+	# A small merge block, so the runs are merged over many rounds
+	monkeypatch.setattr( PercentileRanking, 'MERGE_BLOCK_VALUES', 64 )
+	rng = np.random.default_rng( 0 )
+	# Whole depths, so that many points tie
+	Z = rng.integers( 0, 200, 3000 ).astype( np.float64 )
+	if order != 'random':
+		Z = np.sort( Z ) if order == 'ascending' else np.sort( Z )[::-1].copy()
+	expected = rankDescending( Z )
+	assert np.array_equal( externalRanks( Z, chunk, tmp_path ), expected )
+	# Ties get the same percentile
+	percentiles = ranksToPercentiles( expected, len( Z ) )
+	for depth in np.unique( Z ):
+		assert len( np.unique( percentiles[Z == depth] ) ) == 1
+
+def test_runs_are_replaced_by_one_merged_file( tmp_path ):
+	Z = np.random.default_rng( 1 ).normal( 0, 1, 1000 )
+	ranker = ExternalRanker( str( tmp_path ) )
+	for start in range( 0, 1000, 100 ):
+		ranker.addRun( Z[start:start + 100] )
+	ranker.rank( Z[:10] )
+	assert len( ranker.runs ) == 1
+	assert np.array_equal( ranker.rank( Z ), rankDescending( Z ) )
+	ranker.close()
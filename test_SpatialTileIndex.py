@@ -0,0 +1,47 @@
+# Checks the spatial tile index against the in-memory residual engine. Run with pytest
+import os
+import numpy as np
+from SpatialTileIndex import SpatialTileIndex
+from KNearestNeighborModel import KNNModel
+
+def randomTable( rng, n, xmin, ymin, width, height ):
+	return ( rng.uniform( xmin, xmin + width, n ), rng.uniform( ymin, ymin + height, n ), rng.normal( 0, 5, n ), np.arange( 1, n + 1 ) )
+
+def test_read_box_matches_a_scan( tmp_path ):
+	rng = np.random.default_rng( 0 )
+	( X, Y, Z, OID ) = randomTable( rng, 5000, -3000, -2000, 9000, 7000 )
+	index = SpatialTileIndex( str( tmp_path ), tile_size=1000.0 )
+	index.addTable( 'a', X, Y, Z, OID )
+	# One cache and one JSON file, however many tiles the points spread over
+	assert sorted( os.listdir( os.path.join( str( tmp_path ), 'tables' ) ) ) == ['a.drpc', 'a.json']
+	for ( xmin, ymin, xmax, ymax ) in ( ( -500, -500, 1500, 2500 ), ( -1e9, -1e9, 1e9, 1e9 ), ( 10000, 10000, 20000, 20000 ) ):
+		points = index.readBox( xmin, ymin, xmax, ymax )
+		inside = ( X >= xmin ) & ( X < xmax ) & ( Y >= ymin ) & ( Y < ymax )
+		assert sorted( points[:, 3].astype( np.int64 ).tolist() ) == sorted( OID[inside].tolist() )
+
+def test_residuals_match_in_memory( tmp_path ):
+	rng = np.random.default_rng( 1 )
+	# A dense survey, a sparse one overlapping it, and a small cluster far from both, so some tiles hold fewer than K points
+	tables = { 'dense':randomTable( rng, 3000, 0, 0, 3000, 3000 ), 'sparse':randomTable( rng, 200, 1000, 1000, 8000, 8000 ), 'cluster':randomTable( rng, 6, 20000, 20000, 50, 50 ) }
+	index = SpatialTileIndex( str( tmp_path ), tile_size=1000.0 )
+	for ( table, ( X, Y, Z, OID ) ) in tables.items():
+		index.addTable( table, X, Y, Z, OID )
+	ALL = np.concatenate( [np.column_stack( ( X, Y, Z ) ) for ( X, Y, Z, OID ) in tables.values()] )
+	EXPECTED = KNNModel( ALL, 0, 1, 2, NUM_NN=20 ).CalculateAllResidualsBatch( workers=1 )[:, 3]
+	start = 0
+	for ( table, ( X, Y, Z, OID ) ) in tables.items():
+		results = np.concatenate( list( index.calculateResiduals( table, NUM_NN=20, workers=1 ) ) )
+		assert len( results ) == len( X )
+		residuals = np.empty( len( X ) )
+		residuals[results[:, 3].astype( np.int64 ) - 1] = results[:, 4]
+		assert np.allclose( residuals, EXPECTED[start:start + len( X )] )
+		start += len( X )
+
+def test_remove_table( tmp_path ):
+	rng = np.random.default_rng( 2 )
+	index = SpatialTileIndex( str( tmp_path ), tile_size=1000.0 )
+	index.addTable( 'a', *randomTable( rng, 100, 0, 0, 5000, 5000 ) )
+	index.addTable( 'b', *randomTable( rng, 100, 0, 0, 5000, 5000 ) )
+	assert index.removeTable( 'a' )
+	assert index.getTables() == ['b']
+	assert len( index.readBox( -1e9, -1e9, 1e9, 1e9 ) ) == 100
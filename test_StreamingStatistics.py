@@ -0,0 +1,80 @@
+# Checks StreamingStatistics against NumPy and Counter on the same values. Run with pytest
+from collections import Counter
+import numpy as np
+import pytest
+from StreamingStatistics import StreamingStatistics
+
+# Depths with a wide spread far from zero, where a naive sum of squares loses precision, and some NaNs
+def depths( n=100000, seed=0 ):
+	rng = np.random.default_rng( seed )
+	Z = rng.normal( -4000.0, 25.0, n )
+	Z[rng.random( n ) < 0.01] = np.nan
+	return Z
+
+# Chunks of uneven size, including an empty one and one of a single value
+def split( Z ):
+	return np.split( Z, [0, 1, 7, 5000, 5001, 60000] )
+
+def test_chunks_match_numpy():
+	Z = depths()
+	stats = StreamingStatistics()
+	for chunk in split( Z ):
+		stats.update( chunk )
+	kept = Z[~np.isnan( Z )]
+	assert stats.getCount() == len( kept )
+	assert stats.getMean() == pytest.approx( np.mean( kept ), rel=1e-12 )
+	assert stats.getStdDev() == pytest.approx( np.std( kept ), rel=1e-9 )
+
+# One accumulator per chunk, as separate workers would build them, merged at the end
+def test_merged_accumulators_match_numpy():
+	Z = depths( seed=1 )
+	merged = StreamingStatistics()
+	for chunk in split( Z ):
+		part = StreamingStatistics()
+		part.update( chunk )
+		merged.merge( part )
+	kept = Z[~np.isnan( Z )]
+	assert merged.getCount() == len( kept )
+	assert merged.getMean() == pytest.approx( np.mean( kept ), rel=1e-12 )
+	assert merged.getStdDev() == pytest.approx( np.std( kept ), rel=1e-9 )
+
+def test_merge_rejects_other_bin_widths():
+	with pytest.raises( ValueError ):
+		StreamingStatistics( 0.1 ).merge( StreamingStatistics( 0.5 ) )
+
+def test_nothing_added_gives_none():
+	stats = StreamingStatistics()
+	stats.update( np.array( [] ) )
+	stats.update( np.array( [np.nan, np.nan] ) )
+	assert stats.getCount() == 0
+	assert ( stats.getMean(), stats.getStdDev(), stats.getMedian(), stats.getMode() ) == ( None, None, None, None )
+
+# An empty table leaves every statistic in the TPR as None
+def test_empty_table_records_none( tmp_path ):
+	from DataProcessor import SQLiteDataProcessor
+	processor = SQLiteDataProcessor( str( tmp_path / 'empty.gpkg' ) )
+	processor.storage.createTable( 'empty', ( ( 'x', 'DOUBLE', None ), ( 'y', 'DOUBLE', None ), ( 'z', 'DOUBLE', None ) ) )
+	processor.tpr.addTable( 'empty' )
+	processor.calculateTableStatistics( 'empty' )
+	assert [processor.tpr.getValue( 'empty', field ) for field in ( 'tbl_mean', 'tbl_std_dev', 'tbl_med', 'tbl_mode' )] == [None, None, None, None]
+
+# Depths to the centimetre, so that values repeat
+def test_exact_mode_matches_counter():
+	rng = np.random.default_rng( 2 )
+	Z = np.round( rng.normal( -100.0, 3.0, 50000 ), 2 )
+	stats = StreamingStatistics( exact_mode=True )
+	for chunk in split( Z ):
+		stats.update( chunk )
+	counts = Counter( Z.tolist() )
+	# Several values may share the highest count, and any of them is a mode
+	assert counts[stats.getMode()] == max( counts.values() )
+
+@pytest.mark.parametrize( 'bin_width', ( 0.01, 0.1, 1.0 ) )
+def test_median_within_one_bin( bin_width ):
+	Z = depths( seed=3 )
+	stats = StreamingStatistics( bin_width )
+	for chunk in split( Z ):
+		stats.update( chunk )
+	kept = np.sort( Z[~np.isnan( Z )] )
+	assert abs( stats.getMedian() - kept[len( kept ) // 2] ) <= bin_width
+	assert abs( stats.getMedian() - np.median( kept ) ) <= bin_width
@@ -0,0 +1,55 @@
+# Checks that empty points are dropped from XYZ files, both by the importer's cleaning pass and by the streaming reader. Run with pytest
+import numpy as np
+import pytest
+from XYZReader import readXYZChunks
+from DataImporter import SQLiteDataImporter
+
+# The usable points of the fixture, in file order
+KEPT = [( -150.5, 61.25, -12.5 ), ( -150.25, 61.5, -40.0 ), ( -151.0, 60.75, 0.0 ), ( -149.75, 61.0, -3.25 )]
+# Blank lines, blank and NaN depths, a NaN position, and lines which are not points at all, between the usable ones
+LINES = [
+	"-150.5\t61.25\t-12.5\n",
+	"\n",
+	"-150.0\t61.0\t\n",
+	"-150.0\t61.0\tnan\n",
+	"-150.25\t61.5\t-40.0\n",
+	"   \n",
+	"-150.0\t61.0\tNaN\n",
+	"nan\t61.0\t-5.0\n",
+	"-150.0\t61.0\n",
+	"x\ty\tz\n",
+	"-151.0\t60.75\t0.0\n",
+	"-150.0\t61.0\tNAN\n",
+	"-149.75\t61.0\t-3.25" ]
+
+@pytest.fixture
+def xyz( tmp_path ):
+	fp = str( tmp_path / 'points.xyz' )
+	with open( fp, 'w' ) as writer:
+		writer.write( "".join( LINES ) )
+	return fp
+
+def test_clean_file_keeps_only_usable_rows( xyz, tmp_path ):
+	importer = SQLiteDataImporter( str( tmp_path / 'out.gpkg' ) )
+	dropped = importer.deleteEmptyPoints( xyz )
+	assert dropped == { 'blank':2, 'malformed':3, 'nan':4 }
+	with open( xyz ) as reader:
+		rows = [tuple( float( value ) for value in line.split( '\t' ) ) for line in reader]
+	assert rows == KEPT
+	# A clean file is left alone
+	assert importer.deleteEmptyPoints( xyz ) == { 'blank':0, 'malformed':0, 'nan':0 }
+
+# Chunks small enough that the dropped rows land in different chunks, and some chunks lose every row
+@pytest.mark.parametrize( 'chunk_size', ( 1, 2, 5, 100 ) )
+def test_stream_keeps_only_usable_rows( xyz, chunk_size ):
+	chunks = list( readXYZChunks( xyz, chunk_size ) )
+	assert all( len( X ) > 0 for ( X, Y, Z ) in chunks )
+	points = np.concatenate( [np.column_stack( chunk ) for chunk in chunks] )
+	assert points.tolist() == [list( point ) for point in KEPT]
+
+def test_import_writes_only_usable_rows( xyz, tmp_path ):
+	importer = SQLiteDataImporter( str( tmp_path / 'out.gpkg' ) )
+	importer.importXYZFile( xyz )
+	assert importer.storage.getCount( 'points' ) == len( KEPT )
+	columns = importer.storage.readColumns( 'points', ['x', 'y', 'z'] )
+	assert np.column_stack( ( columns['x'], columns['y'], columns['z'] ) ).tolist() == [list( point ) for point in KEPT]